@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+"""Measure record creation throughput with and without caller lookup.
+
+Logs through a logger without handlers, so the numbers show the cost
+of finding the caller and creating the record. Compares the earlier
+findCaller, which normalized the filename of every frame, with the
+cached lookup, lookup for WARNING and above only and no lookup at all.
+
+    python benchmarks/bench_caller.py [iterations]
+"""
+
+import logging
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from distlog.logger import context  # noqa: E402
+
+
+class LegacyLogger(context.Logger):
+
+    """Logger finding the caller the way it used to."""
+
+    def findCaller(self, stack_info=False, stacklevel=1):
+        f = logging.currentframe()
+        if f is not None:
+            f = f.f_back
+        rv = "(unknown file)", 0, "(unknown function)", None
+        while hasattr(f, "f_code"):
+            co = f.f_code
+            filename = os.path.normcase(co.co_filename)
+            if filename in context._srcfiles:
+                f = f.f_back
+                continue
+            rv = (co.co_filename, f.f_lineno, co.co_name, None)
+            break
+        return rv
+
+
+def nested(logger, depth):
+    """Log from `depth` frames deep, like an application would."""
+    if depth:
+        return nested(logger, depth - 1)
+    logger.info('order %s shipped', 12345)
+
+
+def measure(logger, iterations):
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    logger.addHandler(logging.NullHandler())
+    elapsed = timeit.timeit(lambda: nested(logger, 5), number=iterations)
+    return iterations / elapsed
+
+
+def main(iterations=100000):
+    legacy = LegacyLogger('legacy')
+    always = context.Logger('always')
+    warning = context.Logger('warning')
+    warning.set_caller_level(logging.WARNING)
+    never = context.Logger('never')
+    never.set_caller_level(None)
+    for name, logger in (('legacy findCaller', legacy),
+                         ('cached findCaller', always),
+                         ('WARNING and above', warning),
+                         ('no caller lookup', never)):
+        print('{:<20} {:>10.0f} records/s'.format(
+            name, measure(logger, iterations)))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
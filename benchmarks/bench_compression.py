@@ -0,0 +1,61 @@
+#!/usr/bin/python3
+"""Measure compression ratio and throughput per zlib level.
+
+Compresses batches of JSON encoded records, as produced by a batching
+ZmqHandler, at every zlib level and reports the size reduction and the
+number of records per second the compressor and decompressor handle.
+
+    python benchmarks/bench_compression.py [batch size] [iterations]
+"""
+
+import logging
+import os
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import distlog  # noqa: E402
+from distlog.logger.compression import ZlibCodec  # noqa: E402
+from distlog.logger.formatters import LEAN_FIELDS  # noqa: E402
+
+
+def make_batch(size):
+    fmt = distlog.JSONFormatter(fields=LEAN_FIELDS)
+    parts = []
+    for i in range(size):
+        record = logging.LogRecord(
+            'app.service', logging.INFO, '/srv/app/service/handlers.py',
+            100 + i % 7, 'processed %s in %d ms', ('order-%d' % i, i % 50),
+            None, 'handle'
+        )
+        record.context = {'key': '%d@6f1c2a9e-0d4b/2/1' % i, 'user': 'leo'}
+        body = fmt.serialize(fmt._extract_record(record))
+        parts.append(struct.pack('!I', len(body)) + body)
+    return b''.join(parts)
+
+
+def main(batch_size=100, iterations=200):
+    batch = make_batch(batch_size)
+    records = batch_size * iterations
+    print('batch of {} records, {} bytes'.format(batch_size, len(batch)))
+    print('{:>5} {:>8} {:>7} {:>14} {:>14}'.format(
+        'level', 'bytes', 'ratio', 'compress r/s', 'decompress r/s'))
+    for level in range(0, 10):
+        codec = ZlibCodec(level)
+        start = time.time()
+        for _ in range(iterations):
+            compressed = codec.compress(batch)
+        compress = time.time() - start
+        start = time.time()
+        for _ in range(iterations):
+            codec.decompress(compressed)
+        decompress = time.time() - start
+        print('{:>5} {:>8} {:>7.2f} {:>14.0f} {:>14.0f}'.format(
+            level, len(compressed), float(len(batch)) / len(compressed),
+            records / compress, records / decompress))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
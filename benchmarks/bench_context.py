@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+"""Measure LogRecord creation cost against task nesting depth.
+
+Creates records inside 1 to 8 nested tasks, once with Task and once
+with a copy of the earlier Task implementation that recomputed the id
+recursively and copied the task data for every record.
+
+    python benchmarks/bench_context.py [iterations]
+"""
+
+import logging
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from distlog.logger import context  # noqa: E402
+
+
+class LegacyTask(context.Task):
+
+    """Task computing its id and context the way it used to."""
+
+    @property
+    def id(self):
+        if self.parent:
+            return '{0}/{1}'.format(self.parent, self._id)
+        else:
+            return self._id
+
+    @property
+    def context(self):
+        data = {
+            'key': '{0}@{1}'.format(self.counter, self.id)
+        }
+        self.counter += 1
+        data.update(self.data)
+        return data
+
+
+def measure(task_class, depth, iterations):
+    logger = logging.getLogger('bench')
+    for level in range(depth):
+        context._context.push(task_class(
+            'a1b2c3d4-e5f6' if level == 0 else level, 'level %d', level,
+            user='leo', request='GET /orders', level=level
+        ))
+    try:
+        elapsed = timeit.timeit(
+            lambda: logger.makeRecord('bench', logging.INFO, __file__, 1,
+                                      'msg', None, None),
+            number=iterations
+        )
+    finally:
+        for _ in range(depth):
+            context._context.pop()
+    return elapsed / iterations * 1e6
+
+
+def main(iterations=50000):
+    print('{:>5} {:>12} {:>12}'.format('depth', 'legacy us', 'task us'))
+    for depth in range(1, 9):
+        print('{:>5} {:>12.2f} {:>12.2f}'.format(
+            depth,
+            measure(LegacyTask, depth, iterations),
+            measure(context.Task, depth, iterations)))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
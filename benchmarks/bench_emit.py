@@ -0,0 +1,110 @@
+#!/usr/bin/python3
+"""Measure the cost of sending batches with ZmqHandler.
+
+Compares the buffer reusing, zero-copy batch path of ZmqHandler with
+the previous approach that built a list of length headers and encoded
+records and joined them into a new body for every batch.
+
+For both it reports the time per record, the transient memory allocated
+per record while sending and how many batch buffers were allocated and
+reused. The join path allocates a new body for every batch. Records are
+encoded as JSON and as MessagePack, which is encoded straight into the
+batch buffer.
+
+    python benchmarks/bench_emit.py [batch size] [batches]
+"""
+
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+import zmq
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import distlog  # noqa: E402
+from distlog.logger.formatters import LEAN_FIELDS  # noqa: E402
+from distlog.logger.handler import BATCH_HEADER, TOPIC_BATCH  # noqa: E402
+
+
+def make_records(count):
+    records = []
+    for i in range(count):
+        record = logging.LogRecord(
+            'app.service', logging.INFO, '/srv/app/service/handlers.py',
+            100, 'processed %s', ('x' * 200,), None, 'handle'
+        )
+        record.context = {'key': '%d@6f1c2a9e/2/1' % i, 'user': 'leo'}
+        records.append(record)
+    return records
+
+
+def join_batch(handler, records):
+    """The batch path before buffers were reused."""
+    parts = []
+    for record in records:
+        bmsg = handler._format(record)
+        parts.append(BATCH_HEADER.pack(len(bmsg)))
+        parts.append(bmsg)
+    btopic = (handler.log_topic + TOPIC_BATCH).encode('ascii')
+    handler.socket.send_multipart([btopic, b''.join(parts)])
+
+
+def run(name, send, handler, sink, records, batches):
+    send(records)
+    sink.recv_multipart()
+
+    start = time.time()
+    for _ in range(batches):
+        send(records)
+        sink.recv_multipart()
+    elapsed = time.time() - start
+
+    tracemalloc.start()
+    transient = 0
+    for _ in range(batches):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        send(records)
+        transient += tracemalloc.get_traced_memory()[1] - before
+        sink.recv_multipart()
+    tracemalloc.stop()
+
+    count = batches * len(records)
+    pool = handler._frames
+    print('{:<18} {:>10.2f} {:>16.0f} {:>10} {:>10}'.format(
+        name, elapsed / count * 1e6, float(transient) / count,
+        pool.allocated, pool.reused))
+
+
+def main(batch_size=500, batches=200):
+    ctx = zmq.Context()
+    sink = ctx.socket(zmq.PULL)
+    sink.bind('inproc://bench')
+    records = make_records(batch_size)
+
+    print('{:<18} {:>10} {:>16} {:>10} {:>10}'.format(
+        'path', 'us/record', 'bytes/record', 'allocated', 'reused'))
+    for encoding, formatter in (('json', distlog.JSONFormatter),
+                                ('msgpack', distlog.MsgPackFormatter)):
+        for name, threshold in (('join', None), ('copy', 1 << 30),
+                                ('zero-copy', 0)):
+            handler = distlog.ZmqHandler(
+                'inproc://bench', ctx, zero_copy_threshold=threshold or 0)
+            handler.setFormatter(formatter(fields=LEAN_FIELDS))
+            if threshold is None:
+                def send(records, handler=handler):
+                    join_batch(handler, records)
+            else:
+                send = handler._send_batch
+            run(encoding + ' ' + name, send, handler, sink, records, batches)
+            handler.socket.close()
+
+    sink.close()
+    ctx.term()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,61 @@
+#!/usr/bin/python3
+"""Compare the size and speed of the distlog serializers.
+
+Encodes a typical LogRecord with each formatter and decodes the
+result with the matching distlogd decoder.
+
+    python benchmarks/bench_formatters.py [iterations]
+"""
+
+import logging
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import distlog  # noqa: E402
+from distlog.logger.formatters import LEAN_FIELDS  # noqa: E402
+from distlogd import codec  # noqa: E402
+
+FORMATTERS = [
+    ('json', distlog.JSONFormatter()),
+    ('pickle', distlog.PickleFormatter()),
+    ('msgpack', distlog.MsgPackFormatter()),
+    ('json lean', distlog.JSONFormatter(fields=LEAN_FIELDS)),
+    ('pickle lean', distlog.PickleFormatter(fields=LEAN_FIELDS)),
+    ('msgpack lean', distlog.MsgPackFormatter(fields=LEAN_FIELDS)),
+]
+
+
+def make_record():
+    record = logging.LogRecord(
+        'app.service', logging.INFO, '/srv/app/service/handlers.py', 120,
+        'processed %s in %d ms', ('order-4711', 12), None, 'handle'
+    )
+    record.context = {
+        'key': '3@6f1c2a9e-0d4b-4b43-9a53-2f7a1c0b9e11/2/1',
+        'user': 'leo',
+        'request': 'GET /orders/4711',
+    }
+    return record
+
+
+def main(iterations=20000):
+    print('{:<18} {:>6} {:>12} {:>12}'.format(
+        'formatter', 'bytes', 'encode us', 'decode us'))
+    record = make_record()
+    for name, fmt in FORMATTERS:
+        head = ('PL' + fmt.encoding).encode()
+        body = fmt.format(record)
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        encode = timeit.timeit(lambda: fmt.format(record), number=iterations)
+        decode = timeit.timeit(lambda: codec.decode(head, body), number=iterations)
+        print('{:<18} {:>6} {:>12.2f} {:>12.2f}'.format(
+            name, len(body),
+            encode / iterations * 1e6, decode / iterations * 1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
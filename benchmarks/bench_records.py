@@ -0,0 +1,80 @@
+#!/usr/bin/python3
+"""Measure LogRecord against CompactLogRecord in a burst.
+
+Logs a burst of records inside a task to an asynchronous ZmqHandler
+whose peer never reads, so every record stays on the queue. Reports
+the time per record and the memory held by the queued records, once
+with LogRecord and once with CompactLogRecord.
+
+    python benchmarks/bench_records.py [records]
+"""
+
+import gc
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+import zmq
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from distlog.logger import context  # noqa: E402
+from distlog.logger.formatters import JSONFormatter, LEAN_FIELDS  # noqa: E402
+from distlog.logger.handler import ZmqHandler  # noqa: E402
+
+
+class QuietHandler(ZmqHandler):
+
+    def handleError(self, record):
+        pass
+
+
+def burst(count, compact, trace):
+    ctx = zmq.Context()
+    sock = ctx.socket(zmq.PUSH)
+    sock.setsockopt(zmq.SNDTIMEO, 100)
+    sock.setsockopt(zmq.LINGER, 0)
+    handler = QuietHandler(sock, queue_size=count + 1, batch_size=100)
+    handler.setFormatter(JSONFormatter(fields=LEAN_FIELDS))
+    logger = logging.getLogger('burst')
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.handlers = [handler]
+    context.use_compact_records(compact)
+
+    gc.collect()
+    if trace:
+        tracemalloc.start()
+    try:
+        with context.task('handling request %d', 1, user='leo', size=10):
+            start = time.time()
+            for i in range(count):
+                logger.info('processed item %d of %s', i, 'batch')
+            elapsed = time.time() - start
+        held = tracemalloc.get_traced_memory()[0] if trace else 0
+    finally:
+        if trace:
+            tracemalloc.stop()
+        context.use_compact_records(False)
+        logger.handlers = []
+        while not handler._queue.empty():
+            handler._queue.get_nowait()
+            handler._queue.task_done()
+        handler.close()
+        sock.close()
+        ctx.term()
+    return elapsed / count * 1e6, held / float(count)
+
+
+def main(count=100000):
+    print('{:<18} {:>12} {:>14}'.format('record', 'us/record', 'bytes/record'))
+    for name, compact in (('LogRecord', False), ('CompactLogRecord', True)):
+        per_record, _ = burst(count, compact, False)
+        _, held = burst(count, compact, True)
+        print('{:<18} {:>12.2f} {:>14.0f}'.format(name, per_record, held))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,47 @@
+#!/usr/bin/python3
+"""Measure the cost of entering and leaving a task scope.
+
+Times ``with to(...)`` inside a toplevel task when nothing listens
+(no handler, or INFO disabled) and when a handler receives the
+messages.
+
+    python benchmarks/bench_scopes.py [iterations]
+"""
+
+import logging
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from distlog.logger import context  # noqa: E402
+
+
+def scope():
+    with context.to('step %d of %s', 1, 'job', item=1):
+        pass
+
+
+def measure(iterations):
+    with context.task('bench'):
+        elapsed = timeit.timeit(scope, number=iterations)
+    return elapsed / iterations * 1e6
+
+
+def main(iterations=100000):
+    root = logging.getLogger()
+    root.handlers = []
+    root.setLevel(logging.INFO)
+    print('{:<20} {:>10.2f} us'.format('no handler', measure(iterations)))
+
+    root.addHandler(logging.NullHandler())
+    root.setLevel(logging.WARNING)
+    print('{:<20} {:>10.2f} us'.format('INFO disabled', measure(iterations)))
+
+    root.setLevel(logging.INFO)
+    print('{:<20} {:>10.2f} us'.format('NullHandler at INFO', measure(iterations)))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
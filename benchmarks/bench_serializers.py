@@ -0,0 +1,43 @@
+#!/usr/bin/python3
+"""Compare the JSON implementations available to distlog.
+
+Reports the backend distlog selected and, for every installed backend,
+the records encoded and decoded per second.
+
+    python benchmarks/bench_serializers.py [iterations]
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from distlog.logger import serializers  # noqa: E402
+from distlog.logger.formatters import JSONFormatter  # noqa: E402
+from bench_formatters import make_record  # noqa: E402
+
+
+def main(iterations=50000):
+    selected = serializers.json_backend
+    print('selected backend: {0}'.format(selected))
+    print('{:<12} {:>14} {:>14}'.format('backend', 'encode rec/s', 'decode rec/s'))
+    data = JSONFormatter()._extract_record(make_record())
+    try:
+        for name in serializers.available_json_backends():
+            serializers.use_json_backend(name)
+            encoding = serializers.get_encoding('J')
+            body = encoding.encode(data)
+            if not isinstance(body, bytes):
+                body = body.encode('utf-8')
+            encode = timeit.timeit(lambda: encoding.encode(data), number=iterations)
+            decode = timeit.timeit(lambda: encoding.decode(body), number=iterations)
+            print('{:<12} {:>14.0f} {:>14.0f}{}'.format(
+                name, iterations / encode, iterations / decode,
+                '  *' if name == selected else ''))
+    finally:
+        serializers.use_json_backend(selected)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,64 @@
+#!/usr/bin/python3
+"""Measure the overhead of the traced decorator per call.
+
+Calls a bare function, the same function inside a hand written
+``with to(...)`` scope and the function decorated with ``traced``,
+inside a toplevel task. Nothing listens to the task messages, so the
+numbers show the cost of the scopes themselves.
+
+    python benchmarks/bench_traced.py [iterations]
+"""
+
+import logging
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from distlog.logger import context  # noqa: E402
+from distlog.logger.tracing import traced  # noqa: E402
+
+
+def bare(a, b):
+    return a + b
+
+
+def scoped(a, b):
+    with context.to('adding', op='add'):
+        return a + b
+
+
+@traced('adding', op='add')
+def decorated(a, b):
+    return a + b
+
+
+@traced('counting', op='count')
+def counter(n):
+    for i in range(n):
+        yield i
+
+
+def measure(func, iterations):
+    with context.task('bench'):
+        elapsed = timeit.timeit(lambda: func(1, 2), number=iterations)
+    return elapsed / iterations * 1e6
+
+
+def main(iterations=200000):
+    logging.getLogger().handlers = []
+    base = measure(bare, iterations)
+    print('{:<12} {:>8.2f} us'.format('bare', base))
+    for name, func in (('with to()', scoped), ('traced', decorated)):
+        cost = measure(func, iterations)
+        print('{:<12} {:>8.2f} us  (+{:.2f} us)'.format(name, cost, cost - base))
+
+    with context.task('bench'):
+        elapsed = timeit.timeit(lambda: sum(counter(10)), number=iterations // 10)
+    print('{:<12} {:>8.2f} us per 10 steps'.format(
+        'generator', elapsed / (iterations // 10) * 1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
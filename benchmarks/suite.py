@@ -0,0 +1,340 @@
+#!/usr/bin/python3
+"""Benchmark suite for the client side of distlog.
+
+Measures logging through a ZmqHandler into a local PULL sink, over
+inproc and tcp, and the parts of that path on their own:
+
+emit
+    ``logger.info`` through a synchronous and an asynchronous handler.
+format-json, format-pickle
+    Formatting a record, no transport.
+task-depth
+    Logging inside 1, 4 and 16 nested tasks.
+find-caller
+    Logging with and without looking up the caller.
+context-size
+    Logging inside a task with 0, 10 and 100 context fields.
+
+For every case it reports the records per second, the median and 99th
+percentile latency of a single call and the memory allocated per call.
+The results are written as JSON so runs of different releases can be
+compared::
+
+    python benchmarks/suite.py --output 0.1.json
+    python benchmarks/suite.py --compare 0.1.json
+
+Timings depend on the machine: compare runs made on the same one.
+"""
+
+import argparse
+import gc
+import itertools
+import json
+import logging
+import os
+import platform
+import sys
+import threading
+import time
+import tracemalloc
+
+import zmq
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import distlog  # noqa: E402
+from distlog.logger import context, serializers  # noqa: E402
+
+TRANSPORTS = ('inproc', 'tcp')
+
+try:
+    clock = time.perf_counter
+except AttributeError:  # Python < 3.3
+    clock = time.time
+
+
+class Sink(object):
+
+    """PULL socket receiving and discarding messages on its own thread."""
+
+    # a closed socket releases its inproc address later, never reuse one
+    _ids = itertools.count()
+
+    def __init__(self, ctx, transport):
+        self.socket = ctx.socket(zmq.PULL)
+        if transport == 'inproc':
+            self.endpoint = 'inproc://suite-{0}'.format(next(self._ids))
+            self.socket.bind(self.endpoint)
+        else:
+            port = self.socket.bind_to_random_port('tcp://127.0.0.1')
+            self.endpoint = 'tcp://127.0.0.1:{0}'.format(port)
+        self.received = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        poller = zmq.Poller()
+        poller.register(self.socket, zmq.POLLIN)
+        while not self._stop.is_set():
+            if poller.poll(50):
+                self.socket.recv_multipart()
+                self.received += 1
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.socket.close(0)
+
+
+def make_record():
+    record = logging.LogRecord(
+        'app.service', logging.INFO, '/srv/app/service/handlers.py', 120,
+        'processed %s in %d ms', ('order-4711', 12), None, 'handle'
+    )
+    record.context = {'key': '3@6f1c2a9e/2/1', 'user': 'leo'}
+    return record
+
+
+def make_logger(handler):
+    logger = logging.getLogger('suite')
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.set_caller_level(logging.NOTSET)
+    return logger
+
+
+def push_tasks(depth, fields=2):
+    data = dict(('field%d' % i, 'value %d' % i) for i in range(fields))
+    for level in range(depth):
+        context._context.push(context.Task(
+            '6f1c2a9e-0d4b-4b43' if level == 0 else level,
+            'level %d', level, **data
+        ))
+
+
+def pop_tasks(depth):
+    for _ in range(depth):
+        context._context.pop()
+
+
+def case_emit(handler_kwargs):
+    def setup(endpoint, ctx):
+        handler = distlog.ZmqHandler(endpoint, ctx, **handler_kwargs)
+        handler.setFormatter(distlog.JSONFormatter())
+        logger = make_logger(handler)
+
+        def op():
+            logger.info('processed %s in %d ms', 'order-4711', 12)
+
+        def teardown():
+            handler.close()
+            handler.socket.close(0)
+        return op, teardown
+    return setup
+
+
+def case_format(formatter_class):
+    def setup(endpoint, ctx):
+        fmt = formatter_class()
+        record = make_record()
+
+        def op():
+            fmt.format(record)
+        return op, None
+    return setup
+
+
+def case_tasks(depth, fields=2, caller=True):
+    def setup(endpoint, ctx):
+        handler = distlog.ZmqHandler(endpoint, ctx)
+        handler.setFormatter(distlog.JSONFormatter())
+        logger = make_logger(handler)
+        if not caller:
+            logger.set_caller_level(None)
+        push_tasks(depth, fields)
+
+        def op():
+            logger.info('processed %s in %d ms', 'order-4711', 12)
+
+        def teardown():
+            pop_tasks(depth)
+            handler.close()
+            handler.socket.close(0)
+        return op, teardown
+    return setup
+
+
+CASES = [
+    ('emit', {'mode': 'sync'}, case_emit({})),
+    ('emit', {'mode': 'async'}, case_emit({'queue_size': 100000})),
+    ('format-json', {}, case_format(distlog.JSONFormatter)),
+    ('format-pickle', {}, case_format(distlog.PickleFormatter)),
+    ('task-depth', {'depth': 1}, case_tasks(1)),
+    ('task-depth', {'depth': 4}, case_tasks(4)),
+    ('task-depth', {'depth': 16}, case_tasks(16)),
+    ('find-caller', {'lookup': True}, case_tasks(1, caller=True)),
+    ('find-caller', {'lookup': False}, case_tasks(1, caller=False)),
+    ('context-size', {'fields': 0}, case_tasks(1, 0)),
+    ('context-size', {'fields': 10}, case_tasks(1, 10)),
+    ('context-size', {'fields': 100}, case_tasks(1, 100)),
+]
+"""Benchmark cases: name, parameters and setup function.
+
+The setup function takes the sink endpoint and 0MQ context and returns
+the operation to measure and a teardown function or None.
+"""
+
+TRANSPORT_FREE = ('format-json', 'format-pickle')
+"""Cases that do not send, they are run once instead of per transport."""
+
+
+def percentile(ordered, quantile):
+    return ordered[min(len(ordered) - 1, int(quantile * len(ordered)))]
+
+
+def measure(op, iterations):
+    """Measure an operation.
+
+    :return dict: records per second, latency percentiles in
+        microseconds and the peak of the memory allocated during a call.
+    """
+    for _ in range(min(1000, iterations)):
+        op()
+
+    gc.collect()
+    start = clock()
+    for _ in range(iterations):
+        op()
+    elapsed = clock() - start
+
+    latencies = []
+    append = latencies.append
+    for _ in range(iterations):
+        begin = clock()
+        op()
+        append(clock() - begin)
+    latencies.sort()
+
+    # memory allocated while a call runs, freed or not (Python >= 3.9)
+    count = min(1000, iterations)
+    allocated = 0
+    tracemalloc.start()
+    for _ in range(count):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        op()
+        allocated += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+
+    return {
+        'iterations': iterations,
+        'records_per_sec': round(iterations / elapsed, 1),
+        'p50_us': round(percentile(latencies, 0.5) * 1e6, 3),
+        'p99_us': round(percentile(latencies, 0.99) * 1e6, 3),
+        'alloc_bytes': round(float(allocated) / count, 1),
+    }
+
+
+def environment():
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'pyzmq': zmq.__version__,
+        'libzmq': zmq.zmq_version(),
+        'json_backend': serializers.json_backend,
+    }
+
+
+def run(iterations, transports, selected=None):
+    results = []
+    ctx = zmq.Context()
+    for name, params, setup in CASES:
+        if selected and not any(s in name for s in selected):
+            continue
+        for transport in (None,) if name in TRANSPORT_FREE else transports:
+            sink = Sink(ctx, transport) if transport else None
+            op, teardown = setup(sink.endpoint if sink else None, ctx)
+            try:
+                result = measure(op, iterations)
+            finally:
+                if teardown is not None:
+                    teardown()
+                if sink is not None:
+                    sink.close()
+            result.update(name=name, transport=transport, params=params)
+            results.append(result)
+            report(result)
+    ctx.term()
+    return {'environment': environment(), 'results': results}
+
+
+def key(result):
+    return (result['name'], result['transport'],
+            json.dumps(result['params'], sort_keys=True))
+
+
+def label(result):
+    params = ' '.join('{0}={1}'.format(k, v)
+                      for k, v in sorted(result['params'].items()))
+    return '{0} {1} {2}'.format(result['name'], result['transport'] or '-',
+                                params).strip()
+
+
+def report(result, baseline=None):
+    line = '{0:<40} {1:>12.0f} {2:>9.2f} {3:>9.2f} {4:>9.0f}'.format(
+        label(result), result['records_per_sec'], result['p50_us'],
+        result['p99_us'], result['alloc_bytes'])
+    if baseline is not None:
+        line += ' {0:>+7.1%}'.format(
+            result['records_per_sec'] / baseline['records_per_sec'] - 1)
+    sys.stderr.write(line + '\n')
+
+
+def compare(current, previous):
+    """Print the change in throughput against an earlier run."""
+    earlier = dict((key(r), r) for r in previous['results'])
+    sys.stderr.write('\ncompared to {0}\n'.format(
+        previous['environment'].get('created')))
+    for result in current['results']:
+        baseline = earlier.get(key(result))
+        if baseline is not None:
+            report(result, baseline)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the client side of distlog.')
+    parser.add_argument('-n', '--iterations', type=int, default=20000,
+                        help='calls per case, default: %(default)s')
+    parser.add_argument('-t', '--transport', action='append',
+                        choices=TRANSPORTS,
+                        help='transport to test, default: all')
+    parser.add_argument('-k', '--case', action='append',
+                        help='only run the cases whose name contains this')
+    parser.add_argument('-o', '--output',
+                        help='write the results to this file, default: stdout')
+    parser.add_argument('-c', '--compare',
+                        help='results of an earlier run to compare with')
+    args = parser.parse_args(argv)
+
+    sys.stderr.write('{0:<40} {1:>12} {2:>9} {3:>9} {4:>9}\n'.format(
+        'case', 'records/s', 'p50 us', 'p99 us', 'bytes'))
+    results = run(args.iterations, args.transport or TRANSPORTS, args.case)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
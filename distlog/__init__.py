@@ -1,15 +1,33 @@
-from .logger.context import import_task, task, to, Task, LogContext, LogRecord
-from .logger.formatters import JSONFormatter, PickleFormatter
+import sys
+
+from .logger.context import import_task, task, to, Task, LogContext, LogRecord, \
+    CompactLogRecord, use_compact_records
+from .logger.formatters import JSONFormatter, PickleFormatter, MsgPackFormatter
 from .logger.handler import ZmqHandler
+from .logger import metrics
+from .logger.sampling import Sampler, get_sampler, set_sampler
+from .logger.tracing import traced
 
 __all__ = [
     'import_task',
     'task',
     'to',
+    'traced',
     'JSONFormatter',
     'PickleFormatter',
+    'MsgPackFormatter',
     'ZmqHandler',
+    'metrics',
+    'Sampler',
+    'get_sampler',
+    'set_sampler',
     'Task',
     'LogContext',
-    'LogRecord'
+    'LogRecord',
+    'CompactLogRecord',
+    'use_compact_records'
 ]
+
+if sys.version_info >= (3, 5):
+    from .logger.aiohandler import AsyncZmqHandler
+    __all__.append('AsyncZmqHandler')
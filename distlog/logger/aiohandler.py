@@ -0,0 +1,226 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""Publish log messages via 0MQ from an asyncio event loop.
+
+The :py:class:`~distlog.logger.handler.ZmqHandler` sends on the thread
+that logs, which blocks the event loop when the peer is slow.
+The handler in this module uses :py:mod:`zmq.asyncio` instead, so a send
+never blocks the loop.
+
+Requires Python 3.5 or later.
+
+"""
+
+__copyright__ = "Copyright (C) 2017 Leo Noordergraaf"
+__licence__ = "GNU General Public Licence v3"
+
+import asyncio
+import time
+
+import zmq
+import zmq.asyncio
+
+from .handler import DEFAULT_QUEUE_SIZE, STAMP, ZmqHandler
+
+try:
+    _running_loop = asyncio.get_running_loop
+except AttributeError:  # Python < 3.7
+    def _running_loop():
+        loop = asyncio._get_running_loop()
+        if loop is None:
+            raise RuntimeError('no running event loop')
+        return loop
+
+
+class AsyncZmqHandler(ZmqHandler):
+
+    """0MQ transport for asyncio applications.
+
+    :py:meth:`emit` only collects the record. All records emitted during
+    one iteration of the event loop are sent together, in batches of at
+    most `batch_size` records, once the loop gets around to it.
+
+    Records may also be emitted from other threads, they are handed to
+    the loop the handler was first used on. At most `queue_size` records
+    are held while no loop sends them, once that loop is closed records
+    are no longer collected. Records that are not sent are counted in
+    :py:attr:`dropped`.
+
+    Before the loop stops, await :py:meth:`flush` or :py:meth:`aclose`
+    to make sure all records were handed to 0MQ.
+    """
+
+    def __init__(self, endpoint, context=None, system='P', batch_size=1000,
+                 queue_size=DEFAULT_QUEUE_SIZE, **kwargs):
+        """Create an AsyncZmqHandler.
+
+        :param string endpoint: A 0MQ endpoint like `tcp://localhost:11223`.
+        :param socket endpoint: An endpoint can also be a connected
+            :py:class:`zmq.asyncio.Socket`.
+        :param context: A :py:class:`zmq.asyncio.Context`.
+        :param string system: the system topic
+        :param int batch_size: Maximum number of records per message.
+        :param int queue_size: Maximum number of records waiting for
+            the event loop.
+        :param kwargs: `intern`, `compression`, `compress_threshold`,
+            `rate_limit` and `stamp`, see
+            :py:class:`~distlog.logger.handler.ZmqHandler`.
+
+        """
+        self._owns_socket = not isinstance(endpoint, zmq.Socket)
+        super(AsyncZmqHandler, self).__init__(
+            endpoint, context or zmq.asyncio.Context.instance(), system,
+            **kwargs
+        )
+        self._batch_size = batch_size
+        self._max_pending = queue_size
+        self._loop = None
+        self._pending = []
+        self._scheduled = False
+        self._sends = set()
+
+    def _dispatch(self, record):
+        """Collect a record, it is sent later on by the event loop.
+
+        Called with the handler lock held.
+        """
+        try:
+            loop = _running_loop()
+        except RuntimeError:
+            loop = None
+        if len(self._pending) >= self._max_pending or (
+                loop is None and self._loop is not None and
+                self._loop.is_closed()):
+            # nothing will ever send it
+            self.dropped += 1
+            return
+        self._pending.append(record)
+        if self._scheduled:
+            return
+        if loop is not None:
+            self._loop = loop
+            self._scheduled = True
+            loop.call_soon(self._send_pending)
+        elif self._loop is not None and not self._loop.is_closed():
+            self._scheduled = True
+            self._loop.call_soon_threadsafe(self._send_pending)
+
+    def _send_pending(self):
+        """Send the records collected during the last loop iteration."""
+        self.acquire()
+        try:
+            records, self._pending = self._pending, []
+            self._scheduled = False
+        finally:
+            self.release()
+        size = self._batch_size
+        for start in range(0, len(records), size):
+            batch = records[start:start + size]
+            try:
+                self._send_batch(batch)
+            except Exception:
+                self.handleError(batch[0])
+
+    def _rebuild(self):
+        """Forget the event loop and sends of the parent process."""
+        self.acquire()
+        try:
+            if self._forked:
+                self._loop = None
+                self._pending = []
+                self._scheduled = False
+                self._sends = set()
+                self._owns_socket = True
+                super(AsyncZmqHandler, self)._rebuild()
+        finally:
+            self.release()
+
+    def send_perf_data(self, data):
+        """Collect performance data, it is sent along with the records."""
+        if self._forked:
+            self._rebuild()
+        self.acquire()
+        try:
+            self._dispatch(data)
+        finally:
+            self.release()
+
+    def _send_body(self, flags, body, performance=False, count=1):
+        """Queue a message body for sending on the event loop.
+
+        0MQ may send the body after this returns, so it is copied out of
+        the reusable batch buffer.
+        """
+        codec = self._codec
+        if codec is not None and len(body) >= self._compress_threshold:
+            body = codec.compress(body)
+            flags += codec.letter
+        elif not isinstance(body, bytes):
+            body = bytes(body)
+        frames = [self._topic(flags, performance), body]
+        if self._stamp:
+            frames.append(STAMP.pack(time.time()))
+        future = self.socket.send_multipart(frames)
+        self._sends.add(future)
+        future.add_done_callback(self._sent)
+        return None
+
+    def _sent(self, future):
+        self._sends.discard(future)
+        if not future.cancelled() and future.exception() is not None:
+            try:
+                raise future.exception()
+            except Exception:
+                self.handleError(None)
+
+    def flush(self):
+        """Send all collected records.
+
+        Must be awaited on the event loop:
+
+        .. code-block:: python
+
+            await handler.flush()
+
+        Outside of a running loop, for instance when :py:mod:`logging`
+        shuts down, it does nothing.
+
+        :return: awaitable that completes when all records are handed to
+            0MQ, or None when called outside the event loop.
+        """
+        try:
+            loop = _running_loop()
+        except RuntimeError:
+            return None
+        if self._forked:
+            self._rebuild()
+        self._flush_suppressed()
+        self._send_pending()
+        sends = list(self._sends)
+        if not sends:
+            future = loop.create_future()
+            future.set_result(None)
+            return future
+        return asyncio.gather(*sends, return_exceptions=True)
+
+    def close(self):
+        """Close the handler, counting the records left unsent as dropped.
+
+        Await :py:meth:`flush` first, or use :py:meth:`aclose`, to send
+        them.
+        """
+        super(AsyncZmqHandler, self).close()
+        self.acquire()
+        try:
+            self.dropped += len(self._pending)
+            self._pending = []
+        finally:
+            self.release()
+
+    async def aclose(self):
+        """Send all collected records and close the handler."""
+        await self.flush()
+        self.close()
+        if self._owns_socket:
+            self.socket.close()
@@ -0,0 +1,36 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""Coroutine support for :py:func:`~distlog.traced`.
+
+Requires Python 3.5 or later.
+
+"""
+
+__copyright__ = "Copyright (C) 2017 Leo Noordergraaf"
+__licence__ = "GNU General Public Licence v3"
+
+import functools
+
+from .context import skip_source_file
+
+
+def trace_coroutine(func, start):
+    """Run every call of a coroutine function in a task.
+
+    The task stays on the stack while the coroutine awaits. The stack
+    belongs to the asyncio task running the coroutine, so other asyncio
+    tasks do not see it.
+
+    :param func: the coroutine function.
+    :param start: callable creating the :py:class:`~distlog.Task`.
+    :return: the wrapped coroutine function.
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        with start():
+            return await func(*args, **kwargs)
+    return wrapper
+
+
+skip_source_file(trace_coroutine.__code__.co_filename)
@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""Compress messages for network transport.
+
+A compression codec shrinks the body of a message before it is sent.
+The codec is identified by a single letter that is added to the flags
+of the message topic so the receiver knows how to decompress the body.
+
+Log records, JSON encoded ones in particular, contain a lot of
+repetition and compress well, batches of records even more so.
+
+Codecs are registered by letter. The producers and distlogd both look
+the codec of a topic flag up here, so a codec added with
+:py:func:`register_codec` is understood by both:
+
+.. code-block:: python
+
+    import lz4.frame
+    from distlog.logger import compression
+
+    class LZ4Codec(compression.Codec):
+        letter = 'L'
+
+        def compress(self, data):
+            return lz4.frame.compress(data)
+
+        def decompress(self, data):
+            return lz4.frame.decompress(data)
+
+    compression.register_codec(LZ4Codec())
+
+The (Z)lib codec is registered from the start.
+
+"""
+
+__copyright__ = "Copyright (C) 2017 Leo Noordergraaf"
+__licence__ = "GNU General Public Licence v3"
+
+import zlib
+
+
+class Codec(object):
+
+    """Common base class for compression codecs."""
+
+    letter = None
+    """Topic flag identifying the codec."""
+
+    def compress(self, data):
+        """Compress a message body.
+
+        :param bytes data: the encoded record or batch
+        :return bytes: the compressed data
+
+        """
+        raise NotImplementedError()
+
+    def decompress(self, data):
+        """Decompress a message body.
+
+        :param bytes data: the compressed data
+        :return bytes: the encoded record or batch
+
+        """
+        raise NotImplementedError()
+
+
+class ZlibCodec(Codec):
+
+    """Compression using zlib.
+
+    The level trades CPU time for bandwidth: 1 is the fastest and
+    compresses least, 9 is the slowest and compresses most.
+
+    :param int level: zlib compression level
+
+    """
+
+    letter = 'Z'
+
+    def __init__(self, level=6):
+        assert -1 <= level <= 9
+        self.level = level
+
+    def compress(self, data):
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+
+_codecs = {}
+
+RESERVED_FLAGS = 'BD'
+"""Topic flags that are not available to codecs."""
+
+
+def _keys(letter):
+    """Produce the keys under which a codec letter is stored.
+
+    The handler uses text topics, distlogd receives bytes; both are
+    looked up directly.
+    """
+    if isinstance(letter, bytes):
+        letter = letter.decode('ascii')
+    return set([letter, letter.encode('ascii')])
+
+
+def register_codec(codec):
+    """Add a codec, or replace the one using the same letter.
+
+    The registered instance decompresses every message flagged with its
+    letter. Handlers may use other instances, with other settings, to
+    compress.
+
+    :param codec: the :py:class:`Codec`
+    :return: the codec
+    """
+    letter = codec.letter
+    if len(letter) != 1 or not letter.isupper() or letter in RESERVED_FLAGS:
+        raise ValueError('codec letter must be a single upper case letter '
+                         'other than ' + ', '.join(RESERVED_FLAGS))
+    for key in _keys(letter):
+        _codecs[key] = codec
+    return codec
+
+
+def get_codec(letter):
+    """Look up a codec.
+
+    :param letter: the topic flag, as text or bytes
+    :return: the :py:class:`Codec`
+    :raises KeyError: if no codec uses the letter
+    """
+    return _codecs[letter]
+
+
+def codecs():
+    """Produce all registered codecs.
+
+    :return list: the :py:class:`Codec` objects, ordered by letter
+    """
+    unique = dict((c.letter, c) for c in _codecs.values())
+    return [unique[letter] for letter in sorted(unique)]
+
+
+register_codec(ZlibCodec())
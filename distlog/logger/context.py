@@ -20,9 +20,59 @@ __licence__ = "GNU General Public Licence v3"
 import logging
 import os
 import io
+import sys
+import threading
+import time
 import traceback
 import uuid
 import six
+from six.moves import _thread, collections_abc
+from . import perf
+from . import sampling
+try:
+    import contextvars
+except ImportError:
+    contextvars = None
+
+
+class TaskContext(collections_abc.Mapping):
+
+    """
+    Context of a single log message.
+
+    A read-only mapping combining the key identifying the log message with
+    the data of the :py:class:`~distlog.Task` it was created in.
+    The task data is shared by all messages of the task, the key is only
+    formatted when it is asked for.
+
+    :param dict base: the task data, must not be modified
+    :param int counter: sequence number of the message in its task
+    :param string task_id: id of the task
+    """
+
+    __slots__ = ('_base', '_counter', '_task_id')
+
+    def __init__(self, base, counter, task_id):
+        self._base = base
+        self._counter = counter
+        self._task_id = task_id
+
+    def __getitem__(self, key):
+        if key == 'key' and 'key' not in self._base:
+            return '{0}@{1}'.format(self._counter, self._task_id)
+        return self._base[key]
+
+    def __iter__(self):
+        if 'key' not in self._base:
+            yield 'key'
+        for key in self._base:
+            yield key
+
+    def __len__(self):
+        return len(self._base) + (0 if 'key' in self._base else 1)
+
+    def __repr__(self):
+        return repr(dict(self))
 
 
 class Task(object):
@@ -48,6 +98,9 @@ class Task(object):
     scope. Thereafter all log messages will belong to the same scope until a
     subtask is created with the :py:func:`~distlog.to` function or until the
     `with` section terminates.
+    When the root logger has no handlers or is not enabled for INFO these
+    messages are skipped entirely: no record is created and neither the
+    message nor the context is assembled.
 
     When the :py:func:`__exit__` method of the :py:class:`~distlog.Task` is
     called another log message at the INFO level signals the completion of the
@@ -61,11 +114,21 @@ class Task(object):
         You may provide as many named parameters as needed.
         They are stored as key/value pairs in the context
         and are added to the :py:class:`~distlog.LogRecord` when it is created.
+
+    The `sampled` attribute holds the sampling decision of the trace the
+    task belongs to. While an unsampled task is on top of the
+    :py:class:`~distlog.LogContext` no log records are created.
+
+    The task is timed with a monotonic clock, `started` and `ended`
+    hold the clock values. When it ends the duration is published on
+    the performance topic, see :py:mod:`~distlog.logger.perf`.
     """
 
     def __init__(self, _id, msg, *args, **kwargs):
         self._id = _id
         self._parent = None
+        self._path = None
+        self._base = None
         self.msg = msg
         self.args = args
         self.data = kwargs
@@ -73,18 +136,28 @@ class Task(object):
         self.sargs = args
         self.counter = 0
         self.tasks = 0
+        self.sampled = True
+        self._enabled = False
+        self.started = None
+        self.ended = None
+        self._cpu_started = None
 
     @property
     def id(self):
         """
         Property produces the context's unique id.
 
+        The id is determined once for every time the task is pushed on
+        the :py:class:`~distlog.LogContext`.
+
         :vartype string: scope (task/subtask) id.
         """
-        if self.parent:
-            return '{0}/{1}'.format(self.parent, self._id)
-        else:
-            return self._id
+        if self._path is None:
+            if self.parent:
+                self._path = '{0}/{1}'.format(self.parent, self._id)
+            else:
+                self._path = self._id
+        return self._path
 
     @property
     def parent(self):
@@ -109,14 +182,17 @@ class Task(object):
         with the data provided when creating the context and any
         data added to it by the :py:func:`~distlog.Task.bind` function.
 
-        :vartype: dict containing the context data.
+        Every call produces the context for the next log message.
+        The returned :py:class:`~distlog.logger.context.TaskContext` shares
+        the task data with the other messages of this task.
+
+        :vartype: mapping containing the context data.
         """
-        data = {
-            'key': '{0}@{1}'.format(self.counter, self.id)
-        }
+        if self._base is None:
+            self._base = dict(self.data)
+        counter = self.counter
         self.counter += 1
-        data.update(self.data)
-        return data
+        return TaskContext(self._base, counter, self.id)
 
     def get_next_task(self):
         """
@@ -140,12 +216,13 @@ class Task(object):
         function :py:func:`~distlog.import_task`.
         Doing so will link both tasks (although in separate processes)
         toghether in one related set of log messages.
+        The sampling decision of this task is part of the id.
 
         :return string: child task identification string.
 
         """
         _id = self.get_next_task()
-        return '{0}/{1}'.format(self.parent, _id)
+        return sampling.encode('{0}/{1}'.format(self.id, _id), self.sampled)
 
     def bind(self, **kwargs):
         """
@@ -157,6 +234,7 @@ class Task(object):
         :param dict kwargs: dict with key/value pairs
         """
         self.data.update(kwargs)
+        self._base = None
 
     def success(self, msg, *args):
         """
@@ -183,7 +261,7 @@ class Task(object):
         :rtype: Task
         """
         _context.push(self)
-        logging.info(self.msg, *self.args)
+        self._begin()
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
@@ -199,13 +277,58 @@ class Task(object):
         :param traceback: see context manager
         :rtype: bool False, do not interfere with exceptions
         """
-        if exc_type:
-            logging.exception('FAILED ' + self.msg % self.args, exc_type, exc_value, traceback)
-        elif self.smsg:
-            logging.info(self.smsg, *self.sargs)
+        self._end(exc_type, exc_value, traceback)
         _context.pop()
         return False
 
+    def _begin(self):
+        """Log the begin of the task, which must be on top of the stack."""
+        if perf.cpu_timing:
+            self._cpu_started = perf.cpu_clock()
+        self.started = perf.clock()
+        self._enabled = _listening(logging.INFO)
+        if self._enabled:
+            logging.root._log(logging.INFO, self.msg, self.args)
+
+    def _end(self, exc_type=None, exc_value=None, traceback=None):
+        """Log the end of the task, which must be on top of the stack."""
+        self.ended = perf.clock()
+        if perf.handlers and self.sampled:
+            perf.publish(self._timing(exc_type is not None))
+        if exc_type:
+            if _listening(logging.ERROR):
+                logging.root._log(logging.ERROR, 'FAILED ' + self.msg, self.args,
+                                  exc_info=(exc_type, exc_value, traceback))
+        elif self.smsg and self._enabled:
+            logging.root._log(logging.INFO, self.smsg, self.sargs)
+
+
+    def _timing(self, failed):
+        """Produce the timing record of the finished task."""
+        data = {
+            'task': str(self.id),
+            'msg': self.msg,
+            'created': time.time(),
+            'duration': self.ended - self.started,
+            'failed': failed,
+        }
+        if self._cpu_started is not None:
+            data['cpu'] = perf.cpu_clock() - self._cpu_started
+        return data
+
+
+def _listening(level):
+    """
+    Is anything listening to task messages at this level?
+
+    Task messages are logged on the root logger.
+
+    :param int level: level of the message.
+    :rtype: bool
+    """
+    root = logging.root
+    return bool(root.handlers) and root.isEnabledFor(level)
+
 
 class LogContext(object):
 
@@ -217,13 +340,36 @@ class LogContext(object):
     Tasks can be constructed from subtasks which is why a stack structure is
     required.
 
+    Every thread has a stack of its own, and from Python 3.7 on so does
+    every asyncio task, so concurrent requests handled by one process do
+    not mix up their tasks. The stack is an immutable tuple kept in a
+    :py:mod:`contextvars` variable. Pythons before 3.7 lack contextvars
+    and keep it in a thread local, there the asyncio tasks of a thread
+    share one stack. Neither requires locking.
+
     The :py:class:`~distlog.LogContext` itself is a class with only a single
     instance which acts as a singleton and is defined as a module global
     in this file.
     """
 
     def __init__(self):
-        self.context = list()
+        if contextvars is not None:
+            tasks = contextvars.ContextVar('distlog_tasks', default=())
+            self._get = tasks.get
+            self._set = tasks.set
+        else:
+            local = threading.local()
+            self._get = lambda: getattr(local, 'tasks', ())
+            self._set = lambda tasks: setattr(local, 'tasks', tasks)
+
+    @property
+    def context(self):
+        """
+        The stack of the current thread or asyncio task.
+
+        :vartype: tuple of :py:class:`~distlog.Task`, the top last.
+        """
+        return self._get()
 
     def push(self, action):
         """
@@ -232,8 +378,10 @@ class LogContext(object):
         :param action: item to add to the stack.
         :type action: :py:class:`~distlog.Task`
         """
-        action._parent = self.top
-        self.context.append(action)
+        tasks = self._get()
+        action._parent = tasks[-1] if tasks else None
+        action._path = None
+        self._set(tasks + (action,))
 
     def pop(self):
         """
@@ -243,8 +391,11 @@ class LogContext(object):
 
         :rtype: :py:class:`~distlog.Task` the removed element.
         """
-        action = self.context.pop()
+        tasks = self._get()
+        action = tasks[-1]
+        self._set(tasks[:-1])
         action._parent = None
+        action._path = None
         return action
 
     @property
@@ -254,8 +405,9 @@ class LogContext(object):
 
         :vartype: :py:class:`~distlog.Task` the element on top of the stack.
         """
-        if len(self.context) > 0:
-            return self.context[-1]
+        tasks = self._get()
+        if tasks:
+            return tasks[-1]
         return None
 
 
@@ -276,19 +428,52 @@ if six.PY2:
             super(LogRecord, self).__init__(name, level, pathname, lineno, msg, args, exc_info, func)
             self.context = _context.top.context if _context.top else None
 
+        def _has_field(self, key):
+            """Does the record have an attribute named key?"""
+            return key in self.__dict__
+
 
     class Logger(logging.Logger):
+        caller_level = logging.NOTSET
+        """Records below this level are created without caller information."""
+
+        def set_caller_level(self, level):
+            """
+            Choose the records for which the caller is looked up.
+
+            Finding the file, line and function that logged a record
+            walks the stack. Records below `level` are created without
+            it, they report `(unknown file)` as their pathname. The rate
+            limiter then tells their call sites apart by logger name and
+            message.
+
+            :param int level: lowest level for caller lookup, NOTSET for
+                all records, None for none.
+            """
+            self.caller_level = sys.maxsize if level is None else level
+
+        def isEnabledFor(self, level):
+            """
+            Is this logger enabled for level 'level'?
+
+            Always False while the current task is not sampled.
+            """
+            tasks = _context.context
+            if tasks and not tasks[-1].sampled:
+                return False
+            return super(Logger, self).isEnabledFor(level)
+
         def makeRecord(self, name, level, fn, lno, msg, args, exc_info, func=None, extra=None):
             """
             A factory method which can be overridden in subclasses to create
             specialized LogRecords.
             """
-            rv = LogRecord(name, level, fn, lno, msg, args, exc_info, func)
+            rv = _record_class(name, level, fn, lno, msg, args, exc_info, func)
             if extra is not None:
                 for key in extra:
-                    if (key in ["message", "asctime"]) or (key in rv.__dict__):
+                    if (key in ["message", "asctime"]) or rv._has_field(key):
                         raise KeyError("Attempt to overwrite %r in LogRecord" % key)
-                    rv.__dict__[key] = extra[key]
+                    setattr(rv, key, extra[key])
             return rv
 
         def findCaller(self):
@@ -304,13 +489,33 @@ if six.PY2:
             rv = "(unknown file)", 0, "(unknown function)"
             while hasattr(f, "f_code"):
                 co = f.f_code
-                filename = os.path.normcase(co.co_filename)
-                if filename == logging._srcfile or filename == _srcfile:
+                if _is_internal(co):
                     f = f.f_back
                     continue
                 rv = (co.co_filename, f.f_lineno, co.co_name)
                 break
             return rv
+
+        def _log(self, level, msg, args, exc_info=None, extra=None):
+            """
+            Low-level logging routine which creates a LogRecord and then calls
+            all the handlers of this logger to handle the record.
+
+            The caller is only looked up for levels of at least
+            :py:attr:`caller_level`.
+            """
+            if level >= self.caller_level:
+                try:
+                    fn, lno, func = self.findCaller()
+                except ValueError:
+                    fn, lno, func = "(unknown file)", 0, "(unknown function)"
+            else:
+                fn, lno, func = "(unknown file)", 0, "(unknown function)"
+            if exc_info:
+                if not isinstance(exc_info, tuple):
+                    exc_info = sys.exc_info()
+            record = self.makeRecord(self.name, level, fn, lno, msg, args, exc_info, func, extra)
+            self.handle(record)
 else:
     class LogRecord(logging.LogRecord):
 
@@ -326,21 +531,54 @@ else:
             super(LogRecord, self).__init__(name, level, pathname, lineno, msg, args, exc_info, func, sinfo)
             self.context = _context.top.context if _context.top else None
 
+        def _has_field(self, key):
+            """Does the record have an attribute named key?"""
+            return key in self.__dict__
+
     class Logger(logging.Logger):
+        caller_level = logging.NOTSET
+        """Records below this level are created without caller information."""
+
+        def set_caller_level(self, level):
+            """
+            Choose the records for which the caller is looked up.
+
+            Finding the file, line and function that logged a record
+            walks the stack. Records below `level` are created without
+            it, they report `(unknown file)` as their pathname. The rate
+            limiter then tells their call sites apart by logger name and
+            message.
+
+            :param int level: lowest level for caller lookup, NOTSET for
+                all records, None for none.
+            """
+            self.caller_level = sys.maxsize if level is None else level
+
+        def isEnabledFor(self, level):
+            """
+            Is this logger enabled for level 'level'?
+
+            Always False while the current task is not sampled.
+            """
+            tasks = _context.context
+            if tasks and not tasks[-1].sampled:
+                return False
+            return super(Logger, self).isEnabledFor(level)
+
         def makeRecord(self, name, level, fn, lno, msg, args, exc_info, func=None, extra=None,  sinfo=None):
             """
             A factory method which can be overridden in subclasses to create
             specialized LogRecords.
             """
-            rv = LogRecord(name, level, fn, lno, msg, args, exc_info, func,  sinfo)
+            rv = _record_class(name, level, fn, lno, msg, args, exc_info, func,  sinfo)
             if extra is not None:
                 for key in extra:
-                    if (key in ["message", "asctime"]) or (key in rv.__dict__):
+                    if (key in ["message", "asctime"]) or rv._has_field(key):
                         raise KeyError("Attempt to overwrite %r in LogRecord" % key)
-                    rv.__dict__[key] = extra[key]
+                    setattr(rv, key, extra[key])
             return rv
 
-        def findCaller(self, stack_info=False):
+        def findCaller(self, stack_info=False, stacklevel=1):
             """
             Find the stack frame of the caller so that we can note the source
             file name, line number and function name.
@@ -353,10 +591,13 @@ else:
             rv = "(unknown file)", 0, "(unknown function)", None
             while hasattr(f, "f_code"):
                 co = f.f_code
-                filename = os.path.normcase(co.co_filename)
-                if filename == logging._srcfile or filename == _srcfile:
+                if _is_internal(co):
                     f = f.f_back
                     continue
+                while stacklevel > 1 and f.f_back is not None:
+                    f = f.f_back
+                    stacklevel -= 1
+                co = f.f_code
                 sinfo = None
                 if stack_info:
                     sio = io.StringIO()
@@ -370,9 +611,212 @@ else:
                 break
             return rv
 
+        def _log(self, level, msg, args, exc_info=None, extra=None, stack_info=False,
+                 stacklevel=1):
+            """
+            Low-level logging routine which creates a LogRecord and then calls
+            all the handlers of this logger to handle the record.
+
+            The caller is only looked up for levels of at least
+            :py:attr:`caller_level`.
+            """
+            sinfo = None
+            if level >= self.caller_level:
+                try:
+                    fn, lno, func, sinfo = self.findCaller(stack_info, stacklevel)
+                except ValueError:
+                    fn, lno, func = "(unknown file)", 0, "(unknown function)"
+            else:
+                fn, lno, func = "(unknown file)", 0, "(unknown function)"
+            if exc_info:
+                if isinstance(exc_info, BaseException):
+                    exc_info = (type(exc_info), exc_info, exc_info.__traceback__)
+                elif not isinstance(exc_info, tuple):
+                    exc_info = sys.exc_info()
+            record = self.makeRecord(self.name, level, fn, lno, msg, args,
+                                     exc_info, func, extra, sinfo)
+            self.handle(record)
+
     _logRecordFactory = logging.getLogRecordFactory()
     logging.setLogRecordFactory(LogRecord)
 
+class _CompactFields(object):
+
+    """Storage of the :py:class:`CompactLogRecord` fields."""
+
+    __slots__ = (
+        'name', 'msg', 'args', 'levelname', 'levelno', 'pathname',
+        '_filename', '_module', 'exc_info', 'exc_text', 'stack_info',
+        'lineno', 'funcName', 'created', '_msecs', '_relativeCreated',
+        'thread', 'threadName', 'processName', 'process', 'context',
+        'message', 'asctime', '__dict__'
+    )
+
+
+_extra_fields = _CompactFields.__dict__['__dict__'].__get__
+_compact_fields = tuple(
+    field.lstrip('_') for field in _CompactFields.__slots__
+    if field != '__dict__'
+)
+_compact_field_names = frozenset(_compact_fields)
+
+
+class CompactLogRecord(_CompactFields):
+
+    """
+    Allocation-light :py:class:`~distlog.LogRecord`.
+
+    The standard fields are kept in slots instead of an instance
+    dictionary, the context is kept by reference and the fields derived
+    from others, `filename`, `module`, `msecs` and `relativeCreated`,
+    are only computed when asked for.
+    Additional attributes, for instance from the `extra` argument of
+    the log functions, are stored in a dictionary created on demand.
+
+    The `__dict__` attribute produces a dictionary of all fields, so
+    formatters, including :py:class:`~distlog.logger.formatters.Serializer`,
+    handle the record like any other.
+    Note that it is not an instance of :py:class:`logging.LogRecord`.
+
+    Enable it with :py:func:`~distlog.use_compact_records`.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, name, level, pathname, lineno, msg, args, exc_info,
+                 func=None, sinfo=None):
+        ct = time.time()
+        self.name = name
+        self.msg = msg
+        if (args and len(args) == 1 and
+                isinstance(args[0], collections_abc.Mapping) and args[0]):
+            args = args[0]
+        self.args = args
+        self.levelname = logging.getLevelName(level)
+        self.levelno = level
+        self.pathname = pathname
+        self._filename = None
+        self._module = None
+        self.exc_info = exc_info
+        self.exc_text = None
+        self.stack_info = sinfo
+        self.lineno = lineno
+        self.funcName = func
+        self.created = ct
+        self._msecs = None
+        self._relativeCreated = None
+        if logging.logThreads:
+            self.thread = _thread.get_ident()
+            self.threadName = threading.current_thread().name
+        else:
+            self.thread = None
+            self.threadName = None
+        self.processName = None
+        if logging.logMultiprocessing:
+            self.processName = 'MainProcess'
+            mp = sys.modules.get('multiprocessing')
+            if mp is not None:
+                try:
+                    self.processName = mp.current_process().name
+                except Exception:
+                    pass
+        self.process = os.getpid() if logging.logProcesses else None
+        tasks = _context.context
+        self.context = tasks[-1].context if tasks else None
+
+    def _derive(self):
+        try:
+            self._filename = os.path.basename(self.pathname)
+            self._module = os.path.splitext(self._filename)[0]
+        except (TypeError, ValueError, AttributeError):
+            self._filename = self.pathname
+            self._module = "Unknown module"
+
+    @property
+    def filename(self):
+        if self._filename is None:
+            self._derive()
+        return self._filename
+
+    @filename.setter
+    def filename(self, value):
+        self._filename = value
+
+    @property
+    def module(self):
+        if self._module is None:
+            self._derive()
+        return self._module
+
+    @module.setter
+    def module(self, value):
+        self._module = value
+
+    @property
+    def msecs(self):
+        if self._msecs is None:
+            self._msecs = (self.created - int(self.created)) * 1000
+        return self._msecs
+
+    @msecs.setter
+    def msecs(self, value):
+        self._msecs = value
+
+    @property
+    def relativeCreated(self):
+        if self._relativeCreated is None:
+            self._relativeCreated = (self.created - logging._startTime) * 1000
+        return self._relativeCreated
+
+    @relativeCreated.setter
+    def relativeCreated(self, value):
+        self._relativeCreated = value
+
+    def _has_field(self, key):
+        """Does the record have an attribute named key?
+
+        Unlike `key in record.__dict__` this does not compute all fields.
+        """
+        if key in _compact_field_names:
+            return hasattr(self, key)
+        return key in _extra_fields(self)
+
+    @property
+    def __dict__(self):
+        fields = {}
+        for field in _compact_fields:
+            try:
+                fields[field] = getattr(self, field)
+            except AttributeError:
+                pass
+        fields.update(_extra_fields(self))
+        return fields
+
+    def __getstate__(self):
+        return self.__dict__
+
+    def __setstate__(self, state):
+        for key, value in state.items():
+            setattr(self, key, value)
+
+    getMessage = six.get_unbound_function(logging.LogRecord.getMessage)
+    __repr__ = six.get_unbound_function(logging.LogRecord.__repr__)
+
+
+_record_class = LogRecord
+
+
+def use_compact_records(enabled=True):
+    """
+    Let the distlog loggers create :py:class:`CompactLogRecord` instances.
+
+    :param bool enabled: True for compact records, False for
+        :py:class:`~distlog.LogRecord` instances.
+    """
+    global _record_class
+    _record_class = CompactLogRecord if enabled else LogRecord
+
+
 class RootLogger(Logger):
     """
     A root logger is not that different to any other logger, except that
@@ -410,8 +854,14 @@ def task(msg, *args, **kwargs):
     :param list args: parameters for the goal
     :param dict kwargs: key/value context for the log messages
     :rtype: :py:class:`~distlog.Task`
+
+    Whether the records of the new task and its subtasks are kept is
+    decided here by the :py:class:`~distlog.Sampler`, see
+    :py:func:`~distlog.set_sampler`.
     """
-    return Task(uuid.uuid4(), msg, *args, **kwargs)
+    tsk = Task(uuid.uuid4(), msg, *args, **kwargs)
+    tsk.sampled = sampling.get_sampler().decide(kwargs)
+    return tsk
 
 
 def to(msg, *args, **kwargs):
@@ -422,7 +872,8 @@ def to(msg, *args, **kwargs):
     performs a specific job. Usually this means that it
     encapsulates a function.
 
-    :todo: Create a decorator to easily encapsulate a function.
+    To run every call of a function in a subtask, decorate it with
+    :py:func:`~distlog.traced`.
 
     .. code-block:: python
 
@@ -437,8 +888,10 @@ def to(msg, *args, **kwargs):
     :param dict kwargs: context for log messages of this task
     :rtype: :py:class:`~distlog.Task`
     """
-    _context.top.get_next_task()
-    return Task(_context.top.tasks, msg, *args, **kwargs)
+    top = _context.top
+    tsk = Task(top.get_next_task(), msg, *args, **kwargs)
+    tsk.sampled = top.sampled
+    return tsk
 
 
 def import_task(_id, msg, *args, **kwargs):
@@ -468,7 +921,46 @@ def import_task(_id, msg, *args, **kwargs):
     :param list args: parameters for the log message
     :param dict kwargs: key/value pairs forming the log message context.
     :rtype: :py:class:`~distlog.Task`
+
+    The sampling decision of the foreign parent is taken over.
     """
-    return Task(id, msg, *args, **kwargs)
+    _id, sampled = sampling.decode(_id)
+    tsk = Task(_id, msg, *args, **kwargs)
+    tsk.sampled = sampled
+    return tsk
 
 _srcfile = os.path.normcase(task.__code__.co_filename)
+_srcfiles = set([logging._srcfile, _srcfile])
+"""Source files skipped when looking for the caller of a log function."""
+
+_internal_code = {}
+
+
+def _is_internal(code):
+    """
+    Is the code part of the logging machinery?
+
+    The answer is cached per code object, so the filename is normalized
+    only once.
+
+    :param code: code object of a stack frame.
+    :rtype: bool
+    """
+    try:
+        return _internal_code[code]
+    except KeyError:
+        internal = os.path.normcase(code.co_filename) in _srcfiles
+        if len(_internal_code) > 10000:
+            _internal_code.clear()
+        _internal_code[code] = internal
+        return internal
+
+
+def skip_source_file(filename):
+    """
+    Skip a source file when looking for the caller of a log function.
+
+    :param string filename: path of the source file.
+    """
+    _srcfiles.add(os.path.normcase(filename))
+    _internal_code.clear()
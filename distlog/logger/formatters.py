@@ -13,43 +13,276 @@ __licence__ = "GNU General Public Licence v3"
 
 import logging
 import os
-import pickle
-try:
-    import jsonext as json
-except ImportError:
-    import json
+import time
+import uuid
+
+import six
+
+from .serializers import get_encoding
+
+
+INTERN_FIELDS = (
+    'name', 'pathname', 'filename', 'module', 'funcName', 'levelname',
+    'hostname', 'processName', 'threadName'
+)
+"""Record fields whose values are sent through the string dictionary."""
+
+
+class StringTable(object):
+
+    """Dictionary of strings already sent over a connection.
+
+    A record that is interned has the `fields` and their values replaced
+    by numeric ids and the keys of its context replaced by ids as well.
+    Strings that were not sent before are assigned the next free id and
+    included in the record once. Later records only carry the id.
+
+    The receiver keeps a dictionary per producer and epoch. The epoch is
+    incremented, and the dictionary restarted, whenever it holds
+    `max_size` strings or is older than `max_age` seconds. This bounds the
+    memory used on both ends. A receiver that restarted, or missed
+    messages, cannot rebuild the strings of the current epoch and leaves
+    those fields out, it picks up the dictionary again within `max_age`
+    seconds.
+
+    An interned record contains these additional fields:
+
+    `~s`
+        A list with the producer id, the epoch, the id of the first new
+        string and a list of the new strings.
+    `~r`
+        The interned fields as a flat list of alternating field name ids
+        and value ids.
+    `~c`
+        The context as a flat list of alternating key ids and values.
+
+    :param fields: names of the record fields to intern
+    :param int max_size: maximum number of strings in the dictionary
+    :param float max_age: maximum lifetime of an epoch in seconds
+
+    """
+
+    def __init__(self, fields=INTERN_FIELDS, max_size=4096, max_age=10):
+        self.fields = fields
+        self.max_size = max_size
+        self.max_age = max_age
+        self.producer = '{0}:{1}:{2}'.format(
+            os.uname()[1], os.getpid(), uuid.uuid4().hex[:8]
+        )
+        self.epoch = -1
+        self._started = None
+        self._ids = {}
+        self._reset(time.time())
+
+    def _reset(self, now):
+        self.epoch += 1
+        self._started = now
+        self._ids = {}
+
+    def _lookup(self, value, new):
+        """Produce the id of a string, registering it when needed."""
+        sid = self._ids.get(value)
+        if sid is None:
+            sid = self._ids[value] = len(self._ids)
+            new.append(value)
+        return sid
+
+    def intern(self, data):
+        """Replace repeated strings in a record by their ids.
+
+        :param dict data: the extracted record
+        :return: a new dict with the interned record
+
+        """
+        created = data.get('created') or self._started
+        if (len(self._ids) + 2 * len(self.fields) >= self.max_size or
+                created - self._started > self.max_age):
+            self._reset(created)
+        first = len(self._ids)
+        new = []
+        refs = []
+        result = dict(data)
+        for field in self.fields:
+            value = result.get(field)
+            if isinstance(value, six.string_types):
+                refs.append(self._lookup(field, new))
+                refs.append(self._lookup(value, new))
+                del result[field]
+        context = result.get('context')
+        if isinstance(context, dict) and \
+                len(self._ids) + len(context) < self.max_size:
+            pairs = []
+            for key, value in context.items():
+                pairs.append(self._lookup(key, new))
+                pairs.append(value)
+            result['~c'] = pairs
+            del result['context']
+        result['~s'] = [self.producer, self.epoch, first, new]
+        result['~r'] = refs
+        return result
+
+
+LEAN_FIELDS = (
+    'name', 'levelno', 'pathname', 'lineno', 'funcName', 'created',
+    'thread', 'threadName', 'processName', 'message', 'exc_text',
+    'stack_info', 'context', 'suppressed', 'first_created', 'last_created'
+)
+"""Record fields for a lean wire record.
+
+Leaves out the fields the receiver can derive from these (`filename`,
+`module`, `levelname`, `msecs`, `asctime`), the unformatted `msg` and
+`args` and the process constants provided by the envelope.
+"""
+
+
+class _All(object):
+
+    """Contains every field name."""
+
+    def __contains__(self, field):
+        return True
+
+
+_ALL = _All()
+
+
+def static_envelope():
+    """Produce the fields that are constant for the process.
+
+    :return dict: hostname, system name and process id
+
+    """
+    uname = os.uname()
+    return {
+        'hostname': uname[1],
+        'system': uname[0],
+        'process': os.getpid(),
+    }
 
 
 class Serializer(logging.Formatter):
 
-    """Common base class for formatters."""
+    """Common base class for formatters.
+
+    Subclasses name their :py:attr:`encoding`, the dict produced from a
+    LogRecord is encoded by the function registered for it, see
+    :py:mod:`distlog.logger.serializers`.
+
+    By default all LogRecord attributes are sent. A projection, like
+    :py:data:`LEAN_FIELDS`, limits the record to the listed fields,
+    fields without a value are left out. The envelope holds the process
+    constants and is computed once; its fields are added to every
+    record.
+
+    The positional arguments are those of :py:class:`logging.Formatter`,
+    as passed by :py:func:`logging.config.dictConfig`, the projection and
+    envelope are keyword arguments.
+
+    :param fields: names of the record fields to send,
+        None to send them all
+    :param dict envelope: additional constant fields
+    """
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        envelope = kwargs.pop('envelope', None)
+        super(Serializer, self).__init__(*args, **kwargs)
+        self.fields = fields
+        self.envelope = static_envelope()
+        self._own_process = not envelope or 'process' not in envelope
+        if envelope:
+            self.envelope.update(envelope)
+
+    def _update_process(self):
+        """Put the current process id in the envelope, unless it was given."""
+        if self._own_process:
+            self.envelope['process'] = os.getpid()
+
+    def format(self, record):
+        """Format a record for network transport.
+
+        :param record: LogRecord instance
+        :return: encoded record contents.
+
+        """
+        return self.serialize(self._extract_record(record))
+
+    def format_interned(self, record, strings):
+        """Format a record, sending repeated strings by id.
+
+        :param record: LogRecord instance
+        :param strings: the :py:class:`StringTable` of the connection
+        :return: encoded record contents.
+
+        """
+        return self.serialize(strings.intern(self._extract_record(record)))
+
+    def serialize(self, data):
+        """Encode the extracted record data.
+
+        :param dict data: extracted record contents
+        :return: encoded record contents.
+
+        """
+        return get_encoding(self.encoding).encode(data)
+
+    def serialize_into(self, data, out):
+        """Encode the extracted record data, appending it to a buffer.
+
+        Encodings with an `encode_into` function, like MessagePack, write
+        to the buffer without creating a bytes object for the record. The
+        others append the result of :py:meth:`serialize`.
+
+        :param dict data: extracted record contents
+        :param out: object with a `write` method taking a bytes-like object
+
+        """
+        encoding = get_encoding(self.encoding)
+        if encoding.encode_into is not None:
+            encoding.encode_into(data, out)
+            return
+        encoded = encoding.encode(data)
+        if not isinstance(encoded, bytes):
+            encoded = encoded.encode('utf-8')
+        out.write(encoded)
 
     def _extract_record(self, record):
         """Extract the data from a LogRecord.
 
         Logging data is collected in a LogRecord.
         This function readies it for transmission.
-        The receiver may not be able to deal with LogRecords,
-        exception info and timestamps therefore these are
+        The receiver may not be able to deal with LogRecords and
+        exception info therefore the message and exception are
         converted into text, escaping any newlines.
 
-        Additionally, the name of the host generating this
-        message is added as well as the process id.
+        The data starts out as a copy of the static envelope, the
+        record itself is left untouched.
 
         :param record: LogRecord instance
         :return: A dict with the massaged record contents.
 
         """
-        record.message = record.getMessage().replace('\n', '\\n')
-        record.asctime = self.formatTime(record, self.datefmt)
-        record.hostname = os.uname()[1]
-        if record.exc_info:
-            if not record.exc_text:
-                record.exc_text = self.formatException(record.exc_info).\
-                    replace('\n', '\\n')
-        record.exc_info = None
-        record.args = None
-        return record.__dict__
+        data = dict(self.envelope)
+        if self.fields is None:
+            data.update(record.__dict__)
+            data['args'] = None
+            data['exc_info'] = None
+            wanted = _ALL
+        else:
+            for field in self.fields:
+                value = getattr(record, field, None)
+                if value is not None:
+                    data[field] = value
+            wanted = self.fields
+        context = data.get('context')
+        if context is not None and type(context) is not dict:
+            data['context'] = dict(context)
+        if 'message' in wanted:
+            data['message'] = record.getMessage().replace('\n', '\\n')
+        if record.exc_info and not record.exc_text and 'exc_text' in wanted:
+            data['exc_text'] = self.formatException(record.exc_info).\
+                replace('\n', '\\n')
+        return data
 
     @property
     def encoding(self):
@@ -59,19 +292,26 @@ class Serializer(logging.Formatter):
 
 class JSONFormatter(Serializer):
 
-    """Formatter to convert to JSON format."""
+    """Formatter to convert to JSON format.
+
+    The fastest JSON implementation installed is used, see
+    :py:mod:`distlog.logger.serializers`.
+
+    """
 
     def format(self, record):
-        """Format to JSON.
+        """Format a record as JSON text.
 
-        Use the logging Formatter to convert the
-        LogRecord data to JSON for network transport.
+        Like any logging formatter this produces text, so it can be used
+        with the handlers of the standard library as well. The
+        :py:class:`~distlog.ZmqHandler` sends the UTF-8 bytes produced by
+        :py:meth:`serialize` instead.
 
         :param record: LogRecord instance
-        :return: JSON encoded record contents.
+        :return string: the record as JSON
 
         """
-        return json.dumps(self._extract_record(record))
+        return super(JSONFormatter, self).format(record).decode('utf-8')
 
     @property
     def encoding(self):
@@ -87,21 +327,26 @@ class PickleFormatter(Serializer):
 
     """Formatter to convert to pickle format."""
 
-    def format(self, record):
-        """Format to pickle.
-
-        Use the logging Formatter to convert the
-        LogRecord data to pickle format or network transport.
+    @property
+    def encoding(self):
+        """Describe the encoding used.
 
-        :param record: LogRecord instance
-        :return: pickled record contents.
+        :return string: encoding indicator
 
         """
-        # Python2 does not support pickle protocol 3, so
-        # to transfer data between Python applications regardless
-        # the version their are written in it is best to use the
-        # highest common protocol.
-        return pickle.dumps(self._extract_record(record), 2)
+        return 'P'
+
+
+class MsgPackFormatter(Serializer):
+
+    """Formatter to convert to the compact binary MessagePack format.
+
+    Records are encoded by the `msgpack` package, installed with
+    ``pip install distlog[msgpack]``. Without it a pure Python packer
+    is used that produces the same bytes but is several times slower
+    than JSON, distlogd then decodes with a pure Python unpacker too.
+
+    """
 
     @property
     def encoding(self):
@@ -110,4 +355,4 @@ class PickleFormatter(Serializer):
         :return string: encoding indicator
 
         """
-        return 'P'
+        return 'M'
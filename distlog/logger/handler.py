@@ -12,22 +12,36 @@ __copyright__ = "Copyright (C) 2017 Leo Noordergraaf"
 __licence__ = "GNU General Public Licence v3"
 
 import logging
+import os
+import struct
+import threading
+import time
+import weakref
 
 import zmq
-from zmq.utils.strtypes import cast_bytes
+from zmq.utils.strtypes import cast_bytes, cast_unicode
+from six.moves import queue
 
-from .formatters import Serializer
+from . import perf
+from .compression import RESERVED_FLAGS, Codec, ZlibCodec
+from .formatters import Serializer, StringTable
+from .ratelimit import RateLimiter
+from .serializers import get_encoding
+from .spill import SpillBuffer
 
 TOPIC_SEPARATOR = ''
 TOPIC_SYSTEM = 'TSP'
-TOPIC_ENCODING = 'JP'
+TOPIC_ENCODING = 'JPM'
 TOPIC_LOGGING = 'L'
 TOPIC_PERFORMANCE = 'P'
+TOPIC_BATCH = 'B'
+TOPIC_DICTIONARY = 'D'
 """Message topics.
 
 Message topics are used to describe the contents of the
 next fragment. It consists of three parts SYSTEM, KIND
-and ENCODING. The parts are separated by the TOPIC_SEPARATOR.
+and ENCODING, optionally followed by FLAGS.
+The parts are separated by the TOPIC_SEPARATOR.
 
 A client subscribes to these topics and only receives those
 messages to which it subscribed.
@@ -68,8 +82,186 @@ Finally the ENCODING defines how the message is transferred:
 (P)ickle
     Python's own serialization method.
     Python specific but smaller and faster than JSON.
+
+(M)essagePack
+    A compact, typed and binary encoding.
+    Like JSON it can be processed by non python programs.
+
+Other encodings can be added, see :py:mod:`distlog.logger.serializers`.
+
+The FLAGS describe how the fragment is framed:
+
+(B)atch
+    The fragment contains several encoded records. Each record is
+    preceded by its length as a 4 byte unsigned integer in network
+    byte order.
+
+(D)ictionary
+    The records are interned: repeated strings are replaced by ids
+    from a dictionary maintained per producer, see
+    :py:class:`~distlog.logger.formatters.StringTable`.
+
+(Z)lib
+    The fragment is compressed using zlib. Other compression codecs
+    identify themselves with their own letter, see
+    :py:mod:`distlog.logger.compression`.
 """
 
+BATCH_HEADER = struct.Struct('!I')
+STAMP = struct.Struct('!d')
+"""Fragment holding the time a message was sent, in seconds since the
+epoch, added to the messages of a handler that stamps them."""
+DEFAULT_QUEUE_SIZE = 10000
+ZERO_COPY_THRESHOLD = 65536
+"""Bodies of at least this many bytes are sent without copying."""
+
+SPILL_SIZE = 64 << 20
+"""Default maximum size of the spill file in bytes."""
+
+REPLAY_RATE = 1 << 20
+"""Default number of bytes per second replayed from the spill file."""
+
+REPLAY_INTERVAL = 0.1
+"""Seconds between attempts to replay the spill file."""
+
+DRAIN_TIMEOUT = 5.0
+"""Default number of seconds flush and close wait for the spill file to
+be sent."""
+
+OVERFLOW_BLOCK = 'block'
+OVERFLOW_DROP_NEWEST = 'drop-newest'
+OVERFLOW_DROP_OLDEST = 'drop-oldest'
+OVERFLOW_DROP_BELOW_LEVEL = 'drop-below-level'
+"""Overflow policies.
+
+When the handler runs in asynchronous mode (a `queue_size` is given)
+records are placed on a bounded queue and sent by a background thread.
+The overflow policy decides what happens when that queue is full:
+
+block
+    Wait until the sender thread made room on the queue.
+
+drop-newest
+    Discard the record that is being emitted.
+
+drop-oldest
+    Discard the oldest record on the queue to make room for the new one.
+
+drop-below-level
+    Discard the record being emitted if its level is below the
+    `overflow_level`, otherwise wait for room like `block`.
+"""
+OVERFLOW_POLICIES = (
+    OVERFLOW_BLOCK,
+    OVERFLOW_DROP_NEWEST,
+    OVERFLOW_DROP_OLDEST,
+    OVERFLOW_DROP_BELOW_LEVEL
+)
+
+_STOP = object()
+_FLUSH = object()
+
+FORK_SOCKET_OPTIONS = (zmq.SNDHWM, zmq.SNDBUF, zmq.SNDTIMEO, zmq.LINGER)
+"""Socket options copied to the socket a forked process creates."""
+
+_handlers = weakref.WeakSet()
+
+
+def _after_fork():
+    """Mark the handlers a child process inherited.
+
+    The handlers rebuild their connection the first time they are used,
+    so a child that does not log does not pay for it.
+    """
+    for handler in list(_handlers):
+        handler._forked = True
+
+
+try:
+    os.register_at_fork(after_in_child=_after_fork)
+except AttributeError:  # Python < 3.7, only processes of multiprocessing
+    from multiprocessing.util import register_after_fork
+    register_after_fork(_handlers, lambda handlers: _after_fork())
+
+
+class FrameBuffer(object):
+
+    """Reusable buffer a message body is assembled in.
+
+    The buffer only grows, data is written at the current position so
+    reusing it for the next message does not reallocate memory.
+    """
+
+    def __init__(self, size=4096):
+        self.buf = bytearray(size)
+        self.length = 0
+
+    def write(self, data):
+        """Append data to the buffer."""
+        end = self.length + len(data)
+        if end > len(self.buf):
+            grow = bytearray(max(end, 2 * len(self.buf)) - len(self.buf))
+            try:
+                self.buf.extend(grow)
+            except BufferError:
+                # a view of the old buffer is still around, leave it be
+                self.buf = self.buf[:self.length] + grow
+        self.buf[self.length:end] = data
+        self.length = end
+
+    def __iadd__(self, data):
+        self.write(data)
+        return self
+
+    def view(self):
+        """Produce a memoryview of the data written so far."""
+        return memoryview(self.buf)[:self.length]
+
+
+class FramePool(object):
+
+    """Recycle FrameBuffers once 0MQ no longer uses them.
+
+    A buffer that was sent without copying may only be reused after 0MQ
+    is done with it, this is signalled through its message tracker.
+    """
+
+    allocated = 0
+    """Number of buffers created."""
+
+    reused = 0
+    """Number of times a buffer was recycled instead of created."""
+
+    def __init__(self, size=4):
+        self._size = size
+        self._free = []
+        self._pending = []
+
+    def acquire(self):
+        """Produce an empty buffer."""
+        if self._pending:
+            pending = []
+            for tracker, frame in self._pending:
+                if tracker.done:
+                    self._free.append(frame)
+                else:
+                    pending.append((tracker, frame))
+            self._pending = pending
+        if self._free:
+            self.reused += 1
+            frame = self._free.pop()
+            frame.length = 0
+            return frame
+        self.allocated += 1
+        return FrameBuffer()
+
+    def release(self, frame, tracker=None):
+        """Return a buffer, optionally still in use until tracker is done."""
+        if tracker is not None and not tracker.done:
+            self._pending.append((tracker, frame))
+        elif len(self._free) < self._size:
+            self._free.append(frame)
+
 
 class ZmqHandler(logging.Handler):
 
@@ -79,28 +271,238 @@ class ZmqHandler(logging.Handler):
     perf_topic = None
     socket = None
     context = None
+    _forked = False
 
-    def __init__(self, endpoint, context=None, system='P'):
+    queued = 0
+    """Number of records placed on the queue in asynchronous mode."""
+
+    dropped = 0
+    """Number of records discarded by the overflow policy or left in the
+    spill file when the handler was closed."""
+
+    spilled = 0
+    """Number of records written to the spill file."""
+
+    spilled_bytes = 0
+    """Number of message bytes written to the spill file."""
+
+    replayed = 0
+    """Number of records sent from the spill file."""
+
+    def __init__(self, endpoint, context=None, system='P', queue_size=None,
+                 overflow=OVERFLOW_BLOCK, overflow_level=logging.WARNING,
+                 batch_size=None, batch_interval=None, intern=False,
+                 compression=None, compress_threshold=256,
+                 zero_copy_threshold=ZERO_COPY_THRESHOLD, rate_limit=None,
+                 performance=False, metrics=False, spill=None,
+                 spill_size=SPILL_SIZE,
+                 replay_rate=REPLAY_RATE, drain_timeout=DRAIN_TIMEOUT,
+                 stamp=False):
         """Create a ZmqHandler.
 
         This creates the 0MQ PUSH socket and connects its with an endpoint.
+
+        A 0MQ context and socket may not be used after a fork. A child
+        process, for instance a pre-forked worker, that inherited the
+        handler gives it a context, socket and sender thread of its own
+        when it first uses it. A handler created from a socket connects
+        its new socket to the last endpoint the socket was connected to.
+
+        By default records are formatted and sent on the thread that logs
+        them. When `queue_size` is given the handler runs in asynchronous
+        mode: :py:meth:`emit` only places the record on a bounded queue and
+        a background thread formats and sends it. The socket is then used by
+        that thread only.
+
+        When `batch_size` is given the sender thread packs up to that many
+        records in a single message. It waits at most `batch_interval`
+        milliseconds for the batch to fill up, without an interval it sends
+        whatever is queued at that moment. Batching implies asynchronous
+        mode.
+
+        When `intern` is set repeated strings, like the path and module
+        names, are sent once and referred to by id in later records.
+
+        With `compression` the body of every message, a single record or
+        a batch, of at least `compress_threshold` bytes is compressed.
+        Pass a zlib compression level, 1 (fast) to 9 (small), or a
+        :py:class:`~distlog.logger.compression.Codec` instance. The
+        receiver decompresses with the codec registered for its letter,
+        see :py:func:`~distlog.logger.compression.register_codec`.
+
+        Bodies of at least `zero_copy_threshold` bytes are handed to 0MQ
+        without copying. Batches are assembled in reusable buffers that
+        are recycled once 0MQ is done with them.
+
+        With `rate_limit` every call site may send that many records per
+        second, the excess is summarized by a single record. Pass a
+        number or a :py:class:`~distlog.logger.ratelimit.RateLimiter`.
+        Summaries are sent at least every `interval` of the limiter, in
+        asynchronous mode also when nothing else is logged.
+
+        With `performance` the handler also sends the timing records of
+        finished tasks and the aggregated metrics, on the performance
+        topic. With `metrics` it only sends the metrics. See
+        :py:mod:`~distlog.logger.perf` and :py:mod:`~distlog.logger.metrics`.
+
+        With `spill` messages the socket cannot take, because the
+        receiver is unreachable or slow, are written to a file of at most
+        `spill_size` bytes instead of blocking or being dropped. Once the
+        socket accepts messages again the file is sent in order, at most
+        `replay_rate` bytes per second on top of the new records. While the
+        file holds messages new ones are added to it as well, so the
+        receiver gets them in the order they were sent. Interned records
+        depend on the strings defined by the records sent before them.
+        :py:meth:`flush` and :py:meth:`close` send the whole file, waiting
+        at most `drain_timeout` seconds for the socket to take it. The
+        records still in the file when the handler is closed are counted
+        as dropped. Spilling implies asynchronous mode. See
+        :py:mod:`~distlog.logger.spill`.
+
+        With `stamp` every message, a single record or a batch, gets a
+        third fragment holding the time it was handed to 0MQ. distlogd
+        uses it to measure the transport lag, see
+        :py:mod:`distlogd.metrics`.
+
         :param string endpoint: A 0MQ endpoint like `tcp://localhost:11223`.
         :param socket endpoint: An endpoint can also be a connected socket.
         :param context: A ZMQ context.
+        :param int queue_size: Maximum number of queued records,
+            enables asynchronous mode.
+        :param string overflow: One of the OVERFLOW_POLICIES.
+        :param int overflow_level: Records below this level are dropped
+            by the `drop-below-level` policy when the queue is full.
+        :param int batch_size: Maximum number of records per message.
+        :param int batch_interval: Milliseconds to wait for a batch to fill.
+        :param bool intern: Send repeated strings through a dictionary.
+        :param compression: zlib level or Codec used to compress messages.
+        :param int compress_threshold: Minimum size of a compressed body.
+        :param int zero_copy_threshold: Minimum size of a body sent
+            without copying.
+        :param rate_limit: records per second per call site or RateLimiter.
+        :param bool performance: Send the task timing records and metrics.
+        :param bool metrics: Send the metrics.
+        :param string spill: Path of the spill file.
+        :param int spill_size: Maximum size of the spill file in bytes.
+        :param int replay_rate: Bytes per second sent from the spill file.
+        :param float drain_timeout: Seconds to wait for the spill file
+            to be sent on flush and close.
+        :param bool stamp: Add the send time to every message.
 
         """
         super(ZmqHandler, self).__init__()
 
         assert system in TOPIC_SYSTEM
+        assert overflow in OVERFLOW_POLICIES
         self._system = system
+        self._overflow = overflow
+        self._overflow_level = overflow_level
+        self._queue = None
+        self._sender = None
+        self._batch_size = batch_size or 1
+        self._batch_interval = (batch_interval or 0) / 1000.0
+        self._strings = StringTable() if intern else None
+        if compression is not None and not isinstance(compression, Codec):
+            compression = ZlibCodec(compression)
+        assert compression is None or \
+            compression.letter not in RESERVED_FLAGS
+        self._codec = compression
+        self._compress_threshold = compress_threshold
+        self._zero_copy_threshold = zero_copy_threshold
+        self._topics = {}
+        self._perf_topics = {}
+        self._frames = FramePool()
+        if rate_limit is not None and not isinstance(rate_limit, RateLimiter):
+            rate_limit = RateLimiter(rate_limit)
+        self._limiter = rate_limit
+        self._spill = None
+        self._spill_path = spill
+        if spill is not None:
+            self._spill = SpillBuffer(spill, spill_size)
+        self._replay_rate = replay_rate
+        self._replay_allowance = 0
+        self._replay_pending = 0
+        self._replayed_at = time.time()
+        self._drain_timeout = drain_timeout
+        self._stamp = stamp
 
         if isinstance(endpoint, zmq.Socket):
             self.socket = endpoint
             self.context = self.socket.context
+            endpoint = cast_unicode(endpoint.getsockopt(zmq.LAST_ENDPOINT))
         else:
             self.context = context or zmq.Context.instance()
             self.socket = self.context.socket(zmq.PUSH)
             self.socket.connect(endpoint)
+        self._endpoint = endpoint or None
+        self._socket_options = [
+            (option, self.socket.getsockopt(option))
+            for option in FORK_SOCKET_OPTIONS
+        ]
+
+        if (batch_size is not None or spill is not None) and \
+                queue_size is None:
+            queue_size = DEFAULT_QUEUE_SIZE
+
+        if queue_size is not None:
+            self._queue = queue.Queue(queue_size)
+            self._start_sender()
+
+        self._performance = performance or metrics
+        if self._performance:
+            perf.add_handler(self, timings=performance)
+        _handlers.add(self)
+
+    def _start_sender(self):
+        """Start the thread sending the queued records."""
+        self._sender = threading.Thread(
+            target=self._send_loop, name='ZmqHandler sender'
+        )
+        self._sender.daemon = True
+        self._sender.start()
+
+    def _rebuild(self):
+        """Replace what a child process inherited from its parent.
+
+        The context and socket of the parent are left alone, closing
+        them could disturb the parent. Records still queued or
+        suppressed in the parent are sent by the parent. The string
+        dictionary, rate limiter and spill file are per process, the
+        counters start over.
+        """
+        self.acquire()
+        try:
+            if not self._forked:
+                return
+            self._forked = False
+            self.context = type(self.context)()
+            self.socket = self.context.socket(zmq.PUSH)
+            for option, value in self._socket_options:
+                self.socket.setsockopt(option, value)
+            if self._endpoint is not None:
+                self.socket.connect(self._endpoint)
+            if self.formatter is not None:
+                self.formatter._update_process()
+            if self._strings is not None:
+                strings = self._strings
+                self._strings = StringTable(
+                    strings.fields, strings.max_size, strings.max_age
+                )
+            self._frames = FramePool()
+            if self._limiter is not None:
+                self._limiter.reset()
+            if self._spill is not None:
+                self._spill = SpillBuffer(
+                    '{0}.{1}'.format(self._spill_path, os.getpid()),
+                    self._spill.size, self._spill.segment_size
+                )
+            self.queued = self.dropped = 0
+            self.spilled = self.spilled_bytes = self.replayed = 0
+            if self._queue is not None:
+                self._queue = queue.Queue(self._queue.maxsize)
+                self._start_sender()
+        finally:
+            self.release()
 
     def set_topic(self, encoding):
         """Set message topic elements.
@@ -110,22 +512,436 @@ class ZmqHandler(logging.Handler):
         :param encoding: the encoding topic
 
         """
-        assert encoding in TOPIC_ENCODING
+        get_encoding(encoding)
 
+        flags = TOPIC_DICTIONARY if self._strings else ''
         self.log_topic = TOPIC_SEPARATOR.join(
-            [self._system, TOPIC_LOGGING, encoding]
+            [self._system, TOPIC_LOGGING, encoding, flags]
         )
+        self.perf_topic = TOPIC_SEPARATOR.join(
+            [self._system, TOPIC_PERFORMANCE, encoding]
+        )
+        self._topics = {}
+        self._perf_topics = {}
+
+    def _topic(self, flags, performance=False):
+        """Produce the encoded topic for a message with additional flags."""
+        topics = self._perf_topics if performance else self._topics
+        btopic = topics.get(flags)
+        if btopic is None:
+            topic = self.perf_topic if performance else self.log_topic
+            btopic = topics[flags] = cast_bytes(topic + flags)
+        return btopic
 
     def emit(self, record):
         """Do whatever it takes to actually log the specified logging record.
+
+        Records over the rate limit are held back. In asynchronous mode
+        the record is handed to the sender thread, otherwise it is sent
+        immediately.
         """
+        if self._forked:
+            self._rebuild()
+        if self._limiter is None:
+            self._dispatch(record)
+        else:
+            for rec in self._limiter.check(record):
+                self._dispatch(rec)
+
+    def _dispatch(self, record):
+        """Send or enqueue a record that passed the rate limiter."""
+        if self._queue is None:
+            self._send(record)
+        else:
+            self._enqueue(record)
+
+    def _format(self, record):
+        """Format a record for transmission over this connection."""
+        fmt = self.formatter
+        data = fmt._extract_record(record)
+        if self._strings is not None:
+            data = self._strings.intern(data)
+        return cast_bytes(fmt.serialize(data))
+
+    def _format_into(self, record, frame):
+        """Format a record for this connection, appending it to frame."""
+        fmt = self.formatter
+        data = fmt._extract_record(record)
+        if self._strings is not None:
+            data = self._strings.intern(data)
+        fmt.serialize_into(data, frame)
+
+    def _send(self, record):
+        """Format a record and send it over the socket."""
         try:
-            bmsg = cast_bytes(self.format(record))
-            btopic = cast_bytes(self.log_topic)
+            bmsg = self._format(record)
         except Exception:
             self.handleError(record)
             return
-        self.socket.send_multipart([btopic, bmsg])
+        self._send_body('', bmsg)
+
+    def _send_body(self, flags, body, performance=False, count=1):
+        """Send a message body, compressing it when worthwhile.
+
+        With a spill file the body is written to it when the socket
+        does not take it right away, or when the file still holds
+        messages that have to be sent first.
+
+        :param int count: the number of records in the body
+        :return: the message tracker when body itself is still in use by
+            0MQ after this call, otherwise None.
+        """
+        codec = self._codec
+        if codec is not None and len(body) >= self._compress_threshold:
+            body = codec.compress(body)
+            flags += codec.letter
+            tracked = False
+        else:
+            tracked = True
+        btopic = self._topic(flags, performance)
+        frames = [btopic, body]
+        stamp = 0.0
+        if self._stamp:
+            stamp = time.time()
+            frames.append(STAMP.pack(stamp))
+        spill = self._spill
+        if spill:
+            # keep the order, the replay sends it without using the allowance
+            self._spill_body(btopic, body, count, stamp)
+            self._replay_pending += len(body)
+            return None
+        send_flags = 0 if spill is None else zmq.NOBLOCK
+        try:
+            if len(body) < self._zero_copy_threshold:
+                self.socket.send_multipart(frames, send_flags)
+                return None
+            tracker = self.socket.send_multipart(
+                frames, send_flags, copy=False, track=True
+            )
+        except zmq.Again:
+            if spill is None:
+                raise
+            self._spill_body(btopic, body, count, stamp)
+            return None
+        return tracker if tracked else None
+
+    def _spill_body(self, btopic, body, count, stamp):
+        """Write a message to the spill file."""
+        self._spill.append(btopic, body, count, stamp)
+        self.spilled += count
+        self.spilled_bytes += len(btopic) + len(body)
+
+    def _send_spilled(self):
+        """Send the oldest message of the spill file.
+
+        :return int: the size of its body
+        :raises zmq.Again: when the socket does not take it right away
+        """
+        spill = self._spill
+        btopic, body, count, stamp = spill.peek()
+        frames = [btopic, body]
+        if stamp:
+            frames.append(STAMP.pack(stamp))
+        self.socket.send_multipart(frames, zmq.NOBLOCK)
+        spill.pop()
+        self.replayed += count
+        return len(body)
+
+    def _replay(self):
+        """Send messages from the spill file, within the replay rate.
+
+        Messages added while the file was being replayed are sent on top
+        of the replay rate, their bytes are only used up once sent. Stops
+        as soon as the socket does not take a message right away.
+        """
+        spill = self._spill
+        now = time.time()
+        rate = self._replay_rate
+        self._replay_allowance = min(
+            self._replay_allowance + (now - self._replayed_at) * rate,
+            rate * REPLAY_INTERVAL
+        )
+        self._replayed_at = now
+        while spill and self._replay_allowance + self._replay_pending > 0:
+            try:
+                size = self._send_spilled()
+            except zmq.Again:
+                return
+            pending = min(size, self._replay_pending)
+            self._replay_pending -= pending
+            self._replay_allowance -= size - pending
+        if not spill:
+            self._replay_pending = 0
+
+    def _drain(self):
+        """Send the whole spill file, regardless of the replay rate.
+
+        Waits at most the drain timeout for the socket to take the
+        messages, what it did not take by then stays in the file.
+        """
+        spill = self._spill
+        deadline = time.time() + self._drain_timeout
+        while spill:
+            try:
+                self._send_spilled()
+            except zmq.Again:
+                timeout = deadline - time.time()
+                if timeout <= 0 or \
+                        not self.socket.poll(int(timeout * 1000), zmq.POLLOUT):
+                    return
+        self._replay_pending = 0
+
+    def _send_batch(self, records):
+        """Format a list of records and send them as one message.
+
+        Timing records among them are sent in a message of their own.
+        """
+        if self._performance:
+            timings = [item for item in records if type(item) is dict]
+            if timings:
+                records = [item for item in records if type(item) is not dict]
+                self._send_timings(timings)
+                if not records:
+                    return
+        if len(records) == 1:
+            self._send(records[0])
+            return
+        self._send_frame(records, self._format_into)
+
+    def _send_frame(self, items, format_into, performance=False):
+        """Format items into a batch frame and send it."""
+        frame = self._frames.acquire()
+        tracker = None
+        try:
+            count = 0
+            for item in items:
+                start = frame.length
+                frame.write(BATCH_HEADER.pack(0))
+                try:
+                    format_into(item, frame)
+                except Exception:
+                    frame.length = start
+                    self.handleError(item)
+                    continue
+                size = frame.length - start - BATCH_HEADER.size
+                BATCH_HEADER.pack_into(frame.buf, start, size)
+                count += 1
+            if count:
+                tracker = self._send_body(TOPIC_BATCH, frame.view(),
+                                          performance, count)
+        finally:
+            self._frames.release(frame, tracker)
+
+    def send_perf_data(self, data):
+        """Send performance data on the performance topic.
+
+        In asynchronous mode the data is queued like a record, but is
+        dropped instead of waiting when the queue is full.
+
+        :param dict data: the performance data, see
+            :py:mod:`~distlog.logger.perf`.
+        """
+        if self._forked:
+            self._rebuild()
+        self.acquire()
+        try:
+            if self._queue is None:
+                self._send_timings([data])
+                return
+            try:
+                self._queue.put_nowait(data)
+                self.queued += 1
+            except queue.Full:
+                self.dropped += 1
+        finally:
+            self.release()
+
+    def _perf_data(self, data):
+        """Add the envelope of the formatter to performance data."""
+        result = dict(self.formatter.envelope)
+        result.update(data)
+        return result
+
+    def _format_perf_into(self, data, frame):
+        """Format performance data, appending it to frame."""
+        self.formatter.serialize_into(self._perf_data(data), frame)
+
+    def _send_timings(self, timings):
+        """Send performance data on the performance topic."""
+        if len(timings) > 1:
+            self._send_frame(timings, self._format_perf_into, True)
+            return
+        try:
+            body = cast_bytes(self.formatter.serialize(self._perf_data(timings[0])))
+        except Exception:
+            self.handleError(None)
+            return
+        self._send_body('', body, True)
+
+    def _enqueue(self, record):
+        """Place a record on the queue, applying the overflow policy.
+
+        Called with the handler lock held so the counters need no
+        additional protection.
+        """
+        policy = self._overflow
+        if policy == OVERFLOW_BLOCK:
+            self._queue.put(record)
+        elif policy == OVERFLOW_DROP_NEWEST:
+            try:
+                self._queue.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+                return
+        elif policy == OVERFLOW_DROP_OLDEST:
+            while True:
+                try:
+                    self._queue.put_nowait(record)
+                    break
+                except queue.Full:
+                    pass
+                try:
+                    self._queue.get_nowait()
+                    self._queue.task_done()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+        else:
+            try:
+                self._queue.put_nowait(record)
+            except queue.Full:
+                if record.levelno < self._overflow_level:
+                    self.dropped += 1
+                    return
+                self._queue.put(record)
+        self.queued += 1
+
+    def _collect(self):
+        """Take the next batch of records from the queue.
+
+        Blocks until at least one item is available, then gathers more
+        until the batch is full or the batch interval expired. While the
+        spill file holds messages it waits at most the replay interval,
+        with a rate limiter at most until its next summary is due. Both
+        may return an empty batch.
+        """
+        timeout = REPLAY_INTERVAL if self._spill else None
+        limiter = self._limiter
+        if limiter is not None:
+            # a suppression may start while waiting, wake up in time for it
+            if limiter.next_due is None:
+                wait = limiter.interval
+            else:
+                wait = max(0.0, limiter.next_due - time.time())
+            timeout = wait if timeout is None else min(timeout, wait)
+        if timeout is not None:
+            try:
+                batch = [self._queue.get(timeout=timeout)]
+            except queue.Empty:
+                return []
+        else:
+            batch = [self._queue.get()]
+        deadline = time.time() + self._batch_interval
+        while len(batch) < self._batch_size and \
+                batch[-1] is not _STOP and batch[-1] is not _FLUSH:
+            try:
+                timeout = deadline - time.time()
+                if timeout > 0:
+                    batch.append(self._queue.get(timeout=timeout))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _send_loop(self):
+        """Sender thread: send queued records until told to stop.
+
+        On a flush or stop the whole spill file is sent.
+        """
+        while True:
+            batch = self._collect()
+            stop = bool(batch) and batch[-1] is _STOP
+            drain = stop or (bool(batch) and batch[-1] is _FLUSH)
+            records = batch[:-1] if drain else batch
+            try:
+                if records:
+                    self._send_batch(records)
+                if self._limiter is not None:
+                    self._send_due_summaries()
+                if self._spill:
+                    if drain:
+                        self._drain()
+                    else:
+                        self._replay()
+            except Exception:
+                self.handleError(records[0] if records else None)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if stop:
+                return
+
+    def _send_due_summaries(self):
+        """Send the summaries the rate limiter holds for too long."""
+        limiter = self._limiter
+        if limiter.next_due is None or time.time() < limiter.next_due:
+            return
+        self.acquire()
+        try:
+            summaries = limiter.due(time.time())
+        finally:
+            self.release()
+        if summaries:
+            self._send_batch(summaries)
+
+    def _flush_suppressed(self):
+        """Send the summaries of the records held back by the rate limiter."""
+        if self._limiter is None:
+            return
+        self.acquire()
+        try:
+            for summary in self._limiter.drain():
+                self._dispatch(summary)
+        finally:
+            self.release()
+
+    def flush(self):
+        """Wait until all queued records have been sent.
+
+        Summaries of rate limited records are sent first. With a spill
+        file the sender thread also sends the file, for at most the
+        drain timeout. A handler not used since the process forked has
+        nothing to send.
+        """
+        if self._forked:
+            return
+        self._flush_suppressed()
+        if self._queue is not None and self._sender.is_alive():
+            if self._spill is not None:
+                self._queue.put(_FLUSH)
+            self._queue.join()
+
+    def close(self):
+        """Stop the sender thread after it sent all queued records.
+
+        The records the spill file still holds after the drain timeout
+        are counted as dropped.
+        """
+        perf.remove_handler(self)
+        if self._forked:
+            # not used since the fork, what it holds belongs to the parent
+            super(ZmqHandler, self).close()
+            return
+        self._flush_suppressed()
+        if self._sender is not None and self._sender.is_alive():
+            self._queue.put(_STOP)
+            self._sender.join()
+        if self._spill is not None:
+            self.dropped += len(self._spill)
+            self._spill.close()
+            self._spill = None
+        super(ZmqHandler, self).close()
 
     def setFormatter(self, fmt):  # noqa
         """Set the formatter for this handler."""
@@ -134,9 +950,3 @@ class ZmqHandler(logging.Handler):
                             ' derived object')
         super(ZmqHandler, self).setFormatter(fmt)
         self.set_topic(fmt.encoding)
-
-#    def send_perf_data(self, data):
-#        bdata = cast_bytes(data)
-#        btopic = cast_bytes(self.perf_topic)
-#
-#        self.socket.send_multipart([btopic, bdata])
@@ -0,0 +1,427 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Aggregate metrics in process and publish them periodically.
+
+Sending a performance message for every event does not scale. The
+functions in this module only update in-process aggregates, which are
+published on the performance topic every `interval` seconds:
+
+.. code-block:: python
+
+    from distlog import metrics
+
+    metrics.start(interval=10)
+    ...
+    metrics.count('orders')
+    metrics.gauge('queue.length', len(queue))
+    metrics.observe('order.amount', amount)
+
+Metrics are identified by their name and a label. The label defaults to
+the message of the current :py:class:`~distlog.Task`, so the same
+metric is kept apart per kind of task.
+
+Counters
+    Sum of the counted values. The published value is the increase
+    since the previous publication.
+
+Gauges
+    The value last set. All gauges are published every time.
+
+Histograms
+    Distribution of the observed values in log-linear buckets: every
+    power of two is divided in :py:data:`SUB_BUCKETS` buckets of equal
+    width, so a value is known within about 3%. Histograms of many
+    producers are merged by adding the bucket counts, see
+    :py:mod:`distlogd.metrics`.
+    Zero and negative values are counted in the zero bucket.
+
+Counters and histograms are kept per thread. A thread only updates its
+own aggregates, so no locks are needed. The publisher adds up the
+aggregates of all threads.
+
+The published message is a dict:
+
+.. code-block:: python
+
+    {
+        'type': 'metrics',
+        'created': 1500000000.0,
+        'interval': 10.0,
+        'counters': [name, label, increase, ...],
+        'gauges': [name, label, value, ...],
+        'histograms': [
+            [name, label, count, sum, zero, [bucket, count, ...]],
+            ...
+        ],
+    }
+
+A bucket number `b` stands for the values from
+``ldexp(0.5 + (b % SUB_BUCKETS) / (2.0 * SUB_BUCKETS), b // SUB_BUCKETS)``
+up to the lower bound of bucket `b + 1`.
+"""
+
+__copyright__ = "Copyright (C) 2017 Leo Noordergraaf"
+__licence__ = "GNU General Public Licence v3"
+
+import math
+import os
+import threading
+import time
+import weakref
+
+from . import perf
+from .context import _context
+
+SUB_BUCKETS = 16
+"""Number of buckets per power of two."""
+
+_instances = weakref.WeakSet()
+
+
+def _after_fork():
+    """Let the metrics a child process inherited start over."""
+    for metrics in list(_instances):
+        metrics._after_fork()
+
+
+try:
+    os.register_at_fork(after_in_child=_after_fork)
+except AttributeError:  # Python < 3.7, only processes of multiprocessing
+    from multiprocessing.util import register_after_fork
+    register_after_fork(_instances, lambda instances: _after_fork())
+
+
+def bucket(value):
+    """
+    Determine the histogram bucket of a positive value.
+
+    :param float value: the value, greater than 0.
+    :return int: the bucket number.
+    """
+    mantissa, exponent = math.frexp(value)
+    return exponent * SUB_BUCKETS + int((mantissa - 0.5) * 2 * SUB_BUCKETS)
+
+
+def bucket_bounds(number):
+    """
+    Produce the range of values in a histogram bucket.
+
+    :param int number: the bucket number.
+    :return tuple: lower bound (inclusive) and upper bound (exclusive).
+    """
+    exponent, sub = divmod(number, SUB_BUCKETS)
+    lower = math.ldexp(0.5 + sub / (2.0 * SUB_BUCKETS), exponent)
+    upper = math.ldexp(0.5 + (sub + 1) / (2.0 * SUB_BUCKETS), exponent)
+    return lower, upper
+
+
+class Histogram(object):
+
+    """Log-linear histogram of the values observed by one thread."""
+
+    __slots__ = ('count', 'sum', 'zero', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.zero = 0
+        self.buckets = {}
+
+    def observe(self, value):
+        """
+        Add a value to the histogram.
+
+        :param float value: the observed value.
+        """
+        if value > 0:
+            mantissa, exponent = math.frexp(value)
+            number = exponent * SUB_BUCKETS + \
+                int((mantissa - 0.5) * 2 * SUB_BUCKETS)
+            buckets = self.buckets
+            buckets[number] = buckets.get(number, 0) + 1
+        else:
+            self.zero += 1
+        self.sum += value
+        self.count += 1
+
+    def add(self, other):
+        """
+        Add the values of another histogram.
+
+        :param other: the histogram to add.
+        :type other: :py:class:`Histogram`
+        """
+        self.count += other.count
+        self.sum += other.sum
+        self.zero += other.zero
+        buckets = self.buckets
+        for number, count in list(other.buckets.items()):
+            buckets[number] = buckets.get(number, 0) + count
+
+    def copy(self):
+        """
+        Produce a copy of this histogram.
+
+        :rtype: :py:class:`Histogram`
+        """
+        result = Histogram()
+        result.add(self)
+        return result
+
+
+class _Shard(object):
+
+    """Counters and histograms of a single thread."""
+
+    __slots__ = ('thread', 'counters', 'histograms')
+
+    def __init__(self, thread):
+        self.thread = thread
+        self.counters = {}
+        self.histograms = {}
+
+
+class Metrics(object):
+
+    """
+    Collection of counters, gauges and histograms.
+
+    The module functions operate on a default instance.
+
+    A child process, for instance a pre-forked worker, starts with empty
+    counters and histograms, the parent publishes what it counted itself.
+    Gauges keep their value. When the parent published periodically the
+    child does so as well.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._collect_lock = threading.Lock()
+        self._shards = []
+        self._retired = _Shard(None)
+        self._gauges = {}
+        self._published_counters = {}
+        self._published_histograms = {}
+        self._published = time.time()
+        self._flusher = None
+        _instances.add(self)
+
+    def _after_fork(self):
+        """Drop the aggregates and thread inherited from the parent."""
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._collect_lock = threading.Lock()
+        self._shards = []
+        self._retired = _Shard(None)
+        self._published_counters = {}
+        self._published_histograms = {}
+        self._published = time.time()
+        flusher, self._flusher = self._flusher, None
+        if flusher is not None:
+            self.start(flusher[2])
+
+    def _shard(self):
+        """Produce the shard of the current thread."""
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = _Shard(threading.current_thread())
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    @staticmethod
+    def _label(label):
+        if label is None:
+            top = _context.top
+            label = top.msg if top is not None else ''
+        return label
+
+    def count(self, name, value=1, label=None):
+        """
+        Increase a counter.
+
+        :param string name: name of the counter.
+        :param int value: the increment.
+        :param string label: label, defaults to the current task message.
+        """
+        counters = self._shard().counters
+        key = (name, self._label(label))
+        counters[key] = counters.get(key, 0) + value
+
+    def gauge(self, name, value, label=None):
+        """
+        Set a gauge.
+
+        :param string name: name of the gauge.
+        :param float value: the current value.
+        :param string label: label, defaults to the current task message.
+        """
+        self._gauges[(name, self._label(label))] = value
+
+    def observe(self, name, value, label=None):
+        """
+        Add a value to a histogram.
+
+        :param string name: name of the histogram.
+        :param float value: the observed value.
+        :param string label: label, defaults to the current task message.
+        """
+        histograms = self._shard().histograms
+        key = (name, self._label(label))
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def _totals(self):
+        """Add up the aggregates of all threads.
+
+        Shards of threads that ended are merged into the retired shard
+        so they do not have to be visited again.
+        """
+        with self._lock:
+            retired = self._retired
+            for shard in [s for s in self._shards if not s.thread.is_alive()]:
+                self._shards.remove(shard)
+                _merge(retired, shard)
+            counters = dict(retired.counters)
+            histograms = dict((key, h.copy())
+                              for key, h in retired.histograms.items())
+            shards = list(self._shards)
+        for shard in shards:
+            for key, value in list(shard.counters.items()):
+                counters[key] = counters.get(key, 0) + value
+            for key, histogram in list(shard.histograms.items()):
+                total = histograms.get(key)
+                if total is None:
+                    histograms[key] = histogram.copy()
+                else:
+                    total.add(histogram)
+        return counters, histograms
+
+    def collect(self):
+        """
+        Produce the metrics message.
+
+        Counters and histograms contain what was added since the
+        previous call.
+
+        :return dict: the message, see :py:mod:`distlog.logger.metrics`.
+        """
+        with self._collect_lock:
+            return self._collect()
+
+    def _collect(self):
+        now = time.time()
+        counters, histograms = self._totals()
+
+        counter_data = []
+        published = self._published_counters
+        for key, value in counters.items():
+            increase = value - published.get(key, 0)
+            if increase:
+                counter_data.extend((key[0], key[1], increase))
+        self._published_counters = counters
+
+        histogram_data = []
+        published = self._published_histograms
+        for key, histogram in histograms.items():
+            previous = published.get(key)
+            if previous is None:
+                previous = Histogram()
+            count = histogram.count - previous.count
+            if not count:
+                continue
+            buckets = []
+            for number, n in sorted(histogram.buckets.items()):
+                n -= previous.buckets.get(number, 0)
+                if n:
+                    buckets.extend((number, n))
+            histogram_data.append([
+                key[0], key[1], count, histogram.sum - previous.sum,
+                histogram.zero - previous.zero, buckets
+            ])
+        self._published_histograms = histograms
+
+        gauge_data = []
+        for key, value in list(self._gauges.items()):
+            gauge_data.extend((key[0], key[1], value))
+
+        interval = now - self._published
+        self._published = now
+        return {
+            'type': 'metrics',
+            'created': now,
+            'interval': interval,
+            'counters': counter_data,
+            'gauges': gauge_data,
+            'histograms': histogram_data,
+        }
+
+    def flush(self):
+        """
+        Publish the metrics on the performance topic.
+
+        Nothing is sent when no handler is registered for the metrics,
+        see :py:func:`~distlog.logger.perf.add_handler`.
+        """
+        data = self.collect()
+        if data['counters'] or data['gauges'] or data['histograms']:
+            perf.publish_metrics(data)
+
+    def start(self, interval=10.0):
+        """
+        Publish the metrics every `interval` seconds.
+
+        A daemon thread calls :py:meth:`flush`.
+
+        :param float interval: seconds between publications.
+        """
+        if self._flusher is not None:
+            return
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                self.flush()
+
+        thread = threading.Thread(target=run, name='distlog metrics')
+        thread.daemon = True
+        self._flusher = (thread, stop, interval)
+        thread.start()
+
+    def stop(self):
+        """Stop the periodic publication, publishing once more."""
+        if self._flusher is None:
+            return
+        thread, stop, _ = self._flusher
+        self._flusher = None
+        stop.set()
+        thread.join()
+        self.flush()
+
+
+def _merge(target, shard):
+    """Add the aggregates of shard to target."""
+    for key, value in shard.counters.items():
+        target.counters[key] = target.counters.get(key, 0) + value
+    for key, histogram in shard.histograms.items():
+        total = target.histograms.get(key)
+        if total is None:
+            target.histograms[key] = histogram.copy()
+        else:
+            total.add(histogram)
+
+
+_metrics = Metrics()
+
+count = _metrics.count
+gauge = _metrics.gauge
+observe = _metrics.observe
+collect = _metrics.collect
+flush = _metrics.flush
+start = _metrics.start
+stop = _metrics.stop
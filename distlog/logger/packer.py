@@ -0,0 +1,186 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""Compact binary encoding for log records.
+
+A small, pure Python implementation of the MessagePack_ encoder.
+MessagePack is a typed, binary and language neutral encoding that is
+considerably more compact than JSON. Only the types that occur in log
+records are supported: None, booleans, integers, floats, strings, bytes,
+lists, tuples and dicts. Any other object is encoded as its string
+representation.
+
+The :py:class:`~distlog.MsgPackFormatter` uses the `msgpack` package
+instead when it is installed.
+
+.. _MessagePack: https://msgpack.org
+
+"""
+
+__copyright__ = "Copyright (C) 2017 Leo Noordergraaf"
+__licence__ = "GNU General Public Licence v3"
+
+import struct
+
+import six
+
+_B = struct.Struct('>B')
+_BB = struct.Struct('>BB')
+_BH = struct.Struct('>BH')
+_BI = struct.Struct('>BI')
+_BQ = struct.Struct('>BQ')
+_Bb = struct.Struct('>Bb')
+_Bh = struct.Struct('>Bh')
+_Bi = struct.Struct('>Bi')
+_Bq = struct.Struct('>Bq')
+_Bd = struct.Struct('>Bd')
+
+
+def _pack_int(obj, buf):
+    if 0 <= obj < 0x80:
+        buf += _B.pack(obj)
+    elif -0x20 <= obj < 0:
+        buf += _B.pack(obj & 0xff)
+    elif 0 <= obj:
+        if obj <= 0xff:
+            buf += _BB.pack(0xcc, obj)
+        elif obj <= 0xffff:
+            buf += _BH.pack(0xcd, obj)
+        elif obj <= 0xffffffff:
+            buf += _BI.pack(0xce, obj)
+        elif obj <= 0xffffffffffffffff:
+            buf += _BQ.pack(0xcf, obj)
+        else:
+            _pack_text(str(obj), buf)
+    else:
+        if obj >= -0x80:
+            buf += _Bb.pack(0xd0, obj)
+        elif obj >= -0x8000:
+            buf += _Bh.pack(0xd1, obj)
+        elif obj >= -0x80000000:
+            buf += _Bi.pack(0xd2, obj)
+        elif obj >= -0x8000000000000000:
+            buf += _Bq.pack(0xd3, obj)
+        else:
+            _pack_text(str(obj), buf)
+
+
+def _pack_raw(data, buf):
+    n = len(data)
+    if n < 32:
+        buf += _B.pack(0xa0 | n)
+    elif n <= 0xff:
+        buf += _BB.pack(0xd9, n)
+    elif n <= 0xffff:
+        buf += _BH.pack(0xda, n)
+    else:
+        buf += _BI.pack(0xdb, n)
+    buf += data
+
+
+def _pack_text(obj, buf):
+    _pack_raw(obj.encode('utf-8'), buf)
+
+
+def _pack_bin(obj, buf):
+    n = len(obj)
+    if n <= 0xff:
+        buf += _BB.pack(0xc4, n)
+    elif n <= 0xffff:
+        buf += _BH.pack(0xc5, n)
+    else:
+        buf += _BI.pack(0xc6, n)
+    buf += obj
+
+
+def _pack_header(n, fix, code16, code32, buf):
+    if n < 16:
+        buf += _B.pack(fix | n)
+    elif n <= 0xffff:
+        buf += _BH.pack(code16, n)
+    else:
+        buf += _BI.pack(code32, n)
+
+
+def _pack_dict(obj, buf):
+    _pack_header(len(obj), 0x80, 0xde, 0xdf, buf)
+    for key, value in six.iteritems(obj):
+        _pack(key, buf)
+        _pack(value, buf)
+
+
+def _pack_list(obj, buf):
+    _pack_header(len(obj), 0x90, 0xdc, 0xdd, buf)
+    for value in obj:
+        _pack(value, buf)
+
+
+def _pack_float(obj, buf):
+    buf += _Bd.pack(0xcb, obj)
+
+
+_dispatch = {
+    six.text_type: _pack_text,
+    int: _pack_int,
+    float: _pack_float,
+    dict: _pack_dict,
+    list: _pack_list,
+    tuple: _pack_list,
+}
+
+
+def _pack(obj, buf):
+    # exact type lookup for the common cases, isinstance for the rest
+    pack = _dispatch.get(type(obj))
+    if pack is not None:
+        pack(obj, buf)
+    elif obj is None:
+        buf += b'\xc0'
+    elif obj is True:
+        buf += b'\xc3'
+    elif obj is False:
+        buf += b'\xc2'
+    elif isinstance(obj, six.text_type):
+        _pack_text(obj, buf)
+    elif isinstance(obj, six.binary_type):
+        # Python 2 strings are text as far as the receiver is concerned
+        if six.PY2:
+            _pack_raw(obj, buf)
+        else:
+            _pack_bin(obj, buf)
+    elif isinstance(obj, six.integer_types):
+        _pack_int(obj, buf)
+    elif isinstance(obj, float):
+        _pack_float(obj, buf)
+    elif isinstance(obj, dict):
+        _pack_dict(obj, buf)
+    elif isinstance(obj, (list, tuple)):
+        _pack_list(obj, buf)
+    else:
+        _pack_text(six.text_type(obj), buf)
+
+
+def packb(obj):
+    """Encode an object.
+
+    :param obj: the object to encode
+    :return bytes: the MessagePack encoded object
+
+    """
+    buf = bytearray()
+    _pack(obj, buf)
+    return bytes(buf)
+
+
+def pack_into(obj, out):
+    """Encode an object, appending it to a buffer.
+
+    Saves the bytes object :py:func:`packb` creates.
+
+    :param obj: the object to encode
+    :param out: object with a `write` method taking a bytes-like object
+
+    """
+    buf = bytearray()
+    _pack(obj, buf)
+    out.write(buf)
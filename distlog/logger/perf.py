@@ -0,0 +1,110 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Publish performance data.
+
+Every :py:class:`~distlog.Task` measures how long it ran. When it ends
+a compact timing record is handed to the handlers registered here,
+registered for the timings, which send it on the performance topic:
+
+.. code-block:: python
+
+    {
+        'task': '5b0c...e2/3',          # task id
+        'msg': 'fetching order %s',     # unformatted task message
+        'created': 1500000000.123,      # wall clock time at the end
+        'duration': 0.0123,             # seconds, monotonic clock
+        'cpu': 0.0101,                  # seconds, only with cpu timing
+        'failed': False,                # ended by an exception
+    }
+
+Only sampled tasks are published, see :py:mod:`~distlog.logger.sampling`.
+
+The aggregated metrics of :py:mod:`~distlog.logger.metrics` go to the
+handlers registered for the metrics, a handler may take either or both.
+"""
+
+__copyright__ = "Copyright (C) 2017 Leo Noordergraaf"
+__licence__ = "GNU General Public Licence v3"
+
+import time
+
+try:
+    clock = time.monotonic
+except AttributeError:  # Python < 3.3
+    clock = time.time
+
+try:
+    cpu_clock = time.thread_time
+except AttributeError:  # Python < 3.7
+    cpu_clock = getattr(time, 'process_time', time.clock)
+
+handlers = []
+"""Handlers receiving the task timings, see :py:func:`add_handler`."""
+
+metrics_handlers = []
+"""Handlers receiving the aggregated metrics, see :py:func:`add_handler`."""
+
+cpu_timing = False
+"""Also measure the CPU time of tasks, see :py:func:`set_cpu_timing`."""
+
+
+def add_handler(handler, timings=True, metrics=True):
+    """
+    Send the performance data to a handler.
+
+    :param handler: object with a `send_perf_data(data)` method,
+        usually a :py:class:`~distlog.ZmqHandler`.
+    :param bool timings: send the timing records of finished tasks.
+    :param bool metrics: send the aggregated metrics.
+    """
+    if timings and handler not in handlers:
+        handlers.append(handler)
+    if metrics and handler not in metrics_handlers:
+        metrics_handlers.append(handler)
+
+
+def remove_handler(handler):
+    """
+    Stop sending the performance data to a handler.
+
+    :param handler: a handler passed to :py:func:`add_handler`.
+    """
+    if handler in handlers:
+        handlers.remove(handler)
+    if handler in metrics_handlers:
+        metrics_handlers.remove(handler)
+
+
+def set_cpu_timing(enabled):
+    """
+    Switch measuring the CPU time of tasks on or off.
+
+    The CPU time is measured per thread where the platform supports it,
+    otherwise per process.
+
+    :param bool enabled: True to add the `cpu` field to the timing records.
+    """
+    global cpu_timing
+    cpu_timing = bool(enabled)
+
+
+def publish(data):
+    """
+    Hand a timing record to the handlers registered for the timings.
+
+    :param dict data: the performance data.
+    """
+    for handler in handlers:
+        handler.send_perf_data(data)
+
+
+def publish_metrics(data):
+    """
+    Hand metrics to the handlers registered for the metrics.
+
+    :param dict data: the metrics message.
+    """
+    for handler in metrics_handlers:
+        handler.send_perf_data(data)
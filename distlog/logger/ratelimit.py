@@ -0,0 +1,201 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Limit the number of records sent per call site.
+
+A hot loop calling ``logger.warning`` should not flood distlogd and
+every plugin behind it. The :py:class:`RateLimiter` gives every call
+site, identified by `(pathname, lineno, levelno)`, a token bucket.
+Records created without caller information are told apart by
+`(name, msg, levelno)` instead.
+Records arriving while the bucket is empty are counted instead of sent
+and are reported later on by a single summary record, at least every
+`interval` seconds.
+"""
+
+__copyright__ = "Copyright (C) 2017 Leo Noordergraaf"
+__licence__ = "GNU General Public Licence v3"
+
+import collections
+import copy
+
+import six
+
+SUPPRESSED_MSG = '%d similar messages suppressed'
+SUMMARY_INTERVAL = 10.0
+"""Default maximum age in seconds of a suppressed record before its
+summary is sent."""
+
+
+class _Site(object):
+
+    """Token bucket and suppression counters of a single call site."""
+
+    __slots__ = ('tokens', 'stamp', 'suppressed', 'first', 'last', 'record')
+
+    def __init__(self, tokens, stamp):
+        self.tokens = tokens
+        self.stamp = stamp
+        self.suppressed = 0
+        self.first = None
+        self.last = None
+        self.record = None
+
+
+class RateLimiter(object):
+
+    """
+    Token bucket per call site.
+
+    Every call site may send `burst` records at once and `rate` records
+    per second on average. Records over the limit are suppressed. The
+    first record allowed after a suppression is preceded by a summary
+    record, a copy of the first suppressed record with the message
+    ``N similar messages suppressed`` and the attributes `suppressed`,
+    `first_created` and `last_created`.
+
+    A call site that keeps being suppressed, or goes quiet after a
+    burst, is summarized once its first suppressed record is `interval`
+    seconds old. :py:meth:`check` returns these summaries along with any
+    record passing through it, :py:meth:`due` produces them when nothing
+    is logged. :py:attr:`next_due` tells when the next one is due.
+
+    At most `max_sites` call sites are tracked. The least recently used
+    site is forgotten when a new one arrives, its pending summary is
+    sent at that moment.
+
+    The limiter is not thread safe, the handler calls it with its lock
+    held.
+
+    :param float rate: records per second per call site.
+    :param int burst: bucket size, defaults to `rate` with a minimum of 1.
+    :param int max_sites: maximum number of call sites tracked.
+    :param float interval: maximum age in seconds of a suppressed record
+        before its summary is sent.
+    """
+
+    next_due = None
+    """Time the next summary is due, None without suppressed records."""
+
+    def __init__(self, rate, burst=None, max_sites=1024,
+                 interval=SUMMARY_INTERVAL):
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(rate, 1))
+        self.max_sites = max_sites
+        self.interval = interval
+        self._sites = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._sites)
+
+    def check(self, record):
+        """
+        Pass a record through the limiter.
+
+        :param record: the LogRecord to send.
+        :return: sequence of the records to send instead, empty when
+            the record is suppressed.
+        """
+        if record.lineno:
+            key = (record.pathname, record.lineno, record.levelno)
+        else:
+            # the caller was not looked up, the logger and message remain
+            msg = record.msg
+            if not isinstance(msg, six.string_types):
+                msg = repr(msg)
+            key = (record.name, msg, record.levelno)
+        now = record.created
+        due = ()
+        if self.next_due is not None and now >= self.next_due:
+            due = tuple(self.due(now))
+        sites = self._sites
+        site = sites.pop(key, None)
+        evicted = None
+        if site is None:
+            site = _Site(self.burst, now)
+            if len(sites) >= self.max_sites:
+                evicted = self._summary(sites.popitem(last=False)[1])
+        else:
+            elapsed = now - site.stamp
+            if elapsed > 0:
+                site.tokens = min(self.burst, site.tokens + elapsed * self.rate)
+                site.stamp = now
+        sites[key] = site
+
+        if site.tokens < 1.0:
+            if site.suppressed == 0:
+                site.first = now
+                site.record = record
+                if self.next_due is None or \
+                        now + self.interval < self.next_due:
+                    self.next_due = now + self.interval
+            site.suppressed += 1
+            site.last = now
+            return due + ((evicted,) if evicted is not None else ())
+        site.tokens -= 1.0
+        summary = self._summary(site) if site.suppressed else None
+        if evicted is None and summary is None and not due:
+            return (record,)
+        return due + tuple(
+            r for r in (evicted, summary, record) if r is not None)
+
+    def reset(self):
+        """Forget all call sites and their suppressed records."""
+        self._sites.clear()
+        self.next_due = None
+
+    def due(self, now):
+        """
+        Produce the summaries of the sites suppressing for `interval`.
+
+        :param float now: the current time.
+        :return list: summary records, oldest call site first.
+        """
+        summaries = []
+        next_due = None
+        for site in self._sites.values():
+            if not site.suppressed:
+                continue
+            if site.first + self.interval <= now:
+                summaries.append(self._summary(site))
+            elif next_due is None or site.first + self.interval < next_due:
+                next_due = site.first + self.interval
+        self.next_due = next_due
+        return summaries
+
+    def drain(self):
+        """
+        Produce the summaries of all sites with suppressed records.
+
+        :return list: summary records, oldest call site first.
+        """
+        summaries = []
+        for site in self._sites.values():
+            if site.suppressed:
+                summaries.append(self._summary(site))
+        self.next_due = None
+        return summaries
+
+    @staticmethod
+    def _summary(site):
+        """Create the summary record of a site and reset its counters."""
+        if not site.suppressed:
+            return None
+        summary = copy.copy(site.record)
+        summary.msg = SUPPRESSED_MSG
+        summary.args = (site.suppressed,)
+        summary.exc_info = None
+        summary.exc_text = None
+        summary.created = site.last
+        summary.msecs = (site.last - int(site.last)) * 1000
+        summary.suppressed = site.suppressed
+        summary.first_created = site.first
+        summary.last_created = site.last
+        if hasattr(summary, 'message'):
+            del summary.message
+        site.suppressed = 0
+        site.first = site.last = site.record = None
+        return summary
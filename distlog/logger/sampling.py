@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Head-based sampling of tasks.
+
+Whether the records of a trace are kept is decided once, when the
+toplevel :py:func:`~distlog.task` is created.
+Subtasks inherit the decision and it travels along with the id returned
+by :py:meth:`~distlog.Task.get_foreign_task`, so a trace spanning
+several processes is either kept or dropped as a whole.
+
+.. code-block:: python
+
+    import distlog
+
+    # keep 1 in 10 requests, but all requests of the admin user
+    distlog.set_sampler(distlog.Sampler(0.1, rules=[
+        lambda ctx: True if ctx.get('user') == 'admin' else None,
+    ]))
+"""
+
+__copyright__ = "Copyright (C) 2017 Leo Noordergraaf"
+__licence__ = "GNU General Public Licence v3"
+
+import random
+
+
+# Suffixes of a foreign task id carrying the sampling decision.
+SAMPLED = ';1'
+UNSAMPLED = ';0'
+
+
+class Sampler(object):
+
+    """
+    Decide which tasks are sampled.
+
+    The rules are consulted in order with the context of the new task,
+    the keyword arguments passed to :py:func:`~distlog.task`.
+    A rule returns True to keep the task, False to drop it or None to
+    leave the decision to the next rule.
+    When no rule decides, the task is kept with probability `rate`.
+
+    :param float rate: fraction of the tasks to keep, 0.0 to 1.0.
+    :param list rules: callables taking the task context.
+    """
+
+    def __init__(self, rate=1.0, rules=()):
+        if not 0.0 <= rate <= 1.0:
+            raise ValueError('sample rate must be between 0 and 1')
+        self.rate = rate
+        self.rules = list(rules)
+        self._random = random.random
+
+    def decide(self, context):
+        """
+        Make the sampling decision for a new toplevel task.
+
+        :param dict context: the keyword arguments of the task.
+        :return bool: True when the records of the task must be kept.
+        """
+        for rule in self.rules:
+            decision = rule(context)
+            if decision is not None:
+                return bool(decision)
+        if self.rate >= 1.0:
+            return True
+        return self._random() < self.rate
+
+
+_sampler = Sampler()
+
+
+def get_sampler():
+    """
+    Return the sampler used by :py:func:`~distlog.task`.
+
+    :rtype: :py:class:`~distlog.Sampler`
+    """
+    return _sampler
+
+
+def set_sampler(sampler):
+    """
+    Replace the sampler used by :py:func:`~distlog.task`.
+
+    :param sampler: the new sampler, None keeps every task.
+    :type sampler: :py:class:`~distlog.Sampler`
+    """
+    global _sampler
+    _sampler = sampler if sampler is not None else Sampler()
+
+
+def encode(task_id, sampled):
+    """
+    Append the sampling decision to a task id.
+
+    :param string task_id: id of a foreign task.
+    :param bool sampled: the sampling decision.
+    :rtype: string
+    """
+    return task_id + (SAMPLED if sampled else UNSAMPLED)
+
+
+def decode(task_id):
+    """
+    Split a foreign task id in the id and the sampling decision.
+
+    Ids without a decision, from processes that do not sample, are kept.
+
+    :param string task_id: id as produced by :py:func:`encode`.
+    :return tuple: (task id, sampled)
+    """
+    task_id = str(task_id)
+    if task_id.endswith(UNSAMPLED):
+        return task_id[:-len(UNSAMPLED)], False
+    if task_id.endswith(SAMPLED):
+        return task_id[:-len(SAMPLED)], True
+    return task_id, True
@@ -0,0 +1,282 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""Registry of the encodings used to transport log records.
+
+An encoding is identified by the letter that appears in the ENCODING
+part of the message topic, see :py:mod:`distlog.logger.handler`. The
+registry maps that letter to a function encoding a record dict into
+bytes and a function decoding it again. The formatters of the producer and the
+decoder of distlogd both look the functions up here, so an encoding
+added with :py:func:`register_encoding` is understood by both:
+
+.. code-block:: python
+
+    import cbor2
+    from distlog.logger import serializers
+    from distlog.logger.formatters import Serializer
+
+    serializers.register_encoding('C', 'cbor', cbor2.dumps, cbor2.loads)
+
+    class CBORFormatter(Serializer):
+        encoding = 'C'
+
+An encoding may also register a function that appends the encoded record
+to a buffer, like the batch buffers of the handler, without creating a
+bytes object for every record. MessagePack does.
+
+Three encodings are registered from the start: (J)SON, (P)ickle and
+(M)essagePack.
+
+JSON is encoded by the fastest implementation that is installed,
+trying :py:data:`JSON_BACKENDS` in order. The standard library `json`
+module is always available as the last resort. Records a backend
+cannot encode, for instance integers beyond 64 bits, are passed on to
+the standard library. :py:func:`use_json_backend` selects another
+backend.
+"""
+
+__copyright__ = "Copyright (C) 2017 Leo Noordergraaf"
+__licence__ = "GNU General Public Licence v3"
+
+import functools
+import json
+import pickle
+import threading
+
+JSON_BACKENDS = ('orjson', 'ujson', 'rapidjson', 'jsonext', 'json')
+"""JSON implementations in order of preference, fastest first."""
+
+
+class Encoding(object):
+
+    """An encoding of log records.
+
+    :param string letter: the topic letter identifying the encoding
+    :param string name: a descriptive name
+    :param encode: function taking a dict and returning bytes
+    :param decode: function taking bytes and returning a dict,
+        None if records can only be encoded
+    :param encode_into: function taking a dict and an object with a
+        `write` method, writing the encoded dict to it, None to write
+        the result of `encode`
+
+    """
+
+    def __init__(self, letter, name, encode, decode=None, encode_into=None):
+        self.letter = letter
+        self.name = name
+        self.encode = encode
+        self.decode = decode
+        self.encode_into = encode_into
+
+    def __repr__(self):
+        return '<Encoding {0} {1}>'.format(self.letter, self.name)
+
+
+_encodings = {}
+
+
+def _keys(letter):
+    """Produce the keys under which an encoding letter is stored.
+
+    The handler uses text topics, distlogd receives bytes; both are
+    looked up directly.
+    """
+    if isinstance(letter, bytes):
+        letter = letter.decode('ascii')
+    return set([letter, letter.encode('ascii')])
+
+
+def register_encoding(letter, name, encode, decode=None, encode_into=None):
+    """Add an encoding, or replace the one using the same letter.
+
+    :param string letter: a single upper case letter
+    :param string name: a descriptive name
+    :param encode: function taking a dict and returning bytes
+    :param decode: function taking bytes and returning a dict
+    :param encode_into: function writing the encoded dict to a buffer
+    :return: the registered :py:class:`Encoding`
+    """
+    if isinstance(letter, bytes):
+        letter = letter.decode('ascii')
+    if len(letter) != 1 or not letter.isupper():
+        raise ValueError('encoding must be a single upper case letter')
+    encoding = Encoding(str(letter), name, encode, decode, encode_into)
+    for key in _keys(letter):
+        _encodings[key] = encoding
+    return encoding
+
+
+def get_encoding(letter):
+    """Look up an encoding.
+
+    :param letter: the topic letter, as text or bytes
+    :return: the :py:class:`Encoding`
+    :raises KeyError: if no encoding uses the letter
+    """
+    return _encodings[letter]
+
+
+def encodings():
+    """Produce all registered encodings.
+
+    :return list: the :py:class:`Encoding` objects, ordered by letter
+    """
+    unique = dict((e.letter, e) for e in _encodings.values())
+    return [unique[letter] for letter in sorted(unique)]
+
+
+def _utf8(dumps):
+    """Make a JSON encoder that produces text produce UTF-8 bytes."""
+    @functools.wraps(dumps)
+    def encode(data):
+        encoded = dumps(data)
+        if not isinstance(encoded, bytes):
+            encoded = encoded.encode('utf-8')
+        return encoded
+    return encode
+
+
+@_utf8
+def _stdlib_dumps(data):
+    return json.dumps(data, default=str)
+
+
+def _stdlib_loads(body):
+    if isinstance(body, bytes):
+        body = body.decode('utf-8')
+    return json.loads(body)
+
+
+def _fallback(dumps, errors):
+    """Encode with the standard library what dumps cannot encode."""
+    @functools.wraps(dumps)
+    def encode(data):
+        try:
+            return dumps(data)
+        except errors:
+            return _stdlib_dumps(data)
+    return encode
+
+
+def _orjson():
+    import orjson
+    option = orjson.OPT_NON_STR_KEYS
+
+    def dumps(data):
+        return orjson.dumps(data, default=str, option=option)
+    return _fallback(dumps, TypeError), orjson.loads
+
+
+def _ujson():
+    import ujson
+    return (_fallback(_utf8(ujson.dumps), (TypeError, OverflowError)),
+            ujson.loads)
+
+
+def _rapidjson():
+    import rapidjson
+
+    @_utf8
+    def dumps(data):
+        return rapidjson.dumps(data, default=str)
+    return _fallback(dumps, (TypeError, ValueError)), rapidjson.loads
+
+
+def _jsonext():
+    import jsonext
+    return _utf8(jsonext.dumps), _stdlib_loads
+
+
+def _json():
+    return _stdlib_dumps, _stdlib_loads
+
+
+_json_factories = {
+    'orjson': _orjson,
+    'ujson': _ujson,
+    'rapidjson': _rapidjson,
+    'jsonext': _jsonext,
+    'json': _json,
+}
+
+json_backend = None
+"""Name of the JSON implementation in use."""
+
+
+def available_json_backends():
+    """Produce the names of the JSON implementations that are installed.
+
+    :return list: backend names in order of preference
+    """
+    available = []
+    for name in JSON_BACKENDS:
+        try:
+            _json_factories[name]()
+        except ImportError:
+            continue
+        available.append(name)
+    return available
+
+
+def use_json_backend(name=None):
+    """Select the implementation of the JSON encoding.
+
+    :param string name: one of :py:data:`JSON_BACKENDS`, None to pick
+        the fastest one installed
+    :return string: the name of the selected backend
+    :raises ImportError: if the named backend is not installed
+    """
+    global json_backend
+    if name is None:
+        name = available_json_backends()[0]
+    elif name not in _json_factories:
+        raise ValueError('unknown JSON backend {0}'.format(name))
+    dumps, loads = _json_factories[name]()
+    register_encoding('J', 'json ({0})'.format(name), dumps, loads)
+    json_backend = name
+    return name
+
+
+def _pickle_dumps(data):
+    # Python2 does not support pickle protocol 3, so
+    # to transfer data between Python applications regardless
+    # the version their are written in it is best to use the
+    # highest common protocol.
+    return pickle.dumps(data, 2)
+
+
+try:
+    import msgpack
+
+    _packers = threading.local()
+
+    def _msgpack_dumps(data):
+        return msgpack.packb(data, use_bin_type=True, default=str)
+
+    def _msgpack_dump_into(data, out):
+        # a packer per thread, its buffer is reused for every record
+        packer = getattr(_packers, 'packer', None)
+        if packer is None:
+            packer = _packers.packer = msgpack.Packer(
+                use_bin_type=True, default=str, autoreset=False)
+        try:
+            packer.pack(data)
+            out.write(packer.getbuffer())
+        finally:
+            packer.reset()
+
+    def _msgpack_loads(body):
+        return msgpack.unpackb(body, raw=False)
+except ImportError:
+    from .packer import packb as _msgpack_dumps
+    from .packer import pack_into as _msgpack_dump_into
+    # the pure Python decoder is part of distlogd, which registers it
+    _msgpack_loads = None
+
+
+use_json_backend()
+register_encoding('P', 'pickle', _pickle_dumps, pickle.loads)
+register_encoding('M', 'msgpack', _msgpack_dumps, _msgpack_loads,
+                  _msgpack_dump_into)
@@ -0,0 +1,169 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""Keep messages on disk while the receiver is unreachable.
+
+When distlogd is down, or cannot keep up, a PUSH socket queues messages
+in memory until its high water mark is reached and then refuses more.
+A :py:class:`SpillBuffer` takes the messages the socket refused and
+keeps them in a memory mapped file until they can be sent again.
+
+The file is a ring of equally sized segments. Messages are appended to
+the newest segment and read back from the oldest one, a segment is
+reused once all its messages were read. When all segments are in use
+the oldest one is discarded to make room, so the file never grows
+beyond its initial size.
+
+The buffer only lives as long as the process: the file is truncated
+when the buffer is created and removed when it is closed.
+"""
+
+__copyright__ = "Copyright (C) 2017 Leo Noordergraaf"
+__licence__ = "GNU General Public Licence v3"
+
+import collections
+import mmap
+import os
+import struct
+
+DEFAULT_SEGMENT_SIZE = 1 << 20
+"""Largest default size of a segment in bytes."""
+
+MIN_SEGMENTS = 16
+"""Smallest default number of segments in the file."""
+
+ENTRY_HEADER = struct.Struct('!HIId')
+"""Header of a spilled message: topic size, record count, body size and
+the time the message was first sent, 0 when it is not stamped."""
+
+
+class _Segment(object):
+
+    """Part of the spill file."""
+
+    __slots__ = ('offset', 'end', 'records')
+
+    def __init__(self, offset):
+        self.offset = offset
+        self.end = 0
+        self.records = 0
+
+
+class SpillBuffer(object):
+
+    """Ring of memory mapped segments holding unsent messages.
+
+    Not thread safe, the buffer is meant to be used by the thread that
+    owns the socket.
+
+    :param string path: the spill file, created or truncated
+    :param int size: maximum size of the file in bytes
+    :param int segment_size: size of a segment in bytes, a message
+        larger than a segment is discarded. By default the file holds
+        at least :py:data:`MIN_SEGMENTS` segments of at most
+        :py:data:`DEFAULT_SEGMENT_SIZE` bytes.
+
+    """
+
+    records = 0
+    """Number of records in the buffer."""
+
+    lost = 0
+    """Number of records discarded because the buffer was full."""
+
+    def __init__(self, path, size, segment_size=None):
+        if segment_size is None:
+            segment_size = min(DEFAULT_SEGMENT_SIZE, size // MIN_SEGMENTS)
+        count = size // segment_size
+        if count < 2:
+            raise ValueError('the spill file must hold at least 2 segments')
+        self.path = path
+        self.size = count * segment_size
+        self.segment_size = segment_size
+        with open(path, 'w+b') as f:
+            f.truncate(count * segment_size)
+            self._map = mmap.mmap(f.fileno(), count * segment_size)
+        self._free = [_Segment(i * segment_size) for i in range(count)]
+        self._used = collections.deque()
+        self._read = 0
+
+    def __len__(self):
+        return self.records
+
+    def append(self, topic, body, records=1, stamp=0.0):
+        """Add a message.
+
+        :param bytes topic: the topic fragment
+        :param body: the body fragment, bytes or a buffer
+        :param int records: number of records in the message
+        :param float stamp: the time the message was sent
+        :return bool: False if the message is larger than a segment
+        """
+        size = ENTRY_HEADER.size + len(topic) + len(body)
+        if size > self.segment_size:
+            self.lost += records
+            return False
+        segment = self._used[-1] if self._used else None
+        if segment is None or segment.end + size > self.segment_size:
+            segment = self._segment()
+        start = segment.offset + segment.end
+        ENTRY_HEADER.pack_into(self._map, start, len(topic), records,
+                               len(body), stamp)
+        start += ENTRY_HEADER.size
+        self._map[start:start + len(topic)] = topic
+        start += len(topic)
+        self._map[start:start + len(body)] = body
+        segment.end += size
+        segment.records += records
+        self.records += records
+        return True
+
+    def _segment(self):
+        """Start a new segment, discarding the oldest one when full."""
+        if self._free:
+            segment = self._free.pop()
+        else:
+            segment = self._used.popleft()
+            self._read = 0
+            self.lost += segment.records
+            self.records -= segment.records
+        segment.end = 0
+        segment.records = 0
+        self._used.append(segment)
+        return segment
+
+    def peek(self):
+        """Produce the oldest message without removing it.
+
+        :return tuple: topic, body, record count and stamp, None when empty
+        """
+        if not self._used:
+            return None
+        segment = self._used[0]
+        start = segment.offset + self._read
+        tsize, records, bsize, stamp = ENTRY_HEADER.unpack_from(
+            self._map, start)
+        start += ENTRY_HEADER.size
+        topic = self._map[start:start + tsize]
+        start += tsize
+        return topic, self._map[start:start + bsize], records, stamp
+
+    def pop(self):
+        """Remove the oldest message."""
+        segment = self._used[0]
+        start = segment.offset + self._read
+        tsize, records, bsize, _ = ENTRY_HEADER.unpack_from(self._map, start)
+        self._read += ENTRY_HEADER.size + tsize + bsize
+        segment.records -= records
+        self.records -= records
+        if self._read >= segment.end:
+            self._read = 0
+            self._free.append(self._used.popleft())
+
+    def close(self):
+        """Discard the buffered messages and remove the file."""
+        self._map.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
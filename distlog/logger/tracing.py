@@ -0,0 +1,176 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Decorate functions to run them in a task.
+
+.. code-block:: python
+
+    from distlog import traced
+
+    @traced('fetching order %s', 'summary', table='orders')
+    def fetch(order_id):
+        ...
+
+Every call of the decorated function runs in its own
+:py:class:`~distlog.Task`: a subtask of the current task or, when there
+is none, a new toplevel task.
+Sync functions, generators and, on Python 3.5 and later, coroutines are
+supported.
+"""
+
+__copyright__ = "Copyright (C) 2017 Leo Noordergraaf"
+__licence__ = "GNU General Public Licence v3"
+
+import functools
+import inspect
+import sys
+
+import six
+
+from .context import Task, _context, skip_source_file, task
+
+if sys.version_info >= (3, 5):
+    from .aiotracing import trace_coroutine
+else:
+    trace_coroutine = None
+
+
+def traced(msg=None, *args, **ctx):
+    """Run every call of the decorated function in a task.
+
+    The message, its arguments and the context are fixed when the
+    function is decorated. Without a message the qualified name of the
+    function is used.
+    The decorator can also be applied without arguments:
+
+    .. code-block:: python
+
+        @traced
+        def handle(request):
+            ...
+
+    :param string msg: the goal of the function
+    :param list args: parameters for the goal
+    :param dict ctx: context for log messages of the function
+    :return: the decorator
+    """
+    if callable(msg) and not args and not ctx:
+        return traced()(msg)
+
+    def decorator(func):
+        message = msg
+        if message is None:
+            message = getattr(func, '__qualname__', func.__name__)
+
+        def start():
+            top = _context.top
+            if top is None:
+                return task(message, *args, **ctx)
+            tsk = Task(top.get_next_task(), message, *args, **ctx)
+            tsk.sampled = top.sampled
+            return tsk
+
+        if trace_coroutine is not None and inspect.iscoroutinefunction(func):
+            return trace_coroutine(func, start)
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def generator(*fargs, **fkwargs):
+                parent = _context.top
+                return _TracedGenerator(start(), func(*fargs, **fkwargs),
+                                        parent)
+            return generator
+
+        @functools.wraps(func)
+        def wrapper(*fargs, **fkwargs):
+            with start():
+                return func(*fargs, **fkwargs)
+        return wrapper
+    return decorator
+
+
+skip_source_file(traced.__code__.co_filename)
+
+
+class _TracedGenerator(object):
+
+    """
+    Run the steps of a generator in a task.
+
+    The task is on the stack while the generator runs, not while it is
+    suspended. It begins with the first step and ends when the
+    generator is exhausted, fails or is closed.
+    Wherever the generator is resumed, the task remains a child of the
+    task that created the generator, even after that task ended. Its id
+    is therefore determined when the generator is created.
+    """
+
+    __slots__ = ('_task', '_gen', '_path', '_state')
+
+    _NEW, _RUNNING, _DONE = range(3)
+
+    def __init__(self, tsk, gen, parent):
+        self._task = tsk
+        self._gen = gen
+        if parent is None:
+            self._path = tsk._id
+        else:
+            self._path = '{0}/{1}'.format(parent.id, tsk._id)
+        self._state = self._NEW
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self._step(self._gen.send, None)
+
+    next = __next__
+
+    def send(self, value):
+        return self._step(self._gen.send, value)
+
+    def throw(self, *exc_info):
+        return self._step(self._gen.throw, *exc_info)
+
+    def close(self):
+        if self._state == self._RUNNING:
+            try:
+                self._step(self._gen.throw, GeneratorExit)
+            except (GeneratorExit, StopIteration):
+                pass
+            else:
+                raise RuntimeError('generator ignored GeneratorExit')
+        else:
+            self._gen.close()
+            self._state = self._DONE
+
+    def __del__(self):
+        if self._state == self._RUNNING:
+            self.close()
+
+    def _step(self, method, *args):
+        state = self._state
+        if state == self._DONE:
+            return method(*args)
+        tsk = self._task
+        _context.push(tsk)
+        tsk._path = self._path
+        if state == self._NEW:
+            self._state = self._RUNNING
+            tsk._begin()
+        try:
+            item = method(*args)
+        except (StopIteration, GeneratorExit):
+            exc_info = sys.exc_info()
+            self._state = self._DONE
+            tsk._end()
+            _context.pop()
+            six.reraise(*exc_info)
+        except BaseException:
+            exc_info = sys.exc_info()
+            self._state = self._DONE
+            tsk._end(*exc_info)
+            _context.pop()
+            six.reraise(*exc_info)
+        _context.pop()
+        return item
@@ -1 +1,2 @@
-from .main import Plugin, main, add_plugin
+from .plugins import Plugin, add_plugin
+from .main import main, stats
@@ -0,0 +1,202 @@
+"""Decode the messages sent by distlog's ZmqHandler.
+
+A message consists of a topic and a body fragment. The topic tells how
+the body is encoded and framed, see :py:mod:`distlog.logger.handler`.
+A producer that stamps its messages adds a third fragment holding the
+time the message was sent.
+The decoders and decompressors are shared with the producers, see
+:py:mod:`distlog.logger.serializers` and
+:py:mod:`distlog.logger.compression`.
+"""
+
+import logging
+import os
+import struct
+import time
+from collections import OrderedDict
+
+from distlog.logger import compression, serializers
+from . import unpacker
+
+TOPIC_PERFORMANCE = b'P'
+TOPIC_BATCH = b'B'
+TOPIC_DICTIONARY = b'D'
+
+BATCH_HEADER = struct.Struct('!I')
+STAMP = struct.Struct('!d')
+
+
+_msgpack = serializers.get_encoding('M')
+if _msgpack.decode is None:
+    # msgpack is not installed, use the pure Python decoder
+    serializers.register_encoding(
+        'M', _msgpack.name, _msgpack.encode, unpacker.unpackb,
+        _msgpack.encode_into)
+
+
+class Dictionaries(object):
+    """String dictionaries of interning producers.
+
+    Keeps the strings received from each producer for its current epoch
+    and uses them to rebuild interned records. Only the `max_producers`
+    most recently seen producers are remembered.
+    """
+
+    def __init__(self, max_producers=10000):
+        self.max_producers = max_producers
+        self._producers = OrderedDict()
+
+    def _table(self, producer, epoch):
+        entry = self._producers.get(producer)
+        if entry is None or entry[0] != epoch:
+            entry = (epoch, {})
+            self._producers[producer] = entry
+            if len(self._producers) > self.max_producers:
+                self._producers.popitem(last=False)
+        else:
+            self._producers.move_to_end(producer)
+        return entry[1]
+
+    def expand(self, data):
+        """Rebuild an interned record.
+
+        Fields and context keys whose strings were never received, for
+        instance because distlogd restarted in the middle of an epoch, are
+        left out.
+        """
+        producer, epoch, first, new = data.pop('~s')
+        table = self._table(producer, epoch)
+        for sid, value in enumerate(new, first):
+            table[sid] = value
+        refs = data.pop('~r')
+        for i in range(0, len(refs), 2):
+            name = table.get(refs[i])
+            value = table.get(refs[i + 1])
+            if name is not None and value is not None:
+                data[name] = value
+        pairs = data.pop('~c', None)
+        if pairs is not None:
+            context = {}
+            for i in range(0, len(pairs), 2):
+                key = table.get(pairs[i])
+                if key is not None:
+                    context[key] = pairs[i + 1]
+            data['context'] = context
+        return data
+
+
+dictionaries = Dictionaries()
+
+
+def derive(data):
+    """Add the fields a lean record leaves to the receiver.
+
+    Fields already present in the record are kept.
+    """
+    pathname = data.get('pathname')
+    if pathname is not None and 'filename' not in data:
+        data['filename'] = os.path.basename(pathname)
+    if 'module' not in data and 'filename' in data:
+        data['module'] = os.path.splitext(data['filename'])[0]
+    if 'levelname' not in data and 'levelno' in data:
+        data['levelname'] = logging.getLevelName(data['levelno'])
+    created = data.get('created')
+    if created is not None:
+        if 'msecs' not in data:
+            data['msecs'] = (created - int(created)) * 1000
+        if 'asctime' not in data:
+            data['asctime'] = '{0},{1:03d}'.format(
+                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(created)),
+                int(data['msecs'])
+            )
+    return data
+
+
+def _codec(flag):
+    """Produce the codec of a topic flag, None if it is not a codec."""
+    if flag in (TOPIC_BATCH, TOPIC_DICTIONARY):
+        return None
+    try:
+        return compression.get_codec(flag)
+    except KeyError:
+        return None
+
+
+def understands(flags):
+    """Are all topic flags known to this decoder?"""
+    for i in range(len(flags)):
+        flag = flags[i:i + 1]
+        if flag not in (TOPIC_BATCH, TOPIC_DICTIONARY) and \
+                _codec(flag) is None:
+            return False
+    return True
+
+
+def decompress(flags, body):
+    """Undo the compression indicated by the topic flags."""
+    for i in range(len(flags)):
+        codec = _codec(flags[i:i + 1])
+        if codec is not None:
+            return codec.decompress(body)
+    return body
+
+
+def unbatch(body):
+    """Split a batch fragment into the encoded records it contains."""
+    offset = 0
+    end = len(body)
+    while offset < end:
+        size, = BATCH_HEADER.unpack_from(body, offset)
+        offset += BATCH_HEADER.size
+        yield body[offset:offset + size]
+        offset += size
+
+
+def is_framed(body):
+    """Do the record sizes of a batch fragment add up to its size?"""
+    offset = 0
+    end = len(body)
+    while offset + BATCH_HEADER.size <= end:
+        size, = BATCH_HEADER.unpack_from(body, offset)
+        offset += BATCH_HEADER.size + size
+    return offset == end
+
+
+def sent_at(frames):
+    """Produce the time a message was sent, None if it is not stamped.
+
+    :param list frames: the fragments of the message
+    :return float: seconds since the epoch, by the clock of the producer
+    """
+    if len(frames) < 3:
+        return None
+    return STAMP.unpack(frames[2])[0]
+
+
+def is_performance(head):
+    """Does the message carry performance data instead of log records?"""
+    return head[1:2] == TOPIC_PERFORMANCE
+
+
+def decode(head, body):
+    """Decode a message into a list of records.
+
+    Performance data is returned as sent, log records are completed by
+    :py:func:`derive`.
+
+    :param bytes head: the topic fragment
+    :param bytes body: the body fragment
+    :return: list of dicts
+    """
+    decoder = serializers.get_encoding(head[2:3]).decode
+    flags = head[3:]
+    body = decompress(flags, body)
+    if TOPIC_BATCH in flags:
+        records = [decoder(part) for part in unbatch(body)]
+    else:
+        records = [decoder(body)]
+    if TOPIC_DICTIONARY in flags:
+        records = [dictionaries.expand(data) for data in records]
+    if is_performance(head):
+        return records
+    return [derive(data) for data in records]
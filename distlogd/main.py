@@ -1,35 +1,80 @@
 #/usr/bin/python3
 
 import json
-import pickle
+import signal
+import sys
 import time
+from timeit import default_timer as clock
 import zmq
-from zmq.utils.strtypes import cast_unicode
+
+from . import codec
+from . import metrics
+from . import plugins
 
 MEASURE_INTERVAL = 60
+REPORT_INTERVAL = 10
 ENDPOINT= 'tcp://*:5010'
 
 
+def stats(reset=False):
+    """Produce the percentiles of the lag, decode and plugin times.
+
+    Also written to stderr when distlogd receives SIGUSR1.
+
+    :param bool reset: start over after the report
+    :return dict: see :py:class:`~distlogd.metrics.IngestStats`
+    """
+    return metrics.ingest.report(reset=reset)
+
+
+def dump_stats(signum=None, frame=None):
+    json.dump(stats(), sys.stderr, indent=2, sort_keys=True)
+    sys.stderr.write('\n')
+
+
+def receive(frames, fleet):
+    """Decode a message and hand its records to the plugins.
+
+    :param list frames: topic, body and optionally the send time
+    :param fleet: the :py:class:`~distlogd.metrics.Aggregator`
+    :return int: the number of records
+    """
+    received = time.time()
+    head, body = frames[0], frames[1]
+    sent = codec.sent_at(frames)
+    if sent is not None:
+        metrics.ingest.observe('lag', received - sent)
+    start = clock()
+    records = codec.decode(head, body)
+    metrics.ingest.observe('decode', clock() - start)
+    if codec.is_performance(head):
+        handle = plugins.handle_performance
+    else:
+        handle = plugins.handle
+    for data in records:
+        if data.get('type') == 'metrics':
+            fleet.add(data)
+        handle(data)
+    return len(records)
+
+
 def main():
     ctx = zmq.Context.instance()
     sock = ctx.socket(zmq.PULL)
     sock.bind(ENDPOINT)
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, dump_stats)
 
+    fleet = metrics.Aggregator()
     count = 0
     now = time.time()
     then = time.time()
     try:
         while then - now < MEASURE_INTERVAL:
-            head, body = sock.recv_multipart()
-            if head[2:3] == b'P':
-                data = pickle.loads(body)
-            else:
-                data = json.loads(cast_unicode(body))
-
-            plugins.handle(data)
-
-            count += 1
+            count += receive(sock.recv_multipart(), fleet)
             then = time.time()
+            if then - fleet.started >= REPORT_INTERVAL:
+                plugins.handle_performance(fleet.report())
 
     finally:
         sock.close()
@@ -37,6 +82,7 @@ def main():
 
     print("{} requests took {} seconds".format(count, then - now))
     print("or {} seconds per request".format((then - now) / count))
+    dump_stats()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,219 @@
+"""Merge the metrics of many producers.
+
+Producers publish the increase of their counters and histograms every
+interval, see :py:mod:`distlog.logger.metrics`. The
+:py:class:`Aggregator` adds them up into fleet-wide totals and computes
+the percentiles of the merged histograms.
+
+distlogd measures itself as well. :py:data:`ingest` holds histograms
+of where the time of a message goes:
+
+lag
+    From the moment the producer sent the message until distlogd
+    received it. Only stamped messages are measured, the clocks of the
+    producer and distlogd must be in sync.
+decode
+    Decoding a message, all the records of a batch.
+plugin <name>
+    A plugin handling a record.
+"""
+
+import math
+import time
+
+SUB_BUCKETS = 16
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+def bucket_value(number):
+    """Produce the value representing a histogram bucket, its midpoint."""
+    exponent, sub = divmod(number, SUB_BUCKETS)
+    return math.ldexp(0.5 + (sub + 0.5) / (2.0 * SUB_BUCKETS), exponent)
+
+
+class Histogram(object):
+    """Log-linear histogram merged from the histograms of many producers."""
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.zero = 0
+        self.buckets = {}
+
+    def observe(self, value):
+        """Add a single value.
+
+        :param float value: the value, 0 and less go in the zero bucket
+        """
+        if value > 0:
+            mantissa, exponent = math.frexp(value)
+            number = exponent * SUB_BUCKETS + \
+                int((mantissa - 0.5) * 2 * SUB_BUCKETS)
+            self.buckets[number] = self.buckets.get(number, 0) + 1
+        else:
+            self.zero += 1
+        self.sum += value
+        self.count += 1
+
+    def add(self, count, total, zero, buckets):
+        """Add a published histogram.
+
+        :param int count: number of values
+        :param float total: sum of the values
+        :param int zero: number of values in the zero bucket
+        :param list buckets: flat list of bucket numbers and counts
+        """
+        self.count += count
+        self.sum += total
+        self.zero += zero
+        for i in range(0, len(buckets), 2):
+            number = buckets[i]
+            self.buckets[number] = self.buckets.get(number, 0) + buckets[i + 1]
+
+    def percentile(self, quantile):
+        """Estimate the value below which `quantile` of the values fall.
+
+        :param float quantile: 0.0 to 1.0
+        :return: the estimate, None for an empty histogram
+        """
+        if not self.count:
+            return None
+        rank = quantile * self.count
+        seen = self.zero
+        if seen >= rank and seen:
+            return 0.0
+        number = None
+        for number in sorted(self.buckets):
+            seen += self.buckets[number]
+            if seen >= rank:
+                break
+        return bucket_value(number) if number is not None else 0.0
+
+
+class Aggregator(object):
+    """Fleet-wide totals of the published metrics.
+
+    Counters and histograms are added up over all producers, gauges are
+    kept per producer.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.started = time.time()
+
+    def add(self, data):
+        """Add a metrics message of a producer."""
+        producer = (data.get('hostname'), data.get('process'))
+        counters = data.get('counters') or []
+        for i in range(0, len(counters), 3):
+            key = (counters[i], counters[i + 1])
+            self.counters[key] = self.counters.get(key, 0) + counters[i + 2]
+        gauges = data.get('gauges') or []
+        for i in range(0, len(gauges), 3):
+            self.gauges[(gauges[i], gauges[i + 1], producer)] = gauges[i + 2]
+        for name, label, count, total, zero, buckets in \
+                data.get('histograms') or []:
+            histogram = self.histograms.get((name, label))
+            if histogram is None:
+                histogram = self.histograms[(name, label)] = Histogram()
+            histogram.add(count, total, zero, buckets)
+
+    def percentile(self, name, label, quantile):
+        """Estimate a percentile of a merged histogram."""
+        histogram = self.histograms.get((name, label))
+        return histogram.percentile(quantile) if histogram else None
+
+    def report(self, quantiles=QUANTILES, reset=True):
+        """Summarize the metrics received since the previous report.
+
+        :param quantiles: the percentiles to compute
+        :param bool reset: start over after the report
+        :return dict: the summary, handed to the plugins as performance data
+        """
+        now = time.time()
+        histograms = []
+        for (name, label), histogram in sorted(self.histograms.items()):
+            entry = {
+                'name': name,
+                'label': label,
+                'count': histogram.count,
+                'sum': histogram.sum,
+                'mean': histogram.sum / histogram.count if histogram.count else None,
+            }
+            for quantile in quantiles:
+                entry['p{0:g}'.format(quantile * 100)] = \
+                    histogram.percentile(quantile)
+            histograms.append(entry)
+        summary = {
+            'type': 'fleet',
+            'created': now,
+            'interval': now - self.started,
+            'counters': [
+                {'name': name, 'label': label, 'value': value}
+                for (name, label), value in sorted(self.counters.items())
+            ],
+            'gauges': [
+                {'name': name, 'label': label, 'hostname': producer[0],
+                 'process': producer[1], 'value': value}
+                for (name, label, producer), value in self.gauges.items()
+            ],
+            'histograms': histograms,
+        }
+        if reset:
+            self.reset()
+        return summary
+
+
+class IngestStats(object):
+    """Streaming histograms of the time distlogd spends on messages."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.histograms = {}
+        self.started = time.time()
+
+    def observe(self, name, value):
+        """Add a duration, in seconds, to a histogram."""
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.observe(value)
+
+    def report(self, quantiles=QUANTILES, reset=False):
+        """Summarize the durations observed so far.
+
+        :param quantiles: the percentiles to compute
+        :param bool reset: start over after the report
+        :return dict: count, mean and percentiles in seconds per histogram
+        """
+        now = time.time()
+        histograms = {}
+        for name, histogram in sorted(self.histograms.items()):
+            entry = {
+                'count': histogram.count,
+                'mean': histogram.sum / histogram.count,
+            }
+            for quantile in quantiles:
+                entry['p{0:g}'.format(quantile * 100)] = \
+                    histogram.percentile(quantile)
+            histograms[name] = entry
+        summary = {
+            'type': 'ingest',
+            'created': now,
+            'interval': now - self.started,
+            'histograms': histograms,
+        }
+        if reset:
+            self.reset()
+        return summary
+
+
+ingest = IngestStats()
+"""Where the time of the messages received by this distlogd goes."""
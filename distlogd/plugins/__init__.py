@@ -1,8 +1,11 @@
 import logging
 import sys
 import importlib
+from timeit import default_timer as clock
 import yaml
 
+from ..metrics import ingest
+
 log = logging.getLogger(__name__)
 
 _locations = []
@@ -15,6 +18,10 @@ class Plugin(object):
     def handle(self, data):
         raise NotImplementedError
 
+    def handle_performance(self, data):
+        """Process a task timing record, ignored by default."""
+        pass
+
 def add_location(location):
     global _locations
     if type(location) == list:
@@ -48,4 +55,10 @@ def load_config(filename):
 def handle(data):
     for plugin in _plugins:
         if plugin.match(data):
+            start = clock()
             plugin.handle(data)
+            ingest.observe('plugin ' + type(plugin).__name__, clock() - start)
+
+def handle_performance(data):
+    for plugin in _plugins:
+        plugin.handle_performance(data)
@@ -0,0 +1,246 @@
+"""Forward the messages of the producers on a host over one connection.
+
+Every process using a :py:class:`~distlog.ZmqHandler` connects to
+distlogd on its own. With hundreds of processes per host that is a lot
+of connections, each carrying small messages. The relay runs once per
+host: the producers connect to it over ``ipc://`` and it forwards their
+messages over a single upstream connection.
+
+Messages are collected per topic for at most `batch_interval`
+milliseconds or until `batch_size` bytes were collected, then sent as
+one batch, compressed when it is large enough. Batches and compressed
+messages of the producers are unpacked first so their records end up
+in the same batch. The system, kind and encoding of the topic are kept,
+distlogd receives the records as if the producers batched them
+themselves. Interned records carry the id of their producer and are
+batched apart from the others. Messages with flags the relay does not
+understand, or with an unexpected number of fragments, are forwarded
+unchanged. Messages that cannot be decompressed are logged and
+dropped. When the producers stamp their
+messages with the send time the batch carries the oldest stamp, so the
+lag distlogd measures includes the time spent in the relay.
+
+Run it with::
+
+    distlog-relay --upstream tcp://loghost:5010
+
+and point the handlers at ``ipc:///tmp/distlog-relay``.
+"""
+
+import argparse
+import logging
+import signal
+import threading
+import time
+from collections import OrderedDict
+
+import zmq
+
+from distlog.logger.compression import Codec, ZlibCodec
+from . import codec
+
+log = logging.getLogger(__name__)
+
+ENDPOINT = 'ipc:///tmp/distlog-relay'
+BATCH_SIZE = 256 * 1024
+BATCH_INTERVAL = 50
+COMPRESS_THRESHOLD = 256
+RECEIVE_LIMIT = 1000
+"""Maximum number of messages received before checking the batches."""
+
+
+class Relay(object):
+
+    """Batch the messages of local producers and send them upstream.
+
+    :param string upstream: the endpoint of distlogd
+    :param string endpoint: the endpoint the producers connect to
+    :param context: a 0MQ context
+    :param int batch_size: bytes collected per topic before sending
+    :param int batch_interval: milliseconds a message waits at most
+    :param compression: zlib level or
+        :py:class:`~distlog.logger.compression.Codec`, None to not compress
+    :param int compress_threshold: minimum size of a compressed batch
+    """
+
+    received = 0
+    """Number of messages received from the producers."""
+
+    sent = 0
+    """Number of messages sent upstream."""
+
+    received_bytes = 0
+    """Number of body bytes received from the producers."""
+
+    sent_bytes = 0
+    """Number of body bytes sent upstream."""
+
+    dropped = 0
+    """Number of messages dropped because they could not be decoded."""
+
+    def __init__(self, upstream, endpoint=ENDPOINT, context=None,
+                 batch_size=BATCH_SIZE, batch_interval=BATCH_INTERVAL,
+                 compression=6, compress_threshold=COMPRESS_THRESHOLD):
+        if compression is not None and not isinstance(compression, Codec):
+            compression = ZlibCodec(compression)
+        self._codec = compression
+        self._compress_threshold = compress_threshold
+        self._batch_size = batch_size
+        self._batch_interval = batch_interval / 1000.0
+        self._batches = OrderedDict()
+        self._stamps = {}
+        self._deadline = None
+        self._stopped = threading.Event()
+
+        self.context = context or zmq.Context.instance()
+        self.pull = self.context.socket(zmq.PULL)
+        self.pull.bind(endpoint)
+        self.push = self.context.socket(zmq.PUSH)
+        self.push.connect(upstream)
+
+    def receive(self, topic, body, stamp=None):
+        """Add a message of a producer to the batch of its topic.
+
+        :param bytes topic: the topic fragment
+        :param bytes body: the body fragment
+        :param bytes stamp: the send time fragment, if any
+        """
+        self.received += 1
+        self.received_bytes += len(body)
+        flags = topic[3:]
+        if not codec.understands(flags):
+            self._send([topic, body] if stamp is None else
+                       [topic, body, stamp])
+            return
+        try:
+            body = codec.decompress(flags, body)
+        except Exception:
+            log.exception('dropped a message on topic %r', topic)
+            self.dropped += 1
+            return
+        if codec.TOPIC_BATCH in flags and not codec.is_framed(body):
+            # merged with the records of others it would spoil the batch
+            log.error('dropped a badly framed batch on topic %r', topic)
+            self.dropped += 1
+            return
+        key = topic[:3]
+        if codec.TOPIC_DICTIONARY in flags:
+            key += codec.TOPIC_DICTIONARY
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = self._batches[key] = bytearray()
+            if self._deadline is None:
+                self._deadline = time.time() + self._batch_interval
+        if stamp is not None and key not in self._stamps:
+            self._stamps[key] = stamp
+        if codec.TOPIC_BATCH in flags:
+            batch += body
+        else:
+            batch += codec.BATCH_HEADER.pack(len(body))
+            batch += body
+        if len(batch) >= self._batch_size:
+            self._send_batch(key, self._batches.pop(key))
+
+    def flush(self):
+        """Send all collected batches."""
+        batches, self._batches = self._batches, OrderedDict()
+        self._deadline = None
+        for key, batch in batches.items():
+            self._send_batch(key, batch)
+
+    def _send_batch(self, key, batch):
+        flags = codec.TOPIC_BATCH
+        body = bytes(batch)
+        if self._codec is not None and len(body) >= self._compress_threshold:
+            body = self._codec.compress(body)
+            flags += self._codec.letter.encode('ascii')
+        frames = [key + flags, body]
+        stamp = self._stamps.pop(key, None)
+        if stamp is not None:
+            frames.append(stamp)
+        self._send(frames)
+
+    def _send(self, frames):
+        """Send a message upstream, the topic followed by any fragments."""
+        self.push.send_multipart(frames)
+        self.sent += 1
+        self.sent_bytes += sum(len(frame) for frame in frames[1:])
+
+    def run(self):
+        """Relay messages until :py:meth:`stop` is called."""
+        poller = zmq.Poller()
+        poller.register(self.pull, zmq.POLLIN)
+        while not self._stopped.is_set():
+            if self._deadline is None:
+                timeout = 100
+            else:
+                timeout = max(0, (self._deadline - time.time()) * 1000)
+            if poller.poll(timeout):
+                for _ in range(RECEIVE_LIMIT):
+                    try:
+                        frames = self.pull.recv_multipart(zmq.NOBLOCK)
+                    except zmq.Again:
+                        break
+                    if len(frames) in (2, 3):
+                        self.receive(*frames)
+                    else:
+                        self.received += 1
+                        self._send(frames)
+            if self._deadline is not None and time.time() >= self._deadline:
+                self.flush()
+        self.flush()
+
+    def stop(self):
+        """Make :py:meth:`run` send what it collected and return."""
+        self._stopped.set()
+
+    def close(self, linger=5000):
+        """Close the sockets, waiting at most `linger` ms for the upstream."""
+        self.pull.close()
+        self.push.close(linger)
+
+
+def handle_arguments(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Forward the distlog messages of this host to distlogd.')
+    parser.add_argument(
+        '--upstream', required=True,
+        help='distlogd endpoint, like tcp://loghost:5010')
+    parser.add_argument(
+        '--bind', default=ENDPOINT,
+        help='endpoint for the local producers, default: ' + ENDPOINT)
+    parser.add_argument(
+        '--batch-size', type=int, default=BATCH_SIZE,
+        help='bytes per batch, default: %(default)s')
+    parser.add_argument(
+        '--batch-interval', type=int, default=BATCH_INTERVAL,
+        help='milliseconds a message waits at most, default: %(default)s')
+    parser.add_argument(
+        '--compression', type=int, default=6,
+        help='zlib level, 0 to not compress, default: %(default)s')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = handle_arguments(argv)
+    logging.basicConfig(level=logging.INFO)
+    relay = Relay(args.upstream, args.bind,
+                  batch_size=args.batch_size,
+                  batch_interval=args.batch_interval,
+                  compression=args.compression or None)
+    signal.signal(signal.SIGTERM, lambda signum, frame: relay.stop())
+    log.info('relaying %s to %s', args.bind, args.upstream)
+    try:
+        relay.run()
+    except KeyboardInterrupt:
+        relay.flush()
+    finally:
+        relay.close()
+    log.info('relayed %d messages, %d bytes in %d messages, %d bytes, '
+             '%d dropped', relay.received, relay.received_bytes, relay.sent,
+             relay.sent_bytes, relay.dropped)
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,113 @@
+"""Decode MessagePack encoded records.
+
+Pure Python decoder for the subset of MessagePack produced by
+distlog's MsgPackFormatter. Values are parsed straight from the received
+buffer, only strings and binary values are copied out of it.
+"""
+
+import struct
+
+_fixed = {
+    0xca: struct.Struct('>f'),
+    0xcb: struct.Struct('>d'),
+    0xcc: struct.Struct('>B'),
+    0xcd: struct.Struct('>H'),
+    0xce: struct.Struct('>I'),
+    0xcf: struct.Struct('>Q'),
+    0xd0: struct.Struct('>b'),
+    0xd1: struct.Struct('>h'),
+    0xd2: struct.Struct('>i'),
+    0xd3: struct.Struct('>q'),
+}
+
+_U8 = _fixed[0xcc]
+_U16 = _fixed[0xcd]
+_U32 = _fixed[0xce]
+
+_sizes = {
+    0xc4: _U8, 0xc5: _U16, 0xc6: _U32,
+    0xd9: _U8, 0xda: _U16, 0xdb: _U32,
+    0xdc: _U16, 0xdd: _U32,
+    0xde: _U16, 0xdf: _U32,
+}
+
+
+class UnpackError(ValueError):
+    pass
+
+
+def _unpack(data, offset):
+    """Decode the value at offset, return it and the offset beyond it."""
+    code = data[offset]
+    offset += 1
+    if code < 0x80:
+        return code, offset
+    if code >= 0xe0:
+        return code - 0x100, offset
+    if code < 0x90:
+        return _unpack_map(data, offset, code & 0x0f)
+    if code < 0xa0:
+        return _unpack_array(data, offset, code & 0x0f)
+    if code < 0xc0:
+        return _unpack_str(data, offset, code & 0x1f)
+    if code == 0xc0:
+        return None, offset
+    if code == 0xc2:
+        return False, offset
+    if code == 0xc3:
+        return True, offset
+    fixed = _fixed.get(code)
+    if fixed is not None:
+        return fixed.unpack_from(data, offset)[0], offset + fixed.size
+    size = _sizes.get(code)
+    if size is None:
+        raise UnpackError('unsupported type 0x{0:02x}'.format(code))
+    n = size.unpack_from(data, offset)[0]
+    offset += size.size
+    if code <= 0xc6:
+        return bytes(data[offset:offset + n]), offset + n
+    if code <= 0xdb:
+        return _unpack_str(data, offset, n)
+    if code <= 0xdd:
+        return _unpack_array(data, offset, n)
+    return _unpack_map(data, offset, n)
+
+
+def _unpack_str(data, offset, n):
+    end = offset + n
+    if end > len(data):
+        raise UnpackError('truncated string')
+    return bytes(data[offset:end]).decode('utf-8'), end
+
+
+def _unpack_array(data, offset, n):
+    result = []
+    for _ in range(n):
+        value, offset = _unpack(data, offset)
+        result.append(value)
+    return result, offset
+
+
+def _unpack_map(data, offset, n):
+    result = {}
+    for _ in range(n):
+        key, offset = _unpack(data, offset)
+        value, offset = _unpack(data, offset)
+        result[key] = value
+    return result, offset
+
+
+def unpackb(data):
+    """Decode a MessagePack encoded object.
+
+    :param data: bytes-like object holding exactly one encoded value
+    :return: the decoded object
+    """
+    data = memoryview(data)
+    try:
+        value, offset = _unpack(data, 0)
+    except (IndexError, struct.error):
+        raise UnpackError('truncated data')
+    if offset != len(data):
+        raise UnpackError('extra data after value')
+    return value
@@ -1,53 +1,238 @@
-#/usr/bin/python3
-do_json = False
-#do_json = True
+#!/usr/bin/python3
+"""Generate log load for sizing distlogd.
 
-import zmq
-from zmq.utils.strtypes import cast_bytes
+Starts a number of producer processes that log real LogRecords through
+a ZmqHandler at a target rate, then reports the throughput achieved and
+the latency of the logging calls as seen by the producers::
+
+    python genload.py --endpoint tcp://loghost:5010 --processes 8 \\
+        --rate 50000 --duration 60 --mix plain=6,context=3,exception=1
+
+The shapes of the records are:
+
+plain
+    A formatted message, padded to `--size` bytes.
+context
+    The same message, logged inside a task with ten context fields.
+exception
+    The message with the traceback of a caught exception.
+
+With `--json` the report is printed as JSON instead of a table.
+"""
+
+import argparse
 import json
-import pickle
-from random import randint
-
-msg = {
-    'foo': 'bar',
-    'nest': {
-        'foo': 'bar',
-        'nest': {
-            'list': ['item1', 'item2', 1, 2]
-        },
-        'rand': 0
-    },
-    'nest2': {
-        'foo': 'bar2',
-        'nest': {
-            'list': [4, 5, 6, 7]
-        }
-    },
-    'list': [
-        {'aap': 'noot'},
-        {'mies': 'teun'},
-        {'jet': 'zus'},
-        {'rand': 0}
-    ]
-}
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import time
 
-endpoint = 'tcp://localhost:5010'
+import distlog
+from distlog.logger.metrics import Histogram
+from distlogd.metrics import QUANTILES
+from distlogd.metrics import Histogram as MergedHistogram
+
+FORMATTERS = {
+    'json': distlog.JSONFormatter,
+    'pickle': distlog.PickleFormatter,
+    'msgpack': distlog.MsgPackFormatter,
+}
 
-ctx = zmq.Context.instance()
-sock = ctx.socket(zmq.PUSH)
-sock.connect(endpoint)
+SHAPES = ('plain', 'context', 'exception')
 
 try:
-    while True:
-        msg['nest']['rand'] = randint(0, 1000)
-        msg['list'][3]['rand'] = randint(1000, 2000)
-        if do_json:
-            btopic = b'PLJ'
-            sock.send_multipart([btopic, cast_bytes(json.dumps(msg))])
-        else:
-            btopic = b'PLP'
-            sock.send_multipart([btopic, pickle.dumps(msg)])
-#        print('.', end='', flush=True)
-finally:
-    sock.close()
-    ctx.term()
+    clock = time.perf_counter
+except AttributeError:  # Python < 3.3
+    clock = time.time
+
+
+def parse_mix(value):
+    """Parse a shape mix like ``plain=6,context=3,exception=1``."""
+    mix = {}
+    for part in value.split(','):
+        shape, _, weight = part.partition('=')
+        if shape not in SHAPES:
+            raise argparse.ArgumentTypeError('unknown shape ' + shape)
+        mix[shape] = float(weight or 1)
+    return mix
+
+
+def handle_arguments(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Generate log load for distlogd.')
+    parser.add_argument(
+        '-e', '--endpoint', default='tcp://localhost:5010',
+        help='distlogd or relay endpoint, default: %(default)s')
+    parser.add_argument(
+        '-r', '--rate', type=float, default=0,
+        help='records per second over all processes, 0 for as many as '
+             'possible, default: %(default)s')
+    parser.add_argument(
+        '-p', '--processes', type=int, default=1,
+        help='number of producer processes, default: %(default)s')
+    parser.add_argument(
+        '-s', '--size', type=int, default=200,
+        help='message size in bytes, default: %(default)s')
+    parser.add_argument(
+        '-m', '--mix', type=parse_mix, default='plain',
+        help='weights of the record shapes, like plain=6,context=3,'
+             'exception=1, default: %(default)s')
+    parser.add_argument(
+        '--encoding', choices=sorted(FORMATTERS), default='json',
+        help='record encoding, default: %(default)s')
+    parser.add_argument(
+        '-b', '--batch-size', type=int,
+        help='records per message, default: no batching')
+    parser.add_argument(
+        '--batch-interval', type=int, default=10,
+        help='milliseconds to fill a batch, default: %(default)s')
+    parser.add_argument(
+        '-d', '--duration', type=float, default=10,
+        help='seconds to generate load, default: %(default)s')
+    parser.add_argument(
+        '--json', action='store_true',
+        help='print the report as JSON')
+    return parser.parse_args(argv)
+
+
+def make_calls(logger, mix, size):
+    """Produce the logging call for every shape in the mix and its weight."""
+    padding = 'x' * max(0, size - 40)
+    fields = dict(('field%d' % n, n) for n in range(8))
+
+    def plain(i):
+        logger.info('request %d handled in %d ms %s', i, i % 100, padding)
+
+    def with_context(i):
+        with distlog.task('order %d', i, user='load', shop='test',
+                          **fields):
+            plain(i)
+
+    def exception(i):
+        try:
+            raise ValueError('order %d failed' % i)
+        except ValueError:
+            logger.exception('request %d failed %s', i, padding)
+
+    calls = {'plain': plain, 'context': with_context, 'exception': exception}
+    return [calls[shape] for shape in mix], [mix[shape] for shape in mix]
+
+
+def pick(calls, weights, count, seed):
+    """Produce a sequence of `count` calls drawn by weight."""
+    rng = random.Random(seed)
+    total = sum(weights)
+    sequence = []
+    for _ in range(count):
+        point = rng.uniform(0, total)
+        for call, weight in zip(calls, weights):
+            point -= weight
+            if point <= 0:
+                break
+        sequence.append(call)
+    return sequence
+
+
+def produce(args, rate, results):
+    """Producer process: log at `rate` records per second for a while."""
+    handler = distlog.ZmqHandler(
+        args.endpoint, batch_size=args.batch_size,
+        batch_interval=args.batch_interval if args.batch_size else None)
+    handler.setFormatter(FORMATTERS[args.encoding]())
+    logger = logging.getLogger('genload')
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    calls, weights = make_calls(logger, args.mix, args.size)
+    chosen = pick(calls, weights, 4096, os.getpid())
+
+    latency = Histogram()
+    interval = 1.0 / rate if rate else 0
+    start = clock()
+    end = start + args.duration
+    next_call = start
+    count = 0
+    now = start
+    while now < end:
+        if interval:
+            if now < next_call:
+                time.sleep(next_call - now)
+            next_call += interval
+        begin = clock()
+        chosen[count & 4095](count)
+        now = clock()
+        latency.observe(now - begin)
+        count += 1
+    handler.close()
+    elapsed = clock() - start
+    results.put({
+        'records': count,
+        'elapsed': elapsed,
+        'dropped': handler.dropped,
+        'latency': [latency.count, latency.sum, latency.zero,
+                    [n for item in sorted(latency.buckets.items())
+                     for n in item]],
+    })
+
+
+def run(args):
+    results = multiprocessing.Queue()
+    rate = args.rate / args.processes
+    workers = [multiprocessing.Process(target=produce, args=(args, rate, results))
+               for _ in range(args.processes)]
+    for worker in workers:
+        worker.start()
+    reports = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+
+    latency = MergedHistogram()
+    for report in reports:
+        latency.add(*report['latency'])
+    records = sum(r['records'] for r in reports)
+    elapsed = max(r['elapsed'] for r in reports)
+    summary = {
+        'endpoint': args.endpoint,
+        'processes': args.processes,
+        'encoding': args.encoding,
+        'batch_size': args.batch_size,
+        'target_rate': args.rate,
+        'records': records,
+        'dropped': sum(r['dropped'] for r in reports),
+        'elapsed': elapsed,
+        'records_per_sec': records / elapsed,
+        'latency_us': dict(
+            ('p{0:g}'.format(q * 100), latency.percentile(q) * 1e6)
+            for q in QUANTILES
+        ),
+    }
+    summary['latency_us']['mean'] = latency.sum / latency.count * 1e6
+    return summary
+
+
+def print_report(summary):
+    print('{records} records from {processes} processes in {elapsed:.1f} s'
+          .format(**summary))
+    print('{0:.0f} records/s (target {1:.0f}), {2} dropped'.format(
+        summary['records_per_sec'], summary['target_rate'],
+        summary['dropped']))
+    print('send latency (us): ' + ', '.join(
+        '{0} {1:.1f}'.format(name, value)
+        for name, value in sorted(summary['latency_us'].items())))
+
+
+def main(argv=None):
+    args = handle_arguments(argv)
+    summary = run(args)
+    if args.json:
+        json.dump(summary, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        print_report(summary)
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -40,5 +40,14 @@ setup(
         '': ['LICENSE']
     },
 
+    entry_points={
+        'console_scripts': [
+            'distlog-relay = distlogd.relay:main',
+        ],
+    },
+
     #install_requires=['pyzmq',  'zmq']
+    extras_require={
+        'msgpack': ['msgpack>=1.0'],
+    },
 )
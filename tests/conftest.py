@@ -0,0 +1,11 @@
+import sys
+
+collect_ignore = []
+if sys.version_info < (3, 7):
+    # async def does not compile before 3.5, asyncio.run and per task
+    # contexts need 3.7
+    collect_ignore.extend([
+        'test_aiohandler.py',
+        'test_context_async.py',
+        'test_tracing_async.py',
+    ])
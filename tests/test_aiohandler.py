@@ -0,0 +1,115 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+import sys
+import threading
+
+import pytest
+import zmq
+import zmq.asyncio
+
+from distlog.logger.aiohandler import AsyncZmqHandler
+from distlog.logger.formatters import JSONFormatter
+from distlogd import codec
+
+pytestmark = pytest.mark.skipif(
+    sys.version_info < (3, 7), reason='asyncio.run needs Python 3.7'
+)
+
+def make_record(msg='hi there %s %d', args=('number', 1)):
+    return logging.LogRecord('name', 20, '/here/and/nowhere/else.py', 50, msg, args, None)
+
+def run(emitter):
+    """Run emitter(handler) on a fresh loop and collect what was sent."""
+    ctx = zmq.Context()
+    sink = ctx.socket(zmq.PULL)
+    port = sink.bind_to_random_port('tcp://127.0.0.1')
+    actx = zmq.asyncio.Context()
+
+    async def main():
+        handler = AsyncZmqHandler('tcp://127.0.0.1:{}'.format(port), actx,
+                                  batch_size=4)
+        handler.setFormatter(JSONFormatter())
+        await emitter(handler)
+        await handler.aclose()
+
+    asyncio.run(main())
+    messages = []
+    while sink.poll(200):
+        messages.append(sink.recv_multipart())
+    sink.close()
+    ctx.term()
+    actx.term()
+    return messages
+
+def test_records_of_one_iteration_are_batched():
+    async def emitter(handler):
+        for i in range(6):
+            handler.emit(make_record())
+        await handler.flush()
+        handler.emit(make_record(msg='later', args=None))
+
+    messages = run(emitter)
+    assert [topic for topic, body in messages] == [b'PLJB', b'PLJB', b'PLJ']
+    records = [r for topic, body in messages for r in codec.decode(topic, body)]
+    assert len(records) == 7
+    assert records[-1]['message'] == 'later'
+
+def test_emit_from_other_thread():
+    async def emitter(handler):
+        handler.emit(make_record())
+        await handler.flush()
+        thread = threading.Thread(target=handler.emit, args=(make_record(msg='thread', args=None),))
+        thread.start()
+        thread.join()
+        await asyncio.sleep(0.01)
+
+    messages = run(emitter)
+    records = [r for topic, body in messages for r in codec.decode(topic, body)]
+    assert [r['message'] for r in records] == ['hi there number 1', 'thread']
+
+def test_flush_outside_loop():
+    ctx = zmq.asyncio.Context()
+    handler = AsyncZmqHandler('tcp://127.0.0.1:1', ctx)
+    assert handler.flush() is None
+    handler.socket.close(linger=0)
+    ctx.term()
+
+def test_records_without_loop_are_bounded():
+    ctx = zmq.asyncio.Context()
+    handler = AsyncZmqHandler('tcp://127.0.0.1:1', ctx, queue_size=3)
+    handler.setFormatter(JSONFormatter())
+    for i in range(5):
+        handler.handle(make_record())
+    assert len(handler._pending) == 3
+    assert handler.dropped == 2
+    handler.close()
+    assert handler.dropped == 5
+    handler.socket.close(linger=0)
+    ctx.term()
+
+def test_records_after_loop_closed_are_dropped():
+    ctx = zmq.Context()
+    sink = ctx.socket(zmq.PULL)
+    port = sink.bind_to_random_port('tcp://127.0.0.1')
+    actx = zmq.asyncio.Context()
+    handler = AsyncZmqHandler('tcp://127.0.0.1:{}'.format(port), actx)
+    handler.setFormatter(JSONFormatter())
+
+    async def main():
+        handler.emit(make_record())
+        await handler.flush()
+
+    asyncio.run(main())
+    handler.emit(make_record(msg='too late', args=None))
+    assert handler._pending == []
+    assert handler.dropped == 1
+    handler.close()
+    assert sink.poll(1000)
+    assert len(codec.decode(*sink.recv_multipart())) == 1
+    handler.socket.close(linger=0)
+    sink.close()
+    ctx.term()
+    actx.term()
@@ -0,0 +1,86 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import json
+import pickle
+import struct
+import zlib
+
+import pytest
+
+from distlog.logger import compression
+from distlog.logger.packer import packb
+from distlogd import codec, unpacker
+
+def frame(*parts):
+    return b''.join(struct.pack('!I', len(p)) + p for p in parts)
+
+def test_decode_single():
+    assert codec.decode(b'PLJ', b'{"a": 1}') == [{'a': 1}]
+    assert codec.decode(b'PLP', pickle.dumps({'a': 1}, 2)) == [{'a': 1}]
+
+def test_unbatch():
+    assert list(codec.unbatch(frame(b'ab', b'', b'cde'))) == [b'ab', b'', b'cde']
+    assert list(codec.unbatch(b'')) == []
+
+def test_is_framed():
+    assert codec.is_framed(frame(b'ab', b'', b'cde'))
+    assert codec.is_framed(b'')
+    assert not codec.is_framed(frame(b'ab') + b'c')
+    assert not codec.is_framed(frame(b'ab')[:-1])
+    assert not codec.is_framed(b'\x00\x00')
+
+def test_decode_batch():
+    body = frame(*[json.dumps({'n': n}).encode() for n in range(3)])
+    assert codec.decode(b'PLJB', body) == [{'n': 0}, {'n': 1}, {'n': 2}]
+
+def test_decode_msgpack():
+    assert codec.decode(b'PLM', packb({'a': [1, 2]})) == [{'a': [1, 2]}]
+    assert codec.decode(b'PLMB', frame(packb({'n': 1}), packb({'n': 2}))) == [{'n': 1}, {'n': 2}]
+
+def test_unpack_errors():
+    with pytest.raises(unpacker.UnpackError):
+        unpacker.unpackb(b'\xa5ab')
+    with pytest.raises(unpacker.UnpackError):
+        unpacker.unpackb(b'\x01\x02')
+    with pytest.raises(unpacker.UnpackError):
+        unpacker.unpackb(b'\xc1')
+
+def test_derive():
+    data = codec.derive({'pathname': '/a/b/c.py', 'levelno': 30, 'created': 0.25})
+    assert data['filename'] == 'c.py'
+    assert data['module'] == 'c'
+    assert data['levelname'] == 'WARNING'
+    assert data['msecs'] == 250
+    assert data['asctime'].endswith(',250')
+    assert codec.derive({'filename': 'x.py', 'pathname': '/y.py'})['filename'] == 'x.py'
+
+def test_decompress():
+    body = frame(b'{"n": 1}', b'{"n": 2}')
+    assert codec.decode(b'PLJBZ', zlib.compress(body)) == codec.decode(b'PLJB', body)
+    assert codec.decode(b'PLJZ', zlib.compress(b'{"n": 3}')) == [{'n': 3}]
+
+class ReverseCodec(compression.Codec):
+    letter = 'R'
+
+    def compress(self, data):
+        return data[::-1]
+
+    def decompress(self, data):
+        return data[::-1]
+
+def test_registered_codec():
+    assert not codec.understands(b'BR')
+    compression.register_codec(ReverseCodec())
+    try:
+        assert compression.get_codec(b'R') is compression.get_codec('R')
+        assert codec.understands(b'BR')
+        assert codec.decode(b'PLJR', b'}3 :"n"{') == [{'n': 3}]
+    finally:
+        for key in (u'R', b'R'):
+            del compression._codecs[key]
+    assert [c.letter for c in compression.codecs()] == ['Z']
+    batch = ReverseCodec()
+    batch.letter = 'B'
+    with pytest.raises(ValueError):
+        compression.register_codec(batch)
@@ -1,6 +1,8 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 
+import functools
+import json
 import logging
 import six
 import pytest
@@ -45,6 +47,7 @@ def test_context():
 def test_logrecord():
     logging.basicConfig(level=logging.DEBUG)
     log = logging.getLogger()
+    log.setLevel(logging.DEBUG) # basicConfig is a no-op when pytest added handlers
     log.handlers = [] # make sure only our handler gets installed
     log.propagate = False
     assert type(log) == context.RootLogger
@@ -72,6 +75,7 @@ def test_logrecord():
     assert hasattr(rec[0], 'context')
     assert 'aap' in rec[0].context
     assert rec[0].context['aap'] == 'noot'
+    context._context.pop()
 
 def test_task():
     tsk = context.Task('b', 'msg %d', 6,  wim='jet', zus='gijs')
@@ -89,6 +93,7 @@ def test_task():
 def test_contextmanager():
     logging.basicConfig(level=logging.DEBUG)
     log = logging.getLogger()
+    log.setLevel(logging.DEBUG) # basicConfig is a no-op when pytest added handlers
     log.handlers = [] # make sure only our handler gets installed
     log.propagate = False
     assert type(log) == context.RootLogger
@@ -113,9 +118,285 @@ def test_contextmanager():
         assert 'sample' in r.context
         assert r.context['sample'] == 'good'
 
+def isolated(test):
+    """Run a test without the tasks other tests left on the stack."""
+    @functools.wraps(test)
+    def wrapper():
+        saved = []
+        while context._context.top is not None:
+            saved.append(context._context.pop())
+        try:
+            test()
+        finally:
+            while context._context.top is not None:
+                context._context.pop()
+            for tsk in reversed(saved):
+                context._context.push(tsk)
+    return wrapper
+
+@isolated
+def test_task_ids():
+    top = context.Task('t', 'top')
+    sub = context.Task(1, 'sub')
+    assert top.id == 't'
+    context._context.push(top)
+    context._context.push(sub)
+    assert sub.id == 't/1'
+    assert sub.parent == 't'
+    assert sub.id is sub.id
+    context._context.pop()
+    context._context.pop()
+    assert sub.id == 1
+
+@isolated
+def test_task_context():
+    tsk = context.Task('d', 'msg', user='leo')
+    context._context.push(tsk)
+    try:
+        first = tsk.context
+        second = tsk.context
+        assert first['key'] == '0@d'
+        assert second['key'] == '1@d'
+        assert dict(first) == {'key': '0@d', 'user': 'leo'}
+        assert len(second) == 2
+        tsk.bind(role='admin')
+        third = tsk.context
+        assert 'role' not in first
+        assert third['role'] == 'admin'
+        assert third['key'] == '2@d'
+    finally:
+        context._context.pop()
+
+    override = context.Task('e', 'msg', key='mine')
+    assert dict(override.context) == {'key': 'mine'}
+
+@isolated
+def test_serialized_context():
+    import json
+    from distlog.logger.formatters import JSONFormatter
+    tsk = context.Task('f', 'msg', user='leo')
+    context._context.push(tsk)
+    try:
+        record = context.LogRecord('name', 20, '/x.py', 1, 'hi', None, None)
+    finally:
+        context._context.pop()
+    data = json.loads(JSONFormatter().format(record))
+    assert data['context'] == {'key': '0@f', 'user': 'leo'}
+
+@isolated
+def test_context_per_thread():
+    import threading
+    started = threading.Barrier(2)
+    pushed = threading.Barrier(2)
+    seen = {}
+
+    def worker(name):
+        started.wait()
+        tsk = context.Task(name, 'msg')
+        context._context.push(tsk)
+        pushed.wait()
+        seen[name] = context._context.top.id
+        assert context._context.pop() is tsk
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in 'xy']
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert seen == {'x': 'x', 'y': 'y'}
+    assert context._context.top is None
+
+class Collect(logging.Handler):
+    def __init__(self):
+        super(Collect, self).__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+@isolated
+def test_sampler():
+    sampler = context.sampling.Sampler(0.0, rules=[
+        lambda ctx: True if ctx.get('user') == 'admin' else None,
+    ])
+    assert sampler.decide({'user': 'admin'})
+    assert not sampler.decide({'user': 'guest'})
+    assert context.sampling.Sampler(1.0).decide({})
+    with pytest.raises(ValueError):
+        context.sampling.Sampler(1.5)
+
+@isolated
+def test_sampling():
+    log = logging.getLogger('sampling')
+    log.setLevel(logging.DEBUG)
+    collect = Collect()
+    log.addHandler(collect)
+    try:
+        context.sampling.set_sampler(context.sampling.Sampler(0.0))
+        with context.task('dropped') as tsk:
+            assert not tsk.sampled
+            with context.to('sub') as sub:
+                assert not sub.sampled
+                log.info('not created')
+                foreign = sub.get_foreign_task()
+        assert collect.records == []
+        assert foreign == '{0}/1/1;0'.format(tsk._id)
+
+        context.sampling.set_sampler(None)
+        with context.import_task(foreign, 'downstream') as imp:
+            assert not imp.sampled
+            assert imp.id == '{0}/1/1'.format(tsk._id)
+            log.info('not created')
+        assert collect.records == []
+
+        with context.task('kept') as tsk:
+            assert tsk.sampled
+            log.info('created')
+            foreign = tsk.get_foreign_task()
+        assert [r.msg for r in collect.records] == ['created']
+        assert foreign == '{0}/1;1'.format(tsk._id)
+        with context.import_task(foreign, 'downstream') as imp:
+            assert imp.sampled
+        with context.import_task('abc/3', 'from an older process') as imp:
+            assert imp.sampled
+            assert imp.id == 'abc/3'
+    finally:
+        context.sampling.set_sampler(None)
+        log.removeHandler(collect)
+
+class Unformattable(object):
+    def __str__(self):
+        raise AssertionError('formatted')
+
+@isolated
+def test_silent_task_scopes():
+    root = logging.getLogger()
+    saved = root.handlers, root.level
+    collect = Collect()
+    try:
+        root.handlers = []
+        root.setLevel(logging.INFO)
+        with context.task('silent %s', Unformattable()) as tsk:
+            with context.to('child %s', Unformattable()) as child:
+                assert child.id == '{0}/1'.format(tsk._id)
+                foreign = child.get_foreign_task()
+            with pytest.raises(ValueError):
+                with context.to('failing %s', Unformattable()):
+                    raise ValueError('no handler')
+        assert foreign == '{0}/1/1;1'.format(tsk._id)
+        assert tsk.counter == child.counter == 0
+
+        root.handlers = [collect]
+        root.setLevel(logging.WARNING)
+        with pytest.raises(ValueError):
+            with context.task('quiet') as tsk:
+                raise ValueError('logged anyway')
+        assert [r.getMessage() for r in collect.records] == ['FAILED quiet']
+        assert collect.records[0].exc_info[0] is ValueError
+        assert collect.records[0].funcName == 'test_silent_task_scopes'
+
+        root.setLevel(logging.INFO)
+        del collect.records[:]
+        with context.task('loud %d', 1) as tsk:
+            pass
+        assert [r.getMessage() for r in collect.records] == ['loud 1', 'loud 1']
+    finally:
+        root.handlers = saved[0]
+        root.setLevel(saved[1])
+
+def test_caller_level():
+    log = logging.getLogger('caller')
+    log.setLevel(logging.DEBUG)
+    log.propagate = False
+    collect = Collect()
+    log.addHandler(collect)
+    try:
+        log.info('found')
+        log.set_caller_level(logging.WARNING)
+        log.info('skipped')
+        log.warning('found')
+        log.set_caller_level(None)
+        log.error('skipped')
+    finally:
+        log.removeHandler(collect)
+    found = [(r.getMessage(), r.funcName) for r in collect.records]
+    assert found == [('found', 'test_caller_level'),
+                     ('skipped', '(unknown function)'),
+                     ('found', 'test_caller_level'),
+                     ('skipped', '(unknown function)')]
+    assert collect.records[0].pathname == __file__
+    assert collect.records[1].pathname == '(unknown file)'
+    # the lookup is cached per code object
+    assert context._is_internal(context.Logger._log.__code__)
+    assert not context._is_internal(test_caller_level.__code__)
+
+@isolated
+def test_compact_records():
+    import copy
+    import pickle
+    from distlog.logger.formatters import JSONFormatter, LEAN_FIELDS
+
+    log = logging.getLogger('compact')
+    log.setLevel(logging.DEBUG)
+    log.propagate = False
+    collect = Collect()
+    log.addHandler(collect)
+    try:
+        with context.Task('t', 'task', user='leo'):
+            log.info('plain %s', 'record')
+            context.use_compact_records()
+            try:
+                log.info('plain %s', 'record')
+                log.warning('with %s', 'extra', extra={'request': 7})
+                for key in ('lineno', 'module', 'context'):
+                    with pytest.raises(KeyError):
+                        log.info('overwrite', extra={key: 1})
+            finally:
+                context.use_compact_records(False)
+            with pytest.raises(KeyError):
+                log.info('overwrite', extra={'lineno': 1})
+    finally:
+        log.removeHandler(collect)
+    plain, compact, extra = collect.records
+    assert type(plain) == context.LogRecord
+    assert type(compact) == context.CompactLogRecord
+    assert not hasattr(compact, '__weakref__')
+
+    assert set(compact.__dict__) == set(plain.__dict__)
+    assert compact.filename == plain.filename == 'test_context.py'
+    assert compact.module == 'test_context'
+    assert compact.context['user'] == 'leo'
+    assert extra.request == 7 and extra.__dict__['request'] == 7
+    assert extra._has_field('request') and not compact._has_field('request')
+    assert compact._has_field('relativeCreated')
+    formatter = logging.Formatter('%(levelname)s %(module)s:%(lineno)d %(message)s')
+    assert formatter.format(extra) == \
+        'WARNING test_context:{0} with extra'.format(extra.lineno)
+
+    for fields in (None, LEAN_FIELDS):
+        fmt = JSONFormatter(fields=fields)
+        data = [json.loads(fmt.format(r)) for r in (plain, compact)]
+        for d in data:
+            for key in ('created', 'msecs', 'relativeCreated', 'lineno'):
+                d.pop(key, None)
+            d['context'].pop('key')
+        assert data[0] == data[1]
+
+    for clone in (copy.copy(extra), pickle.loads(pickle.dumps(extra))):
+        assert clone.__dict__ == extra.__dict__
+
 if __name__ == '__main__':
     test_globals()
     test_context()
     test_logrecord()
     test_task()
     test_contextmanager()
+    test_task_ids()
+    test_task_context()
+    test_serialized_context()
+    test_context_per_thread()
+    test_sampler()
+    test_sampling()
+    test_silent_task_scopes()
+    test_caller_level()
+    test_compact_records()
@@ -0,0 +1,33 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import sys
+
+import pytest
+
+import distlog.logger.context as context
+from test_context import isolated
+
+pytestmark = pytest.mark.skipif(
+    sys.version_info < (3, 7),
+    reason='asyncio tasks have a context of their own from Python 3.7'
+)
+
+@isolated
+def test_context_per_asyncio_task():
+    async def request(name):
+        with context.Task(name, 'msg'):
+            await asyncio.sleep(0)
+            with context.to('step'):
+                await asyncio.sleep(0)
+                return context._context.top.id
+
+    async def run():
+        return await asyncio.gather(request('p'), request('q'))
+
+    assert asyncio.run(run()) == ['p/1', 'q/1']
+    assert context._context.top is None
+
+if __name__ == '__main__':
+    test_context_per_asyncio_task()
@@ -2,12 +2,16 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import os
 import json
 import pickle
+import time
 
 import pytest
 
 import distlog.logger.formatters as formatters
+import distlog.logger.packer as packer
+from distlogd import codec, unpacker
 
 @pytest.fixture
 def record(request):
@@ -34,3 +38,142 @@ def test_returned_pickle_matches_record(record):
     assert data['module'] == 'else'
     assert data['lineno'] == 50
     assert data['message'] == 'hi there number 1'
+
+def test_returned_msgpack_matches_record(record):
+    mf = formatters.MsgPackFormatter()
+    s = mf.format(record)
+    data = unpacker.unpackb(s)
+    assert data['name'] == 'name'
+    assert data['levelno'] == 20
+    assert data['filename'] == 'else.py'
+    assert data['module'] == 'else'
+    assert data['lineno'] == 50
+    assert data['message'] == 'hi there number 1'
+    assert len(s) < len(formatters.JSONFormatter().format(record))
+
+def test_packer_encoding():
+    assert packer.packb(None) == b'\xc0'
+    assert packer.packb([True, False]) == b'\x92\xc3\xc2'
+    assert packer.packb(5) == b'\x05'
+    assert packer.packb(-1) == b'\xff'
+    assert packer.packb(200) == b'\xcc\xc8'
+    assert packer.packb(-200) == b'\xd1\xff\x38'
+    assert packer.packb(u'abc') == b'\xa3abc'
+    assert packer.packb(b'ab') == b'\xc4\x02ab'
+    assert packer.packb({u'a': 1.5}) == b'\x81\xa1a\xcb\x3f\xf8\x00\x00\x00\x00\x00\x00'
+
+def test_packer_roundtrip():
+    values = [
+        0, 127, 128, -32, -33, 255, 256, 65535, 65536, 2 ** 32, 2 ** 64 - 1,
+        -128, -129, -32768, -32769, -2 ** 31 - 1, -2 ** 63,
+        0.1, u'', u'x' * 31, u'x' * 32, u'x' * 256, u'x' * 65536, u'€',
+        b'\x00' * 300, list(range(20)), dict((str(i), i) for i in range(20)),
+        {u'nest': [1, {u'deep': None}]}
+    ]
+    for value in values:
+        assert unpacker.unpackb(packer.packb(value)) == value
+    assert unpacker.unpackb(packer.packb((1, 2))) == [1, 2]
+    assert unpacker.unpackb(packer.packb(2 ** 64)) == str(2 ** 64)
+    assert unpacker.unpackb(packer.packb(object)) == str(object)
+
+def test_interned_records_are_rebuilt(record):
+    jf = formatters.JSONFormatter()
+    plain = jf.format(record)
+    strings = formatters.StringTable()
+    dictionaries = codec.Dictionaries()
+
+    record.context = {'key': '0@a', 'user': 'leo'}
+    first = jf.format_interned(record, strings)
+    second = jf.format_interned(record, strings)
+    assert len(second) < len(first)
+    assert len(second) < len(plain)
+    for s in (first, second):
+        data = dictionaries.expand(json.loads(s))
+        assert data['pathname'] == '/here/and/nowhere/else.py'
+        assert data['module'] == 'else'
+        assert data['lineno'] == 50
+        assert data['context'] == {'key': '0@a', 'user': 'leo'}
+
+def test_string_table_epochs(record):
+    strings = formatters.StringTable(max_size=24)
+    first = strings.intern({'name': 'a', 'module': 'b', 'context': None})
+    assert first['~s'][1:] == [0, 0, ['name', 'a', 'module', 'b']]
+    again = strings.intern({'name': 'a', 'module': 'b', 'context': None})
+    assert again['~s'][1:] == [0, 4, []]
+    assert again['~r'] == [0, 1, 2, 3]
+    # a full dictionary starts a new epoch and resends the strings
+    strings.intern({'name': 'c', 'module': 'd'})
+    restart = strings.intern({'name': 'a', 'module': 'b'})
+    assert restart['~s'][1:] == [1, 0, ['name', 'a', 'module', 'b']]
+
+def test_unknown_strings_after_restart():
+    now = time.time()
+    strings = formatters.StringTable()
+    strings.intern({'name': 'a', 'lineno': 1, 'created': now,
+                    'context': {'user': 'leo'}})
+    dictionaries = codec.Dictionaries()
+    data = dictionaries.expand(strings.intern(
+        {'name': 'a', 'lineno': 1, 'created': now,
+         'context': {'user': 'leo'}}))
+    assert data == {'lineno': 1, 'created': now, 'context': {}}
+    # the next epoch defines the strings again
+    data = dictionaries.expand(strings.intern(
+        {'name': 'a', 'lineno': 2, 'created': now + strings.max_age + 1}))
+    assert data['name'] == 'a'
+
+def test_lean_record_leaves_record_untouched(record):
+    before = dict(record.__dict__)
+    lf = formatters.JSONFormatter(fields=formatters.LEAN_FIELDS)
+    data = json.loads(lf.format(record))
+    assert record.__dict__ == before
+    assert data['message'] == 'hi there number 1'
+    assert data['hostname'] == os.uname()[1]
+    assert data['process'] == os.getpid()
+    assert 'asctime' not in data
+    assert 'filename' not in data
+    assert 'args' not in data
+    assert 'exc_text' not in data
+    assert len(json.dumps(data)) < len(formatters.JSONFormatter().format(record))
+    assert codec.derive(data)['filename'] == 'else.py'
+
+def test_exception_text_is_not_cached_on_record():
+    try:
+        raise ValueError('boom')
+    except ValueError:
+        import sys
+        record = logging.LogRecord('name', 40, '/x.py', 1, 'failed', None, sys.exc_info())
+    data = pickle.loads(formatters.PickleFormatter(envelope={'app': 'test'}).format(record))
+    assert 'ValueError: boom' in data['exc_text']
+    assert '\n' not in data['exc_text']
+    assert data['exc_info'] is None
+    assert data['app'] == 'test'
+    assert record.exc_text is None
+    assert record.exc_info is not None
+
+def test_formatter_arguments_from_dict_config():
+    import logging.config
+    logging.config.dictConfig({
+        'version': 1,
+        'formatters': {'json': {
+            '()': 'distlog.JSONFormatter',
+            'format': '%(message)s', 'datefmt': '%H:%M',
+            'fields': formatters.LEAN_FIELDS,
+        }, 'plain': {
+            'class': 'distlog.JSONFormatter', 'format': '%(message)s',
+        }},
+        'handlers': {'null': {
+            'class': 'logging.NullHandler', 'formatter': 'json',
+        }, 'plain': {
+            'class': 'logging.NullHandler', 'formatter': 'plain',
+        }},
+        'loggers': {'dictconfig': {'handlers': ['null', 'plain']}},
+    })
+    handlers = logging.getLogger('dictconfig').handlers
+    lean, plain = [h.formatter for h in handlers]
+    assert lean.fields == formatters.LEAN_FIELDS
+    assert lean.datefmt == '%H:%M'
+    assert plain.fields is None
+    assert plain._fmt == '%(message)s'
+    for handler in handlers:
+        handler.close()
+    logging.getLogger('dictconfig').handlers = []
@@ -2,16 +2,25 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import os
+import shutil
+import tempfile
 import time
 import json
 from threading import Thread
 
+import pytest
 import zmq
 from zmq.utils.strtypes import cast_unicode
 
 
-from distlog.logger.handler import ZmqHandler
-from distlog.logger.formatters import JSONFormatter
+from distlog.logger.handler import ZmqHandler, FrameBuffer, \
+    OVERFLOW_DROP_NEWEST, OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_BELOW_LEVEL
+from distlog.logger.formatters import JSONFormatter, LEAN_FIELDS
+from distlog.logger.ratelimit import RateLimiter
+from distlog.logger.spill import SpillBuffer
+from distlog.logger import context, perf
+from distlogd import codec
 
 CONNECTPOINT = "tcp://localhost:6001"
 BINDPOINT = "tcp://*:6001"
@@ -58,5 +67,605 @@ def test_handler():
     subscriber_thread()
     p_thread.join()
 
+def make_record(level=20, msg='hi there %s %d'):
+    return logging.LogRecord('name', level, '/here/and/nowhere/else.py', 50, msg, ('number', 1), None)
+
+@pytest.fixture
+def receiver():
+    """A PULL socket bound to a random port: context, socket and endpoint."""
+    ctx = zmq.Context()
+    sink = ctx.socket(zmq.PULL)
+    port = sink.bind_to_random_port('tcp://127.0.0.1')
+    yield ctx, sink, 'tcp://127.0.0.1:{}'.format(port)
+    sink.close()
+    ctx.term()
+
+def test_async_handler(receiver):
+    ctx, sink, endpoint = receiver
+
+    handler = ZmqHandler(endpoint, ctx, queue_size=100)
+    handler.setFormatter(JSONFormatter())
+    for i in range(10):
+        handler.emit(make_record())
+    handler.flush()
+    assert handler.queued == 10
+    assert handler.dropped == 0
+
+    for i in range(10):
+        topic, body = sink.recv_multipart()
+        assert topic == b'PLJ'
+        assert json.loads(cast_unicode(body))['message'] == 'hi there number 1'
+    handler.close()
+    handler.socket.close()
+
+def test_batching_handler(receiver):
+    ctx, sink, endpoint = receiver
+
+    handler = ZmqHandler(endpoint, ctx, batch_size=4, batch_interval=50)
+    handler.setFormatter(JSONFormatter())
+    for i in range(10):
+        handler.emit(make_record())
+    handler.close()
+
+    records = []
+    while len(records) < 10:
+        topic, body = sink.recv_multipart()
+        assert topic in (b'PLJ', b'PLJB')
+        records.extend(codec.decode(topic, body))
+    assert all(r['message'] == 'hi there number 1' for r in records)
+
+    handler.socket.close()
+
+def test_interning_handler(receiver):
+    ctx, sink, endpoint = receiver
+
+    handler = ZmqHandler(endpoint, ctx, intern=True)
+    handler.setFormatter(JSONFormatter())
+    for i in range(3):
+        handler.emit(make_record())
+
+    sizes = []
+    for i in range(3):
+        topic, body = sink.recv_multipart()
+        assert topic == b'PLJD'
+        sizes.append(len(body))
+        data, = codec.decode(topic, body)
+        assert data['filename'] == 'else.py'
+        assert data['message'] == 'hi there number 1'
+    assert sizes[1] < sizes[0]
+
+    handler.socket.close()
+
+def test_compressing_handler(receiver):
+    ctx, sink, endpoint = receiver
+
+    handler = ZmqHandler(endpoint, ctx,
+                         batch_size=10, batch_interval=200, compression=1)
+    handler.setFormatter(JSONFormatter())
+    plain = len(handler.format(make_record()))
+    for i in range(10):
+        handler.emit(make_record())
+    handler.close()
+
+    records = []
+    while len(records) < 10:
+        topic, body = sink.recv_multipart()
+        assert topic.startswith(b'PLJ')
+        batch = codec.decode(topic, body)
+        if len(batch) > 1:
+            assert topic == b'PLJBZ'
+            assert len(body) < plain * len(batch) / 2
+        records.extend(batch)
+    assert all(r['message'] == 'hi there number 1' for r in records)
+
+    handler.socket.close()
+
+def test_zero_copy_batches(receiver):
+    ctx, sink, endpoint = receiver
+
+    handler = ZmqHandler(endpoint, ctx,
+                         batch_size=5, batch_interval=100, zero_copy_threshold=0)
+    handler.setFormatter(JSONFormatter())
+    for i in range(30):
+        handler.emit(make_record())
+        if i % 5 == 4:
+            handler.flush()
+    handler.close()
+
+    records = []
+    while len(records) < 30:
+        topic, body = sink.recv_multipart()
+        records.extend(codec.decode(topic, body))
+    assert all(r['message'] == 'hi there number 1' for r in records)
+    assert handler._frames.allocated + handler._frames.reused >= 6
+    assert handler._frames.reused > 0
+
+    handler.socket.close()
+
+def test_frame_buffer():
+    frame = FrameBuffer(4)
+    frame.write(b'abc')
+    frame += b'defgh'
+    assert frame.view().tobytes() == b'abcdefgh'
+    view = frame.view()
+    frame.write(b'x' * 20)
+    assert view.tobytes() == b'abcdefgh'
+    assert frame.view().tobytes() == b'abcdefgh' + b'x' * 20
+
+class QuietHandler(ZmqHandler):
+    errors = 0
+
+    def handleError(self, record):
+        self.errors += 1
+
+def stalled_handler(overflow):
+    """Create a handler whose sender thread is stuck on a peerless socket."""
+    ctx = zmq.Context()
+    sock = ctx.socket(zmq.PUSH)
+    sock.setsockopt(zmq.SNDTIMEO, 200)
+    sock.setsockopt(zmq.LINGER, 0)
+    handler = QuietHandler(sock, queue_size=2, overflow=overflow)
+    handler.setFormatter(JSONFormatter())
+    handler.emit(make_record(msg='stuck'))
+    while not handler._queue.empty():
+        time.sleep(0.001)
+    return handler
+
+def drain(handler):
+    items = []
+    while not handler._queue.empty():
+        items.append(handler._queue.get_nowait())
+        handler._queue.task_done()
+    handler.close()
+    handler.socket.close()
+    handler.context.term()
+    return items
+
+def test_overflow_drop_newest():
+    handler = stalled_handler(OVERFLOW_DROP_NEWEST)
+    for msg in ('a', 'b', 'c', 'd'):
+        handler.emit(make_record(msg=msg))
+    assert handler.queued == 3
+    assert handler.dropped == 2
+    assert [r.msg for r in drain(handler)] == ['a', 'b']
+
+def test_overflow_drop_oldest():
+    handler = stalled_handler(OVERFLOW_DROP_OLDEST)
+    for msg in ('a', 'b', 'c', 'd'):
+        handler.emit(make_record(msg=msg))
+    assert handler.queued == 5
+    assert handler.dropped == 2
+    assert [r.msg for r in drain(handler)] == ['c', 'd']
+
+def test_overflow_drop_below_level():
+    handler = stalled_handler(OVERFLOW_DROP_BELOW_LEVEL)
+    handler.emit(make_record(msg='a'))
+    handler.emit(make_record(msg='b'))
+    handler.emit(make_record(level=logging.INFO, msg='c'))
+    assert handler.dropped == 1
+    # a WARNING waits until the sender thread made room
+    handler.emit(make_record(level=logging.WARNING, msg='d'))
+    assert handler.dropped == 1
+    assert handler.queued == 4
+    assert drain(handler)[-1].msg == 'd'
+
+def timed_record(created, lineno=50, level=logging.WARNING):
+    record = make_record(level=level)
+    record.lineno = lineno
+    record.created = created
+    return record
+
+def test_rate_limiter():
+    limiter = RateLimiter(2, burst=2)
+    passed = [limiter.check(timed_record(100.0 + i * 0.1)) for i in range(10)]
+    # the record allowed after a suppression comes with a summary
+    assert [len(p) for p in passed] == [1, 1, 0, 0, 0, 2, 0, 0, 0, 0]
+    assert passed[5][0].suppressed == 3
+    # other call sites and levels have buckets of their own
+    assert len(limiter.check(timed_record(100.9, lineno=51))) == 1
+    assert len(limiter.check(timed_record(100.9, level=logging.ERROR))) == 1
+
+    summary, record = limiter.check(timed_record(103.0))
+    assert record.created == 103.0
+    assert summary.getMessage() == '4 similar messages suppressed'
+    assert summary.suppressed == 4
+    assert summary.first_created == 100.0 + 6 * 0.1
+    assert summary.last_created == summary.created == 100.0 + 9 * 0.1
+    assert summary.lineno == 50
+
+    limiter.check(timed_record(103.0))
+    limiter.check(timed_record(103.0))
+    summaries = limiter.drain()
+    assert [s.suppressed for s in summaries] == [1]
+    assert limiter.drain() == []
+
+def test_rate_limiter_bounded():
+    limiter = RateLimiter(1, max_sites=3)
+    for i in range(3):
+        limiter.check(timed_record(100.0))
+    limiter.check(timed_record(100.0, lineno=51))
+    limiter.check(timed_record(100.0, lineno=52))
+    assert len(limiter) == 3
+    # the suppressed records of the evicted site are reported at once
+    summary, record = limiter.check(timed_record(100.0, lineno=53))
+    assert (summary.lineno, summary.suppressed) == (50, 2)
+    assert record.lineno == 53
+    assert len(limiter) == 3
+
+def test_rate_limiter_interval():
+    limiter = RateLimiter(1, interval=5)
+    assert limiter.check(timed_record(100.0))
+    assert limiter.check(timed_record(100.5)) == ()
+    assert limiter.check(timed_record(100.6)) == ()
+    assert limiter.next_due == 105.5
+    assert limiter.due(105.0) == []
+    # the site went quiet, another one reports it
+    summary, record = limiter.check(timed_record(105.5, lineno=51))
+    assert (summary.lineno, summary.suppressed) == (50, 2)
+    assert record.lineno == 51
+    assert limiter.next_due is None
+    # a site suppressed all along is summarized every interval
+    limiter = RateLimiter(0.01, burst=1, interval=5)
+    passed = [limiter.check(timed_record(100.0 + i * 0.01))
+              for i in range(1000)]
+    summaries = [r for p in passed for r in p if hasattr(r, 'suppressed')]
+    assert [s.suppressed for s in summaries] == [500]
+    assert summaries[0].first_created == 100.01
+
+def test_rate_limiter_without_caller():
+    limiter = RateLimiter(1)
+
+    def record(msg):
+        rec = timed_record(100.0, lineno=0)
+        rec.pathname, rec.msg, rec.args = '(unknown file)', msg, None
+        return rec
+
+    assert limiter.check(record('a'))
+    assert limiter.check(record('a')) == ()
+    # another message is another call site, even in the same file
+    assert limiter.check(record('b'))
+    assert limiter.check(record(Exception('c')))
+    assert len(limiter) == 3
+
+def test_rate_limited_handler(receiver):
+    ctx, sink, endpoint = receiver
+
+    handler = ZmqHandler(endpoint, ctx, rate_limit=5)
+    handler.setFormatter(JSONFormatter())
+    for i in range(100):
+        handler.handle(make_record(level=logging.WARNING))
+    handler.flush()
+    messages = []
+    while sink.poll(100):
+        head, body = sink.recv_multipart()
+        messages.extend(r['message'] for r in codec.decode(head, body))
+    assert len(messages) == 6
+    assert messages[-1] == '95 similar messages suppressed'
+
+    handler.close()
+    handler.socket.close()
+
+def test_rate_limited_handler_summaries(receiver):
+    ctx, sink, endpoint = receiver
+
+    handler = ZmqHandler(endpoint, ctx, queue_size=100,
+                         rate_limit=RateLimiter(5, interval=0.2))
+    handler.setFormatter(JSONFormatter())
+    for i in range(20):
+        handler.handle(make_record(level=logging.WARNING))
+    # nothing else is logged, the sender thread reports the burst
+    messages = []
+    while len(messages) < 6 and sink.poll(2000):
+        head, body = sink.recv_multipart()
+        messages.extend(r['message'] for r in codec.decode(head, body))
+    assert messages[-1] == '15 similar messages suppressed'
+
+    handler.close()
+    handler.socket.close()
+
+def receive_timings(receiver, **kwargs):
+    ctx, sink, endpoint = receiver
+    handler = ZmqHandler(endpoint, ctx, performance=True, **kwargs)
+    handler.setFormatter(JSONFormatter())
+    perf.set_cpu_timing(True)
+    try:
+        with context.Task('t', 'outer %s', 'task'):
+            for i in range(3):
+                with context.to('inner'):
+                    pass
+            try:
+                with context.to('failing'):
+                    raise ValueError('failed')
+            except ValueError:
+                pass
+    finally:
+        perf.set_cpu_timing(False)
+        handler.flush()
+        handler.close()
+    assert handler not in perf.handlers
+
+    timings = []
+    while sink.poll(100):
+        head, body = sink.recv_multipart()
+        assert codec.is_performance(head)
+        timings.extend(codec.decode(head, body))
+    handler.socket.close()
+    return timings
+
+@pytest.mark.parametrize('kwargs', [
+    {}, {'batch_size': 10, 'batch_interval': 50}
+])
+def test_performance_data(receiver, kwargs):
+    timings = receive_timings(receiver, **kwargs)
+    assert [t['task'] for t in timings] == ['t/1', 't/2', 't/3', 't/4', 't']
+    assert [t['msg'] for t in timings][-2:] == ['failing', 'outer %s']
+    assert [t['failed'] for t in timings] == [False] * 3 + [True, False]
+    outer = timings[-1]
+    assert 0 <= outer['cpu'] and 0 <= outer['duration'] < 1
+    assert outer['duration'] >= sum(t['duration'] for t in timings[:-1])
+    assert 'hostname' in outer
+
+def test_metrics_handler(receiver):
+    ctx, sink, endpoint = receiver
+    handler = ZmqHandler(endpoint, ctx, metrics=True)
+    handler.setFormatter(JSONFormatter())
+    assert handler in perf.metrics_handlers
+    assert handler not in perf.handlers
+    try:
+        with context.Task('t', 'outer'):
+            pass
+        perf.publish_metrics({'type': 'metrics', 'counters': ['hits', '', 1]})
+    finally:
+        handler.close()
+    assert handler not in perf.metrics_handlers
+
+    head, body = sink.recv_multipart()
+    assert codec.is_performance(head)
+    assert [d['type'] for d in codec.decode(head, body)] == ['metrics']
+    assert not sink.poll(100)
+    handler.socket.close()
+
+def test_spill_buffer():
+    directory = tempfile.mkdtemp()
+    try:
+        spill = SpillBuffer(os.path.join(directory, 'spill'), 300, 100)
+        for i in range(5):
+            assert spill.append(b'PLJ', b'x' * 20 + str(i).encode(), 2)
+        assert len(spill) == 10
+        assert spill.peek() == (b'PLJ', b'x' * 20 + b'0', 2, 0.0)
+        spill.pop()
+        assert spill.peek()[1].endswith(b'1')
+        # the segments are full, the oldest one is overwritten
+        for i in range(5, 8):
+            spill.append(b'PLJ', b'x' * 20 + str(i).encode())
+        assert spill.lost == 2
+        bodies = []
+        while spill:
+            bodies.append(spill.peek()[1][-1:])
+            spill.pop()
+        assert bodies == [b'2', b'3', b'4', b'5', b'6', b'7']
+        assert not spill.append(b'PLJ', b'x' * 100)
+        spill.close()
+        assert os.listdir(directory) == []
+    finally:
+        shutil.rmtree(directory)
+
+def spilling_handler(ctx, directory, **kwargs):
+    """Handler connected to a receiver that is down."""
+    sink = ctx.socket(zmq.PULL)
+    port = sink.bind_to_random_port('tcp://127.0.0.1')
+    sink.close()
+
+    # distlogd is down, the socket only takes a few messages
+    sock = ctx.socket(zmq.PUSH)
+    sock.setsockopt(zmq.SNDHWM, 2)
+    sock.setsockopt(zmq.LINGER, 0)
+    sock.connect('tcp://127.0.0.1:{}'.format(port))
+    kwargs.setdefault('replay_rate', 1 << 16)
+    kwargs.setdefault('drain_timeout', 0.2)
+    handler = ZmqHandler(sock, spill=os.path.join(directory, 'spill'),
+                         spill_size=1 << 18, **kwargs)
+    handler.setFormatter(JSONFormatter())
+    return handler, port
+
+def test_spilling_handler():
+    ctx = zmq.Context()
+    directory = tempfile.mkdtemp()
+    handler, port = spilling_handler(ctx, directory)
+    for i in range(50):
+        handler.emit(make_record(msg='record ' + str(i) + ' %s %d'))
+    handler.flush()
+    assert handler.spilled > 40
+    assert handler.spilled_bytes > handler.spilled * 100
+    assert handler.replayed == 0
+
+    # distlogd comes back, new records follow the spilled ones
+    sink = ctx.socket(zmq.PULL)
+    sink.bind('tcp://127.0.0.1:{}'.format(port))
+    handler.emit(make_record(msg='new %s %d'))
+    received = []
+    while len(received) < 51:
+        topic, body = sink.recv_multipart()
+        received.extend(r['msg'] for r in codec.decode(topic, body))
+    handler.close()
+    assert handler.replayed == handler.spilled
+    assert received == ['record ' + str(i) + ' %s %d' for i in range(50)] + \
+        ['new %s %d']
+    assert os.listdir(directory) == []
+    shutil.rmtree(directory)
+    handler.socket.close()
+    sink.close()
+    ctx.term()
+
+def test_spilling_handler_close():
+    ctx = zmq.Context()
+    directory = tempfile.mkdtemp()
+    handler, port = spilling_handler(ctx, directory, replay_rate=1000,
+                                     drain_timeout=5)
+    for i in range(50):
+        handler.emit(make_record(msg='record ' + str(i) + ' %s %d'))
+    handler._queue.join()
+    assert handler.spilled > 40
+
+    # closing sends the spill file and the records added to it, at once
+    sink = ctx.socket(zmq.PULL)
+    sink.bind('tcp://127.0.0.1:{}'.format(port))
+    for i in range(50, 70):
+        handler.emit(make_record(msg='record ' + str(i) + ' %s %d'))
+    handler.flush()
+    handler.close()
+    received = []
+    while sink.poll(1000):
+        topic, body = sink.recv_multipart()
+        received.extend(r['msg'] for r in codec.decode(topic, body))
+    shutil.rmtree(directory)
+    handler.socket.close()
+    sink.close()
+    ctx.term()
+    assert received == ['record ' + str(i) + ' %s %d' for i in range(70)]
+    assert handler.replayed == handler.spilled
+    assert handler.dropped == 0
+
+def test_spilling_handler_close_unreachable():
+    ctx = zmq.Context()
+    directory = tempfile.mkdtemp()
+    handler, port = spilling_handler(ctx, directory)
+    for i in range(20):
+        handler.emit(make_record(msg='record ' + str(i) + ' %s %d'))
+    handler.close()
+    # only the few messages the socket took are not counted
+    assert handler.replayed == 0
+    assert 15 <= handler.dropped == handler.spilled
+    assert os.listdir(directory) == []
+    shutil.rmtree(directory)
+    handler.socket.close()
+    ctx.term()
+
+def test_spilling_interning_handler():
+    ctx = zmq.Context()
+    directory = tempfile.mkdtemp()
+    handler, port = spilling_handler(ctx, directory, intern=True,
+                                     replay_rate=2000)
+
+    def record(name, i):
+        return logging.LogRecord(name, 20, '/' + name + '.py', 50,
+                                 'record %d', (i,), None)
+
+    for i in range(5):
+        handler.emit(record('early', i))
+    handler.flush()
+    # the strings of these records are only defined in the spill file
+    for i in range(5, 20):
+        handler.emit(record('late', i))
+    handler.flush()
+    assert handler.spilled > 10
+
+    sink = ctx.socket(zmq.PULL)
+    sink.bind('tcp://127.0.0.1:{}'.format(port))
+    received = codec.decode(*sink.recv_multipart())
+    handler.emit(record('late', 20))
+    while len(received) < 21:
+        topic, body = sink.recv_multipart()
+        received.extend(codec.decode(topic, body))
+    handler.close()
+    assert [data['message'] for data in received] == \
+        ['record %d' % i for i in range(21)]
+    for data in received:
+        assert data['pathname'] == '/' + data['name'] + '.py'
+    shutil.rmtree(directory)
+    handler.socket.close()
+    sink.close()
+    ctx.term()
+
+def test_fork(receiver):
+    _, sink, endpoint = receiver
+
+    handler = ZmqHandler(endpoint, queue_size=10, intern=True)
+    handler.setFormatter(JSONFormatter(fields=LEAN_FIELDS))
+    handler.emit(make_record(msg='parent %s %d'))
+    handler.flush()
+
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            assert handler._forked
+            handler.emit(make_record(msg='child %s %d'))
+            handler.close()
+            assert handler.queued == 1
+            handler.socket.close()
+            handler.context.term()
+            status = 0
+        finally:
+            os._exit(status)
+    assert os.waitpid(pid, 0)[1] == 0
+    assert not handler._forked
+    handler.emit(make_record(msg='later %s %d'))
+
+    records = {}
+    while len(records) < 3:
+        topic, body = sink.recv_multipart()
+        for data in codec.decode(topic, body):
+            records[data['message'].split()[0]] = data
+    assert records['parent']['process'] == os.getpid()
+    assert records['later']['process'] == os.getpid()
+    assert records['child']['process'] == pid
+    handler.close()
+    handler.socket.close()
+
+def test_fork_state(receiver):
+    _, sink, endpoint = receiver
+
+    handler = ZmqHandler(endpoint, rate_limit=RateLimiter(1, burst=1))
+    handler.setFormatter(JSONFormatter(envelope={'process': 'web'}))
+    for i in range(3):
+        handler.handle(make_record(level=logging.WARNING))
+    assert handler._limiter.next_due is not None
+
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            # the parent reports the records it suppressed
+            handler.handle(make_record(msg='child %s %d'))
+            assert len(handler._limiter) == 1
+            assert handler.formatter.envelope['process'] == 'web'
+            handler.close()
+            handler.socket.close()
+            handler.context.term()
+            status = 0
+        finally:
+            os._exit(status)
+    assert os.waitpid(pid, 0)[1] == 0
+    handler.close()
+
+    messages = []
+    while sink.poll(200):
+        head, body = sink.recv_multipart()
+        messages.extend(r['message'] for r in codec.decode(head, body))
+    assert sorted(messages) == ['2 similar messages suppressed',
+                                'child number 1', 'hi there number 1']
+    handler.socket.close()
+
+def test_stamping_handler(receiver):
+    ctx, sink, endpoint = receiver
+
+    handler = ZmqHandler(endpoint, ctx,
+                         batch_size=4, batch_interval=50, stamp=True)
+    handler.setFormatter(JSONFormatter())
+    before = time.time()
+    for i in range(6):
+        handler.emit(make_record())
+    handler.close()
+
+    records = []
+    while len(records) < 6:
+        frames = sink.recv_multipart()
+        assert len(frames) == 3
+        assert before <= codec.sent_at(frames) <= time.time()
+        records.extend(codec.decode(frames[0], frames[1]))
+
+    handler.socket.close()
+
 if __name__ == '__main__':
-    test_handler()
+    pytest.main([__file__])
@@ -0,0 +1,239 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import random
+import threading
+import time
+
+from distlog.logger import context, perf
+from distlog.logger.metrics import Metrics, bucket, bucket_bounds
+from distlogd import codec, plugins
+from distlogd.main import receive, stats
+from distlogd import metrics as fleet
+
+
+def test_buckets():
+    for value in (1e-6, 0.001, 0.5, 0.75, 1.0, 3.0, 1234.5, 1e9):
+        lower, upper = bucket_bounds(bucket(value))
+        assert lower <= value < upper
+        assert (upper - lower) / lower <= 1.0 / 16
+    assert bucket(1.0) + 1 == bucket(1.0 + 1.0 / 16)
+
+
+def test_counters_and_gauges():
+    metrics = Metrics()
+
+    def work():
+        for i in range(1000):
+            metrics.count('hits')
+        metrics.count('bytes', 10, label='upload')
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    metrics.count('hits')
+    metrics.gauge('queue', 3)
+    metrics.gauge('queue', 5)
+
+    data = metrics.collect()
+    assert data['type'] == 'metrics'
+    assert sorted(zip(*[iter(data['counters'])] * 3)) == [
+        ('bytes', 'upload', 40), ('hits', '', 4001)
+    ]
+    assert data['gauges'] == ['queue', '', 5]
+
+    # only the increase is published, the ended threads are retired
+    metrics.count('hits', 2)
+    data = metrics.collect()
+    assert data['counters'] == ['hits', '', 2]
+    assert data['gauges'] == ['queue', '', 5]
+    assert len(metrics._shards) == 1
+
+
+def test_label_from_task():
+    metrics = Metrics()
+    with context.Task('t', 'fetching %s', 'orders'):
+        metrics.count('queries')
+    assert metrics.collect()['counters'] == ['queries', 'fetching %s', 1]
+
+
+def test_histograms():
+    metrics = Metrics()
+    values = [random.expovariate(10.0) for _ in range(20000)]
+
+    def work(part):
+        for value in part:
+            metrics.observe('latency', value, label='get')
+
+    threads = [threading.Thread(target=work, args=(values[i::4],))
+               for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    metrics.observe('latency', 0, label='get')
+
+    first = metrics.collect()['histograms']
+    assert len(first) == 1
+    name, label, count, total, zero, buckets = first[0]
+    assert (name, label, count, zero) == ('latency', 'get', 20001, 1)
+    assert abs(total - sum(values)) < 1e-6
+    assert sum(buckets[1::2]) == 20000
+
+    metrics.observe('latency', 0.5, label='get')
+    second = metrics.collect()['histograms']
+    assert second == [['latency', 'get', 1, 0.5, 0, [bucket(0.5), 1]]]
+    assert metrics.collect()['histograms'] == []
+
+    # merged over several producers the percentiles stay accurate
+    aggregator = fleet.Aggregator()
+    aggregator.add(dict(hostname='a', process=1, histograms=first))
+    aggregator.add(dict(hostname='b', process=2, histograms=first))
+    values.append(0)
+    values.sort()
+    for quantile in (0.5, 0.9, 0.99):
+        exact = values[int(quantile * len(values))]
+        estimate = aggregator.percentile('latency', 'get', quantile)
+        assert abs(estimate - exact) / exact < 0.05
+
+    report = aggregator.report()
+    assert report['histograms'][0]['count'] == 40002
+    assert set(['p50', 'p90', 'p99', 'p99.9']) <= set(report['histograms'][0])
+    assert aggregator.histograms == {}
+
+
+def test_aggregator():
+    aggregator = fleet.Aggregator()
+    aggregator.add(dict(hostname='a', process=1, counters=['hits', '', 3],
+                        gauges=['queue', '', 5]))
+    aggregator.add(dict(hostname='b', process=1, counters=['hits', '', 4],
+                        gauges=['queue', '', 7]))
+    report = aggregator.report()
+    assert report['counters'] == [{'name': 'hits', 'label': '', 'value': 7}]
+    assert sorted(g['value'] for g in report['gauges']) == [5, 7]
+
+
+class Publisher(object):
+    def __init__(self):
+        self.sent = []
+
+    def send_perf_data(self, data):
+        self.sent.append(data)
+
+
+def test_flush():
+    metrics = Metrics()
+    publisher = Publisher()
+    perf.add_handler(publisher)
+    try:
+        metrics.flush()
+        metrics.count('hits')
+        metrics.start(interval=0.01)
+        metrics.stop()
+    finally:
+        perf.remove_handler(publisher)
+    assert [data['counters'] for data in publisher.sent] == [['hits', '', 1]]
+
+
+def test_metrics_without_timings():
+    metrics = Metrics()
+    publisher = Publisher()
+    perf.add_handler(publisher, timings=False)
+    try:
+        with context.Task('t', 'work'):
+            metrics.count('hits')
+        metrics.flush()
+    finally:
+        perf.remove_handler(publisher)
+    assert [data.get('type') for data in publisher.sent] == ['metrics']
+    assert publisher not in perf.metrics_handlers
+
+
+def test_fork():
+    metrics = Metrics()
+    metrics.count('hits', label='')
+    metrics.start(interval=60)
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            # the parent publishes its own count, the child only its own
+            assert metrics._flusher[0].is_alive()
+            metrics.count('hits', 2, label='')
+            os.write(write, json.dumps(metrics.collect()).encode())
+            status = 0
+        finally:
+            os._exit(status)
+    os.close(write)
+    child = json.loads(os.read(read, 4096).decode())
+    os.close(read)
+    assert os.waitpid(pid, 0)[1] == 0
+    assert child['counters'] == ['hits', '', 2]
+    assert metrics.collect()['counters'] == ['hits', '', 1]
+    metrics.stop()
+
+
+class Collect(plugins.Plugin):
+
+    def __init__(self):
+        self.records = []
+
+    def match(self, data):
+        return True
+
+    def handle(self, data):
+        self.records.append(data)
+
+
+def test_ingest_stats():
+    stats = fleet.IngestStats()
+    for i in range(1, 101):
+        stats.observe('lag', i / 1000.0)
+    stats.observe('decode', 0.0)
+    report = stats.report(reset=True)
+    assert report['type'] == 'ingest'
+    lag = report['histograms']['lag']
+    assert lag['count'] == 100
+    assert abs(lag['mean'] - 0.0505) < 1e-9
+    assert 0.045 <= lag['p50'] <= 0.055
+    assert 0.09 <= lag['p99'] <= 0.1
+    assert report['histograms']['decode']['p50'] == 0
+    assert stats.report()['histograms'] == {}
+
+
+def test_receive():
+    plugin = Collect()
+    plugins.add_plugin(plugin)
+    fleet.ingest.reset()
+    try:
+        body = b'{"message": "hello"}'
+        stamp = codec.STAMP.pack(time.time() - 0.5)
+        assert receive([b'PLJ', body, stamp], fleet.Aggregator()) == 1
+        assert receive([b'PLJ', body], fleet.Aggregator()) == 1
+        report = stats(reset=True)
+    finally:
+        plugins._plugins.remove(plugin)
+    assert [r['message'] for r in plugin.records] == ['hello', 'hello']
+    histograms = report['histograms']
+    assert histograms['lag']['count'] == 1
+    assert 0.45 <= histograms['lag']['p50'] < 1
+    assert histograms['decode']['count'] == 2
+    assert histograms['plugin Collect']['count'] == 2
+
+
+if __name__ == '__main__':
+    test_buckets()
+    test_counters_and_gauges()
+    test_label_from_task()
+    test_histograms()
+    test_aggregator()
+    test_flush()
+    test_metrics_without_timings()
+    test_fork()
+    test_ingest_stats()
+    test_receive()
@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+
+import zmq
+
+from distlog.logger.formatters import JSONFormatter, MsgPackFormatter
+from distlog.logger.handler import ZmqHandler
+from distlogd import codec
+from distlogd.relay import Relay
+
+
+def make_record(msg):
+    return logging.LogRecord('name', 20, '/here/and/nowhere/else.py', 50,
+                             msg, (), None)
+
+
+def test_relay():
+    ctx = zmq.Context()
+    sink = ctx.socket(zmq.PULL)
+    port = sink.bind_to_random_port('tcp://127.0.0.1')
+    relay = Relay('tcp://127.0.0.1:{}'.format(port), 'inproc://relay', ctx,
+                  batch_interval=20, compress_threshold=100)
+    thread = threading.Thread(target=relay.run)
+    thread.start()
+
+    plain = ZmqHandler('inproc://relay', ctx)
+    plain.setFormatter(JSONFormatter())
+    batched = ZmqHandler('inproc://relay', ctx, batch_size=5, compression=1,
+                         compress_threshold=0, intern=True)
+    batched.setFormatter(JSONFormatter())
+    packed = ZmqHandler('inproc://relay', ctx, stamp=True)
+    packed.setFormatter(MsgPackFormatter())
+    for i in range(10):
+        plain.emit(make_record('plain %d' % i))
+        batched.emit(make_record('batched %d' % i))
+        packed.emit(make_record('packed %d' % i))
+    batched.close()
+    # an unknown flag is passed on as is
+    plain.socket.send_multipart([b'PLJX', b'opaque'])
+
+    topics = set()
+    records = []
+    opaque = None
+    while len(records) < 30 or opaque is None:
+        frames = sink.recv_multipart()
+        topic, body = frames[:2]
+        topics.add(topic)
+        # the stamps of the producers are kept
+        assert (codec.sent_at(frames) is not None) == topic.startswith(b'PLM')
+        if topic == b'PLJX':
+            opaque = body
+        else:
+            records.extend(codec.decode(topic, body))
+    relay.stop()
+    thread.join()
+
+    assert opaque == b'opaque'
+    assert topics <= set([b'PLJBZ', b'PLJDBZ', b'PLMBZ', b'PLJX'])
+    for name in ('plain', 'batched', 'packed'):
+        messages = [r['message'] for r in records
+                    if r['message'].startswith(name)]
+        assert messages == ['%s %d' % (name, i) for i in range(10)]
+    assert relay.sent < relay.received
+
+    for handler in (plain, batched, packed):
+        handler.socket.close()
+    relay.close()
+    sink.close()
+    ctx.term()
+
+
+def test_bad_messages():
+    ctx = zmq.Context()
+    sink = ctx.socket(zmq.PULL)
+    port = sink.bind_to_random_port('tcp://127.0.0.1')
+    relay = Relay('tcp://127.0.0.1:{}'.format(port), 'inproc://relay', ctx,
+                  batch_interval=20)
+    thread = threading.Thread(target=relay.run)
+    thread.start()
+
+    producer = ctx.socket(zmq.PUSH)
+    producer.connect('inproc://relay')
+    producer.send_multipart([b'PLJ'])
+    producer.send_multipart([b'PLJ', b'{}', b'x', b'y'])
+    producer.send_multipart([b'PLJZ', b'not compressed'])
+    producer.send_multipart([b'PLJ', b'{"message": "still here"}'])
+    producer.send_multipart([b'PLJB', b'\x00\x00\x00\x09{"a": 1}'])
+    producer.send_multipart([b'PLJ', b'{"message": "and here"}'])
+
+    messages = [sink.recv_multipart() for _ in range(3)]
+    relay.stop()
+    thread.join()
+
+    assert messages[:2] == [[b'PLJ'], [b'PLJ', b'{}', b'x', b'y']]
+    topic, body = messages[2]
+    assert [r['message'] for r in codec.decode(topic, body)] == \
+        ['still here', 'and here']
+    assert relay.received == 6
+    assert relay.dropped == 2
+
+    producer.close()
+    relay.close()
+    sink.close()
+    ctx.term()
+
+
+if __name__ == '__main__':
+    test_relay()
+    test_bad_messages()
@@ -0,0 +1,101 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+
+import pytest
+import six
+
+import distlog
+from distlog.logger import packer, serializers
+from distlog.logger.handler import FrameBuffer
+from distlogd import codec
+
+
+def test_registry():
+    assert [e.letter for e in serializers.encodings()] == ['J', 'M', 'P']
+    assert serializers.get_encoding('J') is serializers.get_encoding(b'J')
+    with pytest.raises(KeyError):
+        serializers.get_encoding('X')
+    with pytest.raises(ValueError):
+        serializers.register_encoding('xy', 'bad', str)
+
+
+def test_json_backends():
+    available = serializers.available_json_backends()
+    assert available[-1] == 'json'
+    assert serializers.json_backend == available[0]
+    data = {'a': [1, 2.5, None], 'b': u'€', 'big': 2 ** 70, 3: object}
+    try:
+        for name in available:
+            assert serializers.use_json_backend(name) == name
+            encoded = serializers.get_encoding('J').encode(data)
+            assert isinstance(encoded, bytes)
+            decoded = codec.decode(b'PLJ', encoded)[0]
+            assert decoded['a'] == [1, 2.5, None]
+            assert decoded['b'] == u'€'
+            assert decoded['big'] == 2 ** 70
+            assert decoded['3'] == str(object)
+        with pytest.raises(ValueError):
+            serializers.use_json_backend('yaml')
+    finally:
+        serializers.use_json_backend()
+
+
+def test_json_formatter_produces_text():
+    record = logging.LogRecord('name', logging.INFO, '/a/b.py', 1,
+                               'hi %s', (u'€',), None)
+    stream = six.StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(distlog.JSONFormatter())
+    try:
+        for name in serializers.available_json_backends():
+            serializers.use_json_backend(name)
+            handler.emit(record)
+    finally:
+        serializers.use_json_backend()
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == len(serializers.available_json_backends())
+    assert all(json.loads(line)['message'] == u'hi €' for line in lines)
+
+
+def test_serialize_into():
+    record = logging.LogRecord('name', logging.INFO, '/a/b.py', 1,
+                               'hi %s', (u'€',), None)
+    for fmt in (distlog.JSONFormatter(), distlog.MsgPackFormatter()):
+        data = fmt._extract_record(record)
+        frame = FrameBuffer(16)
+        frame.write(b'head')
+        fmt.serialize_into(data, frame)
+        assert bytes(frame.view()) == b'head' + fmt.serialize(data)
+    frame = FrameBuffer(16)
+    packer.pack_into(data, frame)
+    assert bytes(frame.view()) == packer.packb(data)
+
+
+def test_custom_encoding():
+    serializers.register_encoding(
+        'X', 'reversed json',
+        lambda data: json.dumps(data)[::-1].encode('utf-8'),
+        lambda body: json.loads(body.decode('utf-8')[::-1]))
+
+    class ReversedFormatter(distlog.logger.formatters.Serializer):
+        encoding = 'X'
+
+    try:
+        record = logging.LogRecord('name', logging.INFO, '/a/b.py', 1,
+                                   'hi %s', ('there',), None)
+        body = ReversedFormatter().format(record)
+        assert codec.decode(b'PLX', body)[0]['message'] == 'hi there'
+    finally:
+        for key in (u'X', b'X'):
+            del serializers._encodings[key]
+
+
+if __name__ == '__main__':
+    test_registry()
+    test_json_backends()
+    test_json_formatter_produces_text()
+    test_serialize_into()
+    test_custom_encoding()
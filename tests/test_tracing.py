@@ -0,0 +1,128 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import functools
+import logging
+
+import pytest
+
+from distlog import traced
+from distlog.logger import context
+
+
+records = []
+
+class Collect(logging.Handler):
+    def emit(self, record):
+        records.append(record)
+
+
+def listening(test):
+    """Run a test with a clean task stack and a collecting root handler."""
+    @functools.wraps(test)
+    def wrapper():
+        root = logging.getLogger()
+        saved = root.handlers, root.level
+        tasks = []
+        while context._context.top is not None:
+            tasks.append(context._context.pop())
+        del records[:]
+        root.handlers = [Collect()]
+        root.setLevel(logging.INFO)
+        try:
+            test()
+        finally:
+            root.handlers = saved[0]
+            root.setLevel(saved[1])
+            while context._context.top is not None:
+                context._context.pop()
+            for tsk in reversed(tasks):
+                context._context.push(tsk)
+    return wrapper
+
+
+@traced('adding %s', 'numbers', op='add')
+def add(a, b):
+    return a + b, context._context.top.id
+
+
+@traced
+def fail():
+    raise ValueError('failed')
+
+
+@listening
+def test_traced_function():
+    with context.Task('t', 'outer'):
+        assert add(1, 2) == (3, 't/1')
+        assert add(2, 3) == (5, 't/2')
+        with pytest.raises(ValueError):
+            fail()
+    assert add.__name__ == 'add'
+    messages = [r.getMessage() for r in records]
+    assert messages == ['outer', 'adding numbers', 'adding numbers',
+                        'adding numbers', 'adding numbers', 'fail',
+                        'FAILED fail', 'outer']
+    assert records[1].context['op'] == 'add'
+    assert records[6].exc_info[0] is ValueError
+    # the messages of the task are attributed to the caller
+    assert set(r.funcName for r in records) == set(['test_traced_function'])
+
+
+@listening
+def test_traced_toplevel():
+    value, task_id = add(1, 1)
+    assert len(str(task_id)) == 36
+    assert context._context.top is None
+
+
+@traced('counting')
+def count(n):
+    for i in range(n):
+        received = yield i, context._context.top.id
+        if received:
+            return received
+    return 'done'
+
+
+@listening
+def test_traced_generator():
+    with context.Task('t', 'outer'):
+        gen = count(3)
+        with context.to('elsewhere'):
+            # the generator stays a child of the task that created it
+            assert next(gen) == (0, 't/1')
+            assert context._context.top.id == 't/2'
+        assert next(gen) == (1, 't/1')
+        assert context._context.top.id == 't'
+        assert list(gen) == [(2, 't/1')]
+
+        def delegate():
+            result = yield from count(5)
+            return result
+        gen = delegate()
+        next(gen)
+        with pytest.raises(StopIteration) as stop:
+            gen.send('stopped')
+        assert stop.value.value == 'stopped'
+
+        gen = count(5)
+        next(gen)
+        gen.close()
+        assert context._context.top.id == 't'
+
+        with context.to('a') as a:
+            path = a.id
+            gen = count(1)
+        # the task that created the generator has ended
+        assert next(gen) == (0, path + '/1')
+        assert path.startswith('t/')
+    messages = [r.getMessage() for r in records]
+    assert messages.count('counting') == 7
+    assert not [m for m in messages if m.startswith('FAILED')]
+
+
+if __name__ == '__main__':
+    test_traced_function()
+    test_traced_toplevel()
+    test_traced_generator()
@@ -0,0 +1,35 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import sys
+
+import pytest
+
+from distlog import traced
+from distlog.logger import context
+from test_tracing import listening, records
+
+pytestmark = pytest.mark.skipif(
+    sys.version_info < (3, 7), reason='asyncio.run needs Python 3.7'
+)
+
+
+@traced('waiting %s', 'a while')
+async def wait(delay):
+    await asyncio.sleep(delay)
+    return context._context.top.id
+
+
+@listening
+def test_traced_coroutine():
+    async def main():
+        with context.Task('t', 'outer'):
+            return await asyncio.gather(wait(0.01), wait(0))
+
+    assert asyncio.run(main()) == ['t/1', 't/2']
+    assert [r.getMessage() for r in records].count('waiting a while') == 4
+
+
+if __name__ == '__main__':
+    test_traced_coroutine()